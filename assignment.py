@@ -0,0 +1,265 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+import scipy.sparse as sp
+
+from assignment_backends import AssignmentBackend, get_backend
+from capacity_ledger import PAID_HOURS_PER_DAY, CapacityLedger, get_capacity_ledger
+from instrumentation import timed
+from reference_data import ReferenceData, ReferenceStore, get_reference_store
+
+MAX_RETRIES = 3
+
+
+def cost_matrix(ad_score: np.ndarray, confidence: np.ndarray, data: ReferenceData) -> np.ndarray:
+    """
+    Matching cost of every ad against every moderator
+
+    :param ad_score: (n_ads,) ad priority scores
+    :param confidence: (n_ads,) violation confidence of each ad
+    :param data: reference snapshot holding the moderator attributes
+    :return: (n_ads, n_moderators) cost matrix
+    """
+    ad_score = np.asarray(ad_score, dtype=np.float64)[:, None]
+    confidence = np.asarray(confidence, dtype=np.float64)[:, None]
+    return np.abs(0.5 * (ad_score - data.moderator_score)
+                  + 0.5 * (confidence - data.normalized_productivity + data.normalized_accuracy))
+
+
+def eligibility_matrix(markets: list, remaining: np.ndarray, data: ReferenceData) -> sp.csr_matrix:
+    """
+    Sparse mask of the (ad, moderator) pairs that may be matched
+
+    :param markets: delivery market of each ad
+    :param remaining: (n_moderators,) remaining tasks today
+    :param data: reference snapshot holding the market index
+    :return: (n_ads, n_moderators) boolean CSR matrix, True where the moderator covers the ad's market and has capacity
+    """
+    available = remaining > 0
+    cols = [rows[available[rows]] for rows in (data.matching_moderators(market) for market in markets)]
+    indptr = np.zeros(len(markets) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(c) for c in cols])
+    indices = np.concatenate(cols) if cols else np.empty(0, dtype=np.intp)
+    values = np.ones(len(indices), dtype=bool)
+    return sp.csr_matrix((values, indices, indptr), shape=(len(markets), len(data)))
+
+
+def solve_single(cost: np.ndarray, candidates: np.ndarray) -> int:
+    """
+    Best moderator for a single ad
+
+    :param cost: (n_moderators,) matching cost of the ad
+    :param candidates: moderator rows eligible for the ad
+    :return: chosen moderator row, or -1 if there are no candidates
+    """
+    if len(candidates) == 0:
+        return -1
+    return int(candidates[np.argmin(cost[candidates])])
+
+
+class NoCapacityError(Exception):
+    """No moderator covering an ad's market has capacity left today"""
+
+
+class _PendingAd:
+
+    def __init__(self, delivery_market: str, ad_score: float, confidence: float):
+        self.delivery_market = delivery_market
+        self.ad_score = ad_score
+        self.confidence = confidence
+        self.future = Future()
+        self.attempts = 0
+
+
+class AssignmentEngine:
+
+    def __init__(self, reference_store: ReferenceStore = None, ledger: CapacityLedger = None,
+                 backend: AssignmentBackend = None, max_batch_size: int = 64, max_wait_ms: float = 20.0):
+        """
+        Collects ads from concurrent requests into micro-batches and assigns them to moderators together
+
+        :param reference_store: source of the moderator table (default: process-wide store)
+        :param ledger: capacity ledger to consume assignments from (default: process-wide ledger)
+        :param backend: solver for batches of more than one ad (default: $ASSIGNMENT_BACKEND or "scipy")
+        :param max_batch_size: maximum number of ads solved together (default: 64)
+        :param max_wait_ms: how long the first ad of a batch waits for others to arrive (default: 20.0)
+        """
+        self.reference_store = reference_store or get_reference_store()
+        self.ledger = ledger or get_capacity_ledger()
+        self.backend = backend or get_backend()
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+
+        self._queue = queue.Queue()
+        # A submitted batch that did not fit in the previous micro-batch
+        self._carry = None
+        self._thread = None
+        self._stopped = False
+
+        self.batches = 0
+        self.ads = 0
+
+    def submit(self, delivery_market: str, ad_score: float, confidence: float) -> Future:
+        """
+        Queue an ad for assignment
+
+        :param delivery_market: the ad's delivery market
+        :param ad_score: the ad's priority score
+        :param confidence: the ad's violation confidence
+        :return: future resolving to the assignment dict
+        """
+        if self._thread is None:
+            self.start()
+        pending = _PendingAd(delivery_market, ad_score, confidence)
+        self._queue.put(pending)
+        return pending.future
+
+    def submit_batch(self, delivery_markets: list, ad_scores, confidences) -> list:
+        """
+        Queue several ads to be solved together, max_batch_size at a time, so one large batch does not hold up the
+        ads of concurrent requests for a single long solve
+
+        :param delivery_markets: delivery market of each ad
+        :param ad_scores: priority score of each ad
+        :param confidences: violation confidence of each ad
+        :return: one future per ad, in the same order
+        """
+        if len(delivery_markets) == 0:
+            return []
+        if self._thread is None:
+            self.start()
+        batch = [_PendingAd(market, float(ad_score), float(confidence))
+                 for market, ad_score, confidence in zip(delivery_markets, ad_scores, confidences)]
+        for start in range(0, len(batch), self.max_batch_size):
+            self._queue.put(batch[start:start + self.max_batch_size])
+        return [pending.future for pending in batch]
+
+    def assign(self, delivery_market: str, ad_score: float, confidence: float, timeout: float = None) -> dict:
+        return self.submit(delivery_market, ad_score, confidence).result(timeout)
+
+    def start(self) -> "AssignmentEngine":
+        if self._thread is None:
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, name="assignment-engine", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._stopped = True
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _collect(self) -> list:
+        first, self._carry = self._carry or self._queue.get(), None
+        if first is None:
+            return []
+        batch = first if isinstance(first, list) else [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                self._stopped = True
+                break
+            if isinstance(item, list):
+                # Submitted batches are never split; one that does not fit starts the next micro-batch
+                if len(batch) + len(item) > self.max_batch_size:
+                    self._carry = item
+                    break
+                batch.extend(item)
+            else:
+                batch.append(item)
+        return batch
+
+    def _run(self):
+        while not self._stopped:
+            batch = self._collect()
+            if not batch:
+                continue
+            try:
+                self._assign(batch)
+            except Exception as e:
+                for pending in batch:
+                    if not pending.future.done():
+                        pending.future.set_exception(e)
+
+    def _assign(self, batch: list):
+        data = self.reference_store.data
+        remaining = self.ledger.remaining_array(data)
+        self.batches += 1
+        self.ads += len(batch)
+
+        markets = [p.delivery_market for p in batch]
+        cost = cost_matrix([p.ad_score for p in batch], [p.confidence for p in batch], data)
+        eligible = eligibility_matrix(markets, remaining, data)
+
+        with timed("solver"):
+            if len(batch) == 1:
+                choice = np.array([solve_single(cost[0], eligible.indices)])
+            else:
+                choice = self.backend.solve(cost, eligible, remaining)
+
+        retry = []
+        for pending, row in zip(batch, choice):
+            if row < 0:
+                pending.future.set_exception(
+                    NoCapacityError(f"Error: No moderator with remaining capacity for market {pending.delivery_market}."))
+                continue
+            capacity = self.ledger.consume(data.moderator[row], data.handling_time[row])
+            if capacity is None:
+                # Another worker took the last slot between our read and the write
+                pending.attempts += 1
+                if pending.attempts < MAX_RETRIES:
+                    retry.append(pending)
+                else:
+                    pending.future.set_exception(NoCapacityError("Error: Could not reserve moderator capacity."))
+                continue
+            remaining_tasks_today, new_utilisation = capacity
+            pending.future.set_result({
+                "moderator": data.moderator[row].item(),
+                "market": data.market[row],
+                "moderator_score": data.moderator_score[row].item(),
+                "normalized_productivity": data.normalized_productivity[row].item(),
+                "normalized_accuracy": data.normalized_accuracy[row].item(),
+                "remaining_tasks_today": remaining_tasks_today,
+                "new_utilisation": new_utilisation,
+                "increase_in_utilisation": data.handling_time[row].item() / (PAID_HOURS_PER_DAY * 60 * 60 * 1000)
+            })
+
+        for pending in retry:
+            self._queue.put(pending)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "ads": self.ads,
+            "mean_batch_size": self.ads / self.batches if self.batches else 0.0,
+            "backend": self.backend.name,
+            "queue_depth": self._queue.qsize()
+        }
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_assignment_engine() -> AssignmentEngine:
+    """
+    Get the process-wide assignment engine, starting it on first use
+    """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = AssignmentEngine().start()
+    return _engine
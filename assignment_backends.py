@@ -0,0 +1,149 @@
+import os
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import min_weight_full_bipartite_matching
+
+# Per-ad reward for being assigned at all; larger than any matching cost so the
+# solver fills as many ads as capacity allows before optimising the match quality
+ASSIGNMENT_REWARD = 10.0
+DEFAULT_BACKEND = os.environ.get("ASSIGNMENT_BACKEND", "scipy")
+
+
+class AssignmentBackend:
+    """
+    Solves a batch of ads against the moderators they are eligible for
+    """
+
+    name = None
+
+    def solve(self, cost: np.ndarray, eligible: sp.csr_matrix, remaining: np.ndarray) -> np.ndarray:
+        """
+        Jointly assign a batch of ads to moderators under capacity constraints
+
+        :param cost: (n_ads, n_moderators) matching cost
+        :param eligible: (n_ads, n_moderators) sparse eligibility mask
+        :param remaining: (n_moderators,) remaining tasks today
+        :return: (n_ads,) chosen moderator row per ad, -1 where no moderator could take the ad
+        """
+        raise NotImplementedError
+
+
+class ScipyBackend(AssignmentBackend):
+    """
+    Solver-free backend: min-cost bipartite matching with each moderator expanded into one slot per remaining task
+    """
+
+    name = "scipy"
+
+    def solve(self, cost: np.ndarray, eligible: sp.csr_matrix, remaining: np.ndarray) -> np.ndarray:
+        n_ads, n_mods = eligible.shape
+        choice = np.full(n_ads, -1, dtype=np.int64)
+        eligible = eligible.tocsr()
+        if eligible.nnz == 0:
+            return choice
+
+        # A moderator never needs more slots than the ads in this batch that could go to them
+        demand = np.bincount(eligible.indices, minlength=n_mods)
+        slots = np.minimum(remaining, demand).astype(np.int64)
+        slot_start = np.zeros(n_mods + 1, dtype=np.int64)
+        slot_start[1:] = np.cumsum(slots)
+        n_slots = slot_start[-1]
+        slot_owner = np.repeat(np.arange(n_mods), slots)
+
+        # Expand every eligible (ad, moderator) pair into one edge per slot of that moderator
+        ad_rows = np.repeat(np.arange(n_ads), np.diff(eligible.indptr))
+        mod_rows = eligible.indices
+        keep = slots[mod_rows] > 0
+        ad_rows, mod_rows = ad_rows[keep], mod_rows[keep]
+        per_pair = slots[mod_rows]
+        edge_ads = np.repeat(ad_rows, per_pair)
+        offsets = np.arange(per_pair.sum()) - np.repeat(np.cumsum(per_pair) - per_pair, per_pair)
+        edge_slots = np.repeat(slot_start[mod_rows], per_pair) + offsets
+        edge_cost = np.repeat(cost[ad_rows, mod_rows], per_pair)
+
+        # One dummy slot per ad so a full matching always exists; weights are shifted by 1
+        # because the sparse matcher treats explicit zeros as missing edges
+        rows = np.concatenate([edge_ads, np.arange(n_ads)])
+        cols = np.concatenate([edge_slots, n_slots + np.arange(n_ads)])
+        weights = np.concatenate([edge_cost + 1.0, np.full(n_ads, 1.0 + ASSIGNMENT_REWARD)])
+        graph = sp.csr_matrix((weights, (rows, cols)), shape=(n_ads, n_slots + n_ads))
+
+        matched = min_weight_full_bipartite_matching(graph)[1]
+        assigned = matched < n_slots
+        choice[assigned] = slot_owner[matched[assigned]]
+        return choice
+
+
+class GurobiBackend(AssignmentBackend):
+    """
+    Exact MIP backend; requires gurobipy and a Gurobi license
+    """
+
+    name = "gurobi"
+
+    def __init__(self):
+        try:
+            import gurobipy
+        except ImportError as e:
+            raise ImportError("The gurobi assignment backend requires gurobipy, install it with "
+                              "`python -m pip install gurobipy`") from e
+        self.gp = gurobipy
+
+    def solve(self, cost: np.ndarray, eligible: sp.csr_matrix, remaining: np.ndarray) -> np.ndarray:
+        GRB = self.gp.GRB
+        n_ads, n_mods = eligible.shape
+        coo = eligible.tocoo()
+        ad_rows, mod_rows = coo.row, coo.col
+        n_pairs = len(ad_rows)
+        choice = np.full(n_ads, -1, dtype=np.int64)
+        if n_pairs == 0:
+            return choice
+
+        # One binary variable per eligible pair only; the market constraint is implied by the sparsity
+        pair = np.arange(n_pairs)
+        ad_constraints = sp.csr_matrix((np.ones(n_pairs), (ad_rows, pair)), shape=(n_ads, n_pairs))
+        mod_constraints = sp.csr_matrix((np.ones(n_pairs), (mod_rows, pair)), shape=(n_mods, n_pairs))
+
+        m = self.gp.Model("AdTaskAllocation")
+        m.Params.OutputFlag = 0
+        x = m.addMVar(n_pairs, vtype=GRB.BINARY, name="x")
+        m.setObjective((cost[ad_rows, mod_rows] - ASSIGNMENT_REWARD) @ x, GRB.MINIMIZE)
+        m.addMConstr(ad_constraints, x, GRB.LESS_EQUAL, np.ones(n_ads))
+        m.addMConstr(mod_constraints, x, GRB.LESS_EQUAL, remaining.astype(np.float64))
+        m.optimize()
+
+        chosen = x.X > 0.5
+        choice[ad_rows[chosen]] = mod_rows[chosen]
+        return choice
+
+
+BACKENDS = {
+    ScipyBackend.name: ScipyBackend,
+    GurobiBackend.name: GurobiBackend
+}
+
+
+def get_backend(name: str = None) -> AssignmentBackend:
+    """
+    Instantiate an assignment backend by name
+
+    :param name: one of BACKENDS (default: $ASSIGNMENT_BACKEND or "scipy")
+    :return: the backend instance
+    """
+    name = name or DEFAULT_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown assignment backend {name!r}, expected one of {sorted(BACKENDS)}")
+    return BACKENDS[name]()
+
+
+def objective(cost: np.ndarray, choice: np.ndarray) -> tuple:
+    """
+    Evaluate an assignment
+
+    :param cost: (n_ads, n_moderators) matching cost
+    :param choice: (n_ads,) chosen moderator row per ad, -1 for unassigned
+    :return: (total matching cost of assigned ads, number of assigned ads)
+    """
+    assigned = choice >= 0
+    return float(cost[np.flatnonzero(assigned), choice[assigned]].sum()), int(assigned.sum())
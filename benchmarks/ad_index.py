@@ -0,0 +1,129 @@
+"""
+Build time, insert latency, query latency and recall of the near-duplicate ad index
+
+    python benchmarks/ad_index.py --sizes 10000 100000 1000000 --nprobe 1 4 8 16 --output ad_index.json
+
+Synthetic ads are clustered unit vectors (one cluster per --ads-per-cluster ads, as campaigns re-cut the same
+footage); every query is a stored ad with a little noise added, like a re-encoded upload. Recall@1 is against
+an exhaustive search of the same rows.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from violations.ad_index import CHUNK_ROWS, AdIndex, normalize_rows
+
+LABELS = ["label_a", "label_b", "label_c"]
+
+
+def synthetic_ads(count: int, dim: int, ads_per_cluster: int, spread: float, seed: int = 0):
+    """Yield (vectors, label values) chunks of clustered unit vectors"""
+    rng = np.random.default_rng(seed)
+    centers = normalize_rows(rng.normal(size=(max(count // ads_per_cluster, 1), dim)))
+    for start in range(0, count, CHUNK_ROWS):
+        rows = min(CHUNK_ROWS, count - start)
+        vectors = centers[rng.integers(len(centers), size=rows)] + rng.normal(scale=spread / np.sqrt(dim), size=(rows, dim))
+        yield normalize_rows(vectors), rng.random((rows, len(LABELS)), dtype=np.float32)
+
+
+def exact_top1(index: AdIndex, queries: np.ndarray) -> np.ndarray:
+    """Most similar row of every query by exhaustive search"""
+    best = np.full(len(queries), -np.inf, dtype=np.float32)
+    rows = np.zeros(len(queries), dtype=np.int64)
+    for start in range(0, index.count, CHUNK_ROWS):
+        similarities = queries @ np.asarray(index.vectors[start:start + CHUNK_ROWS], dtype=np.float32).T
+        chunk_best = similarities.argmax(axis=1)
+        chunk_similarities = similarities[np.arange(len(queries)), chunk_best]
+        better = chunk_similarities > best
+        best[better], rows[better] = chunk_similarities[better], start + chunk_best[better]
+    return rows
+
+
+def percentile(values: list, q: float) -> float:
+    return float(np.percentile(values, q))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000], help="ads in the index")
+    parser.add_argument("--dim", type=int, default=512, help="embedding dimension (CLIP ViT-B/32: 512)")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--inserts", type=int, default=200, help="single-ad inserts timed after the build")
+    parser.add_argument("--ads-per-cluster", type=int, default=50)
+    parser.add_argument("--spread", type=float, default=1.0, help="distance of ads from their cluster centre")
+    parser.add_argument("--noise", type=float, default=0.1, help="distance of queries from the stored ad")
+    parser.add_argument("--directory", help="directory to build the indexes under (default: a temporary directory)")
+    parser.add_argument("--output", help="write results as JSON to this path")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'entries':>8} {'lists':>6} {'build_s':>8} {'train_s':>8} {'insert_p50_ms':>13} "
+          f"{'nprobe':>6} {'query_p50_ms':>12} {'query_p95_ms':>12} {'recall@1':>8}")
+    with tempfile.TemporaryDirectory(dir=args.directory) as tmp:
+        for size in args.sizes:
+            # Clustering is timed on its own, so the build only appends
+            index = AdIndex(os.path.join(tmp, str(size)), args.dim, LABELS, train_size=size + args.inserts + 1)
+            start = time.perf_counter()
+            for vectors, label_values in synthetic_ads(size, args.dim, args.ads_per_cluster, args.spread):
+                index.add_batch(vectors, label_values)
+            build_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            index.train()
+            train_seconds = time.perf_counter() - start
+
+            rng = np.random.default_rng(1)
+            insert_latencies = []
+            for vector in normalize_rows(rng.normal(size=(args.inserts, args.dim))):
+                start = time.perf_counter()
+                index.add(vector, rng.random(len(LABELS)))
+                insert_latencies.append(time.perf_counter() - start)
+
+            sources = rng.choice(index.count, size=args.queries, replace=False)
+            queries = normalize_rows(np.asarray(index.vectors[np.sort(sources)], dtype=np.float32)
+                                     + rng.normal(scale=args.noise / np.sqrt(args.dim), size=(args.queries, args.dim)))
+            expected = exact_top1(index, queries)
+
+            for nprobe in args.nprobe:
+                index.nprobe = nprobe
+                index.search(queries[0])  # sorts the inverted lists
+                latencies, found = [], []
+                for query in queries:
+                    start = time.perf_counter()
+                    rows, _ = index.search(query)
+                    latencies.append(time.perf_counter() - start)
+                    found.append(rows[0])
+                row = {
+                    "entries": index.count,
+                    "dim": args.dim,
+                    "lists": len(index.centroids),
+                    "build_seconds": build_seconds,
+                    "train_seconds": train_seconds,
+                    "insert_p50_ms": 1000 * statistics.median(insert_latencies),
+                    "nprobe": nprobe,
+                    "query_p50_ms": 1000 * statistics.median(latencies),
+                    "query_p95_ms": 1000 * percentile(latencies, 95),
+                    "recall_at_1": float(np.mean(np.array(found) == expected))
+                }
+                results.append(row)
+                print(f"{row['entries']:>8} {row['lists']:>6} {build_seconds:>8.1f} {train_seconds:>8.1f} "
+                      f"{row['insert_p50_ms']:>13.2f} {nprobe:>6} {row['query_p50_ms']:>12.2f} "
+                      f"{row['query_p95_ms']:>12.2f} {row['recall_at_1']:>8.3f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
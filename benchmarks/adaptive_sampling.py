@@ -0,0 +1,130 @@
+"""
+Frames embedded and latency of adaptive frame sampling against the fixed 10-frame baseline
+
+    python benchmarks/adaptive_sampling.py --kinds static pan cuts --seconds 15 --videos 4 --early-exit 0.9
+
+Synthetic ads of three kinds are scored with each sampling mode: "static" is one product shot with sensor
+noise, "pan" is a slowly scrolling scene and "cuts" changes scene every --cut-seconds. Labels are compared
+with the fixed baseline, including whether the same labels cross the 0.9 flag threshold.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from frame_sampling import write_video
+from violations.frame_sampler import AdaptiveSampler
+from violations.violation_checker import ViolationChecker
+
+FLAG_THRESHOLD = 0.9  # func.get_top_violations
+
+
+def write_ad(path: str, kind: str, seconds: float, width: int, height: int, fps: int, cut_seconds: float, seed: int):
+    """Write a synthetic ad of one of the kinds in the module docstring"""
+    if kind == "pan":
+        write_video(path, seconds, width, height, fps, seed=seed)
+        return
+    rng = np.random.default_rng(seed)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    scene = None
+    for i in range(int(seconds * fps)):
+        if scene is None or (kind == "cuts" and i % max(int(cut_seconds * fps), 1) == 0):
+            # Large blocks of colour, so scenes differ in the downscaled hash and not only in noise
+            blocks = rng.integers(0, 255, size=(6, 8, 3), dtype=np.uint8)
+            scene = cv2.resize(blocks, (width, height), interpolation=cv2.INTER_NEAREST)
+        noise = rng.normal(0, 4, size=scene.shape)
+        writer.write(np.clip(scene + noise, 0, 255).astype(np.uint8))
+    writer.release()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--kinds", nargs="+", default=["static", "pan", "cuts"])
+    parser.add_argument("--videos", type=int, default=4, help="videos per kind")
+    parser.add_argument("--seconds", type=float, default=15)
+    parser.add_argument("--resolution", default="640x360")
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--cut-seconds", type=float, default=0.5, help="scene length of the cuts kind")
+    parser.add_argument("--num-frames", type=int, default=10, help="frames of the fixed baseline")
+    parser.add_argument("--base-frames", type=int, default=16)
+    parser.add_argument("--max-frames", type=int, default=32)
+    parser.add_argument("--early-exit", type=float, default=FLAG_THRESHOLD, help="threshold of the early-exit mode")
+    parser.add_argument("--repeats", type=int, default=3, help="timed runs per video, best of")
+    parser.add_argument("--snapshot-dir", help="model snapshot to load, e.g. from benchmarks/stub_models.py")
+    parser.add_argument("--output", help="write results as JSON to this path")
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.resolution.split("x"))
+    checker = ViolationChecker(config_path = os.path.join(ROOT, "violations", "config.yaml"),
+                               cache_dir = tempfile.mkdtemp(prefix="sampling-bench-"),
+                               snapshot_dir = args.snapshot_dir)
+    checker.warm_up()
+    adaptive = AdaptiveSampler(base_frames = args.base_frames, max_frames = args.max_frames, stats = checker.sampling_stats)
+    modes = {
+        "fixed": (None, None),
+        "adaptive": (adaptive, None),
+        "adaptive+exit": (adaptive, args.early_exit)
+    }
+
+    def score(path: str, sampler, early_exit) -> tuple:
+        checker.sampler, checker.early_exit = sampler, early_exit
+        before = checker.sampling_stats.snapshot()
+        start = time.perf_counter()
+        labels = checker.get_violation_labels_from_frames(checker.select_frames(path, args.num_frames))
+        seconds = time.perf_counter() - start
+        after = checker.sampling_stats.snapshot()
+        return (seconds, np.array(list(labels.values())), after["frames_decoded"] - before["frames_decoded"],
+                after["frames_embedded"] - before["frames_embedded"])
+
+    results = []
+    print(f"{'kind':<7} {'mode':<14} {'decoded':>7} {'embedded':>8} {'p50_ms':>8} {'speedup':>7} {'max_label_diff':>14} {'flags_agree':>11}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for kind in args.kinds:
+            paths = []
+            for seed in range(args.videos):
+                path = os.path.join(tmp, f"{kind}_{seed}.mp4")
+                write_ad(path, kind, args.seconds, width, height, args.fps, args.cut_seconds, seed)
+                paths.append(path)
+
+            baseline = None
+            for mode, (sampler, early_exit) in modes.items():
+                runs = [min((score(path, sampler, early_exit) for _ in range(args.repeats)), key=lambda run: run[0])
+                        for path in paths]
+                latencies = [run[0] for run in runs]
+                labels = np.stack([run[1] for run in runs])
+                if baseline is None:
+                    baseline = (labels, statistics.median(latencies))
+                flags_agree = float(np.mean(np.all((labels >= FLAG_THRESHOLD) == (baseline[0] >= FLAG_THRESHOLD), axis=1)))
+                row = {
+                    "kind": kind,
+                    "mode": mode,
+                    "videos": len(paths),
+                    "mean_frames_decoded": statistics.mean(run[2] for run in runs),
+                    "mean_frames_embedded": statistics.mean(run[3] for run in runs),
+                    "p50_ms": 1000 * statistics.median(latencies),
+                    "mean_ms": 1000 * statistics.mean(latencies),
+                    "speedup": baseline[1] / statistics.median(latencies),
+                    "max_label_diff": float(np.abs(labels - baseline[0]).max()),
+                    "flags_agree": flags_agree
+                }
+                results.append(row)
+                print(f"{kind:<7} {mode:<14} {row['mean_frames_decoded']:>7.1f} {row['mean_frames_embedded']:>8.1f} "
+                      f"{row['p50_ms']:>8.1f} {row['speedup']:>7.2f} {row['max_label_diff']:>14.4f} {flags_agree:>11.2f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Compare assignment backends on synthetic batches of ads against the moderator table
+
+    python benchmarks/assignment_backends.py --sizes 1 10 100 1000 10000 --backends scipy gurobi
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from assignment import cost_matrix, eligibility_matrix
+from assignment_backends import get_backend, objective
+from reference_data import MODERATOR_DATA_PATH, ST_COMBINATIONS_PATH, ReferenceData
+
+
+def synthetic_batch(data: ReferenceData, n_ads: int, rng: np.random.Generator) -> tuple:
+    """
+    Draw ads whose markets follow the moderator coverage of each market
+
+    :param data: reference snapshot
+    :param n_ads: number of ads in the batch
+    :param rng: random generator
+    :return: (markets, ad_score, confidence)
+    """
+    markets = np.array(sorted(data.market_index))
+    weights = np.array([len(data.market_index[m]) for m in markets], dtype=np.float64)
+    chosen = rng.choice(markets, size=n_ads, p=weights / weights.sum())
+    return chosen.tolist(), rng.random(n_ads), rng.random(n_ads)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 100, 1000, 10000])
+    parser.add_argument("--backends", nargs="+", default=["scipy", "gurobi"])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write results as JSON to this path")
+    args = parser.parse_args()
+
+    data = ReferenceData(ST_COMBINATIONS_PATH, MODERATOR_DATA_PATH)
+    remaining = np.floor(data.max_tasks_per_day).astype(np.int64)
+    rng = np.random.default_rng(args.seed)
+
+    backends = {}
+    for name in args.backends:
+        try:
+            backends[name] = get_backend(name)
+        except ImportError as e:
+            print(f"skipping {name}: {e}")
+
+    results = []
+    print(f"{'backend':<8} {'ads':>6} {'solve_s':>10} {'objective':>12} {'assigned':>9}")
+    for n_ads in args.sizes:
+        markets, ad_score, confidence = synthetic_batch(data, n_ads, rng)
+        cost = cost_matrix(ad_score, confidence, data)
+        eligible = eligibility_matrix(markets, remaining, data)
+        for name, backend in backends.items():
+            timings = []
+            try:
+                for _ in range(args.repeats):
+                    start = time.perf_counter()
+                    choice = backend.solve(cost, eligible, remaining)
+                    timings.append(time.perf_counter() - start)
+            except Exception as e:
+                # e.g. the size-limited Gurobi license refusing large models
+                print(f"{name:<8} {n_ads:>6} failed: {e}")
+                continue
+            total, assigned = objective(cost, choice)
+            row = {"backend": name, "ads": n_ads, "solve_seconds": min(timings),
+                   "objective": total, "assigned": assigned}
+            results.append(row)
+            print(f"{name:<8} {n_ads:>6} {row['solve_seconds']:>10.4f} {total:>12.4f} {assigned:>9}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
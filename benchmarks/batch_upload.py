@@ -0,0 +1,162 @@
+"""
+Throughput of /upload/batch against the same ads posted one by one to /upload
+
+    python benchmarks/batch_upload.py --stub-models --batch-sizes 8 32 --videos 5x640x360
+
+For every batch size N a fresh serve.py (empty result cache and capacity ledger) scores N distinct synthetic
+ads with N sequential /upload calls, and another fresh server scores the same N ads in one /upload/batch
+request. Warm-up ads are posted to both first, so neither run pays for the first encoder call.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from end_to_end import DEFAULT_FILE_NAME, git_commit, post_upload
+from serving_memory import wait_ready
+from synthetic_data import upload_forms, write_moderator_table, write_videos
+
+
+def multipart_batch(forms: list, paths: list) -> tuple:
+    """
+    Encode a /upload/batch request: every form field and videoFile repeated once per ad, in order
+
+    :return: body and content type
+    """
+    boundary = uuid.uuid4().hex
+    parts = []
+    for form in forms:
+        for name, value in form.items():
+            parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for path in paths:
+        with open(path, "rb") as f:
+            data = f.read()
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{DEFAULT_FILE_NAME}"; '
+                     f'filename="{os.path.basename(path)}"\r\nContent-Type: video/mp4\r\n\r\n'.encode() + data + b"\r\n")
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+def post_batch(url: str, forms: list, paths: list, timeout: float) -> dict:
+    body, content_type = multipart_batch(forms, paths)
+    request = urllib.request.Request(url, data=body, headers={"Content-Type": content_type}, method="POST")
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            results = json.loads(response.read())["results"]
+            status, errors = response.status, [r["error"] for r in results if "error" in r]
+    except urllib.error.HTTPError as e:
+        status, errors = e.code, [e.read().decode(errors="replace")[:200]]
+    except OSError as e:
+        status, errors = None, [str(e)]
+    return {"seconds": time.perf_counter() - start, "status": status, "errors": errors}
+
+
+def run_mode(args, env: dict, mode: str, videos: list, forms: list) -> dict:
+    """
+    Start a server, warm it up and score the ads sequentially or as one batch
+
+    :param mode: "sequential" or "batch"
+    :param videos: --warmup warm-up videos followed by the timed ones
+    :param forms: form fields, one per video
+    :return: wall time, ads scored and errors
+    """
+    base_url = f"http://127.0.0.1:{args.port}"
+    scratch = tempfile.mkdtemp(prefix="batch-bench-")
+    env = dict(env, CAPACITY_LEDGER_PATH=os.path.join(scratch, "capacity_ledger.db"),
+               VIOLATION_CACHE_DIR=os.path.join(scratch, "cache"))
+    log = open(os.path.join(scratch, "server.log"), "w")
+    server = subprocess.Popen([sys.executable, "serve.py", "--workers", "1", "--port", str(args.port),
+                               "--threads", str(args.threads)], cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        wait_ready(f"{base_url}/ready", args.timeout)
+        warmup, timed = (videos[:args.warmup], forms[:args.warmup]), (videos[args.warmup:], forms[args.warmup:])
+        if mode == "batch":
+            post_batch(f"{base_url}/upload/batch", warmup[1], warmup[0], args.timeout)
+            start = time.perf_counter()
+            response = post_batch(f"{base_url}/upload/batch", timed[1], timed[0], args.timeout)
+            wall = time.perf_counter() - start
+            errors = response["errors"] if response["status"] == 200 else response["errors"] * len(timed[0])
+        else:
+            for path, form in zip(*warmup):
+                post_upload(f"{base_url}/upload", form, path, args.timeout)
+            start = time.perf_counter()
+            responses = [post_upload(f"{base_url}/upload", form, path, args.timeout) for path, form in zip(*timed)]
+            wall = time.perf_counter() - start
+            errors = [r["error"] for r in responses if r["status"] != 200]
+    finally:
+        server.terminate()
+        server.wait()
+        log.close()
+    return {"wall_seconds": wall, "ads": len(timed[0]), "errors": len(errors),
+            "first_error": errors[0] if errors else None, "server_log": log.name}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[8, 32], help="ads per batch")
+    parser.add_argument("--videos", default="5x640x360", help="<seconds>x<width>x<height> of the videos")
+    parser.add_argument("--warmup", type=int, default=2, help="untimed ads before each run")
+    parser.add_argument("--moderators", type=int, default=10000, help="synthetic moderator table size")
+    parser.add_argument("--threads", type=int, default=1, help="encoder intra-op threads")
+    parser.add_argument("--stub-models", action="store_true", help="use tiny random models instead of the real ones")
+    parser.add_argument("--snapshot-dir", help="model snapshot to serve (default: $MODEL_SNAPSHOT_DIR, else the hub)")
+    parser.add_argument("--data-dir", help="where to keep the synthetic data between runs (default: a temporary directory)")
+    parser.add_argument("--port", type=int, default=5057)
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--output", help="write results as JSON to this path")
+    args = parser.parse_args()
+
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="batch-data-")
+    env = dict(os.environ, LOG_LEVEL=os.environ.get("LOG_LEVEL", "WARNING"))
+    if args.stub_models:
+        from stub_models import write_stub_snapshot
+
+        env["MODEL_SNAPSHOT_DIR"] = os.path.join(data_dir, "stub-models")
+        if not os.path.exists(env["MODEL_SNAPSHOT_DIR"]):
+            write_stub_snapshot(env["MODEL_SNAPSHOT_DIR"])
+    elif args.snapshot_dir:
+        env["MODEL_SNAPSHOT_DIR"] = args.snapshot_dir
+
+    moderators_path = os.path.join(data_dir, f"moderators_{args.moderators}.parquet")
+    if not os.path.exists(moderators_path):
+        write_moderator_table(moderators_path, args.moderators)
+    env["MODERATOR_DATA_PATH"] = moderators_path
+
+    results = {"created": time.time(), "commit": git_commit(), "models": env.get("MODEL_SNAPSHOT_DIR") or "hub",
+               "video": args.videos, "runs": []}
+    print(f"{'ads':>5} {'sequential_ads_s':>16} {'batch_ads_s':>11} {'speedup':>7} {'errors':>6}")
+    for size in args.batch_sizes:
+        videos = write_videos(os.path.join(data_dir, "videos"), args.videos, args.warmup + size)
+        forms = upload_forms(args.warmup + size)
+        sequential = run_mode(args, env, "sequential", videos, forms)
+        batch = run_mode(args, env, "batch", videos, forms)
+        row = {
+            "ads": size,
+            "sequential": sequential,
+            "batch": batch,
+            "sequential_ads_per_second": size / sequential["wall_seconds"],
+            "batch_ads_per_second": size / batch["wall_seconds"],
+            "speedup": sequential["wall_seconds"] / batch["wall_seconds"]
+        }
+        results["runs"].append(row)
+        print(f"{size:>5} {row['sequential_ads_per_second']:>16.2f} {row['batch_ads_per_second']:>11.2f} "
+              f"{row['speedup']:>7.2f} {sequential['errors'] + batch['errors']:>6}", flush=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
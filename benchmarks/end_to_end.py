@@ -0,0 +1,309 @@
+"""
+End-to-end latency and throughput of /upload under concurrent load, with per-stage latencies
+
+    python benchmarks/end_to_end.py --stub-models --moderators 10000 100000 --videos 5x640x360 --concurrency 1 4 16
+
+Every scenario (moderator table size x video set x concurrency) starts serve.py with an empty result cache
+and capacity ledger, posts --requests distinct synthetic videos from --concurrency clients and reads the
+per-stage latencies from /metrics. --stub-models swaps in tiny randomly initialized models so the suite runs
+offline; the encoder stages then say nothing about the real models but everything around them is real.
+
+Results saved with --output can be compared with a later run (e.g. on another commit) with --compare.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from instrumentation import STAGES
+from serving_memory import wait_ready
+from synthetic_data import upload_forms, write_moderator_table, write_videos
+
+DEFAULT_FILE_NAME = "videoFile"
+
+
+def multipart(fields: dict, filename: str, data: bytes) -> tuple:
+    """
+    Encode an /upload form as multipart/form-data
+
+    :return: body and content type
+    """
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{DEFAULT_FILE_NAME}"; filename="{filename}"\r\n'
+                 f'Content-Type: video/mp4\r\n\r\n'.encode() + data + b"\r\n")
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+def post_upload(url: str, form: dict, path: str, timeout: float) -> dict:
+    with open(path, "rb") as f:
+        body, content_type = multipart(form, os.path.basename(path), f.read())
+    request = urllib.request.Request(url, data=body, headers={"Content-Type": content_type}, method="POST")
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+            status, error = response.status, None
+    except urllib.error.HTTPError as e:
+        status, error = e.code, e.read().decode(errors="replace")[:200]
+    except OSError as e:
+        status, error = None, str(e)
+    return {"seconds": time.perf_counter() - start, "status": status, "error": error}
+
+
+def parse_metrics(text: str, name: str = "ad_moderation_stage_seconds") -> dict:
+    """
+    Read the stage histogram out of a /metrics scrape
+
+    :return: {stage: {"buckets": [(le, cumulative count)], "sum": seconds, "count": n}}
+    """
+    stages = {}
+    for line in text.splitlines():
+        if not line.startswith(name):
+            continue
+        series, value = line.rsplit(" ", 1)
+        labels = dict(pair.split("=", 1) for pair in series[series.index("{") + 1:-1].split(","))
+        stage = stages.setdefault(labels["stage"].strip('"'), {"buckets": [], "sum": 0.0, "count": 0})
+        if series.startswith(f"{name}_bucket"):
+            stage["buckets"].append((float(labels["le"].strip('"')), float(value)))
+        elif series.startswith(f"{name}_sum"):
+            stage["sum"] = float(value)
+        elif series.startswith(f"{name}_count"):
+            stage["count"] = int(float(value))
+    return stages
+
+
+def histogram_quantile(q: float, buckets: list) -> float:
+    """Quantile of a cumulative histogram, interpolating linearly within a bucket as Prometheus does"""
+    total = buckets[-1][1]
+    if total == 0:
+        return float("nan")
+    rank = q * total
+    lower, below = 0.0, 0.0
+    for le, cumulative in buckets:
+        if cumulative >= rank:
+            if le == float("inf"):
+                return lower
+            return lower + (le - lower) * (rank - below) / max(cumulative - below, 1e-12)
+        lower, below = le, cumulative
+    return lower
+
+
+def stage_latencies(before: dict, after: dict) -> dict:
+    """
+    Per-stage count, mean and quantiles of the observations made between two scrapes
+
+    The mean is exact; the quantiles are interpolated within the histogram buckets, so they are only as fine
+    as the buckets.
+    """
+    out = {}
+    for stage in STAGES:
+        if stage not in after:
+            continue
+        previous = before.get(stage, {"buckets": [], "sum": 0.0, "count": 0})
+        previous_buckets = dict(previous["buckets"])
+        buckets = [(le, count - previous_buckets.get(le, 0)) for le, count in after[stage]["buckets"]]
+        count = after[stage]["count"] - previous["count"]
+        if count == 0:
+            continue
+        out[stage] = {
+            "count": count,
+            "mean_ms": 1000 * (after[stage]["sum"] - previous["sum"]) / count,
+            "p50_ms": 1000 * histogram_quantile(0.5, buckets),
+            "p95_ms": 1000 * histogram_quantile(0.95, buckets)
+        }
+    return out
+
+
+def scrape(base_url: str) -> dict:
+    with urllib.request.urlopen(f"{base_url}/metrics", timeout=10) as response:
+        return parse_metrics(response.read().decode())
+
+
+def run_scenario(args, env: dict, moderators: int, moderators_path: str, video: str, videos: list, forms: list,
+                 concurrency: int) -> dict:
+    """
+    Start a server, warm it up, then time --requests uploads from concurrent clients
+
+    :param env: environment of the server
+    :param moderators: number of moderators in the table
+    :param moderators_path: moderator table the server loads
+    :param video: "<seconds>x<width>x<height>" of the videos
+    :param videos: distinct videos, --warmup for warm-up followed by --requests for the timed run
+    :param forms: form fields, one per video
+    :param concurrency: number of concurrent clients
+    :return: result row
+    """
+    base_url = f"http://127.0.0.1:{args.port}"
+    scratch = tempfile.mkdtemp(prefix="e2e-bench-")
+    env = dict(env, MODERATOR_DATA_PATH=moderators_path,
+               CAPACITY_LEDGER_PATH=os.path.join(scratch, "capacity_ledger.db"),
+               VIOLATION_CACHE_DIR=os.path.join(scratch, "cache"))
+    log = open(os.path.join(scratch, "server.log"), "w")
+    server = subprocess.Popen([sys.executable, "serve.py", "--workers", str(args.workers), "--port", str(args.port),
+                               "--threads", str(args.threads)], cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        wait_ready(f"{base_url}/ready", args.timeout)
+        url = f"{base_url}/upload"
+        for path, form in zip(videos[:args.warmup], forms):
+            post_upload(url, form, path, args.timeout)
+
+        before = scrape(base_url)
+        timed = list(zip(videos[args.warmup:], forms[args.warmup:]))
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            responses = list(pool.map(lambda job: post_upload(url, job[1], job[0], args.timeout), timed))
+        wall = time.perf_counter() - start
+        after = scrape(base_url)
+    finally:
+        server.terminate()
+        server.wait()
+        log.close()
+
+    latencies = [r["seconds"] for r in responses if r["status"] == 200]
+    errors = [r for r in responses if r["status"] != 200]
+    return {
+        "moderators": moderators,
+        "video": video,
+        "concurrency": concurrency,
+        "workers": args.workers,
+        "requests": len(responses),
+        "errors": len(errors),
+        "first_error": errors[0]["error"] if errors else None,
+        "server_log": log.name,
+        "throughput_rps": len(latencies) / wall,
+        "latency_ms": {
+            "mean": 1000 * float(np.mean(latencies)) if latencies else None,
+            "p50": 1000 * float(np.percentile(latencies, 50)) if latencies else None,
+            "p95": 1000 * float(np.percentile(latencies, 95)) if latencies else None,
+            "p99": 1000 * float(np.percentile(latencies, 99)) if latencies else None
+        },
+        "stages": stage_latencies(before, after)
+    }
+
+
+def scenario_key(row: dict) -> tuple:
+    return row["moderators"], row["video"], row["concurrency"], row["workers"]
+
+
+def compare(results: dict, baseline_path: str):
+    """Print throughput and latency of this run relative to an earlier --output"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    if baseline.get("models") != results["models"]:
+        print(f"warning: baseline ran with models {baseline.get('models')!r}, this run with {results['models']!r}")
+    previous = {scenario_key(row): row for row in baseline["scenarios"]}
+
+    print(f"\ncompared with {baseline_path} ({baseline.get('commit') or 'unknown commit'}):")
+    print(f"{'moderators':>10} {'video':>14} {'conc':>5} {'rps_ratio':>9} {'p50_ratio':>9} {'p95_ratio':>9}  slowest stage change")
+    for row in results["scenarios"]:
+        old = previous.get(scenario_key(row))
+        if old is None or not old["throughput_rps"] or old["latency_ms"]["p50"] is None or row["latency_ms"]["p50"] is None:
+            continue
+        changes = {stage: stats["mean_ms"] / old["stages"][stage]["mean_ms"]
+                   for stage, stats in row["stages"].items() if old["stages"].get(stage, {}).get("mean_ms")}
+        worst = max(changes, key=changes.get) if changes else None
+        print(f"{row['moderators']:>10} {row['video']:>14} {row['concurrency']:>5} "
+              f"{row['throughput_rps'] / old['throughput_rps']:>9.2f} "
+              f"{row['latency_ms']['p50'] / old['latency_ms']['p50']:>9.2f} "
+              f"{row['latency_ms']['p95'] / old['latency_ms']['p95']:>9.2f}  "
+              f"{f'{worst} x{changes[worst]:.2f}' if worst else ''}")
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--moderators", type=int, nargs="+", default=[10000, 100000], help="synthetic moderator table sizes")
+    parser.add_argument("--videos", nargs="+", default=["5x640x360", "15x1280x720"], help="<seconds>x<width>x<height> of each video set")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16], help="concurrent clients")
+    parser.add_argument("--requests", type=int, default=64, help="timed uploads per scenario")
+    parser.add_argument("--warmup", type=int, default=4, help="untimed uploads before each scenario")
+    parser.add_argument("--workers", type=int, default=1, help="serve.py worker processes; /metrics covers one worker")
+    parser.add_argument("--threads", type=int, default=1, help="encoder intra-op threads per worker")
+    parser.add_argument("--stub-models", action="store_true", help="use tiny random models instead of the real ones")
+    parser.add_argument("--snapshot-dir", help="model snapshot to serve (default: $MODEL_SNAPSHOT_DIR, else the hub)")
+    parser.add_argument("--data-dir", help="where to keep the synthetic data between runs (default: a temporary directory)")
+    parser.add_argument("--port", type=int, default=5056)
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--output", help="write results as JSON to this path")
+    parser.add_argument("--compare", help="earlier --output to compare this run with")
+    args = parser.parse_args()
+
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="e2e-data-")
+    env = dict(os.environ, LOG_LEVEL=os.environ.get("LOG_LEVEL", "WARNING"))
+    if args.stub_models:
+        from stub_models import write_stub_snapshot
+
+        snapshot_dir = os.path.join(data_dir, "stub-models")
+        if not os.path.exists(snapshot_dir):
+            write_stub_snapshot(snapshot_dir)
+        env["MODEL_SNAPSHOT_DIR"] = snapshot_dir
+        models = "stub"
+    elif args.snapshot_dir:
+        env["MODEL_SNAPSHOT_DIR"] = args.snapshot_dir
+        models = args.snapshot_dir
+    else:
+        models = env.get("MODEL_SNAPSHOT_DIR") or "hub"
+
+    uploads = args.warmup + args.requests
+    forms = upload_forms(uploads)
+    results = {
+        "created": time.time(),
+        "commit": git_commit(),
+        "models": models,
+        "environment": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "args": {k: v for k, v in vars(args).items() if k not in ("output", "compare", "data_dir", "port")},
+        "scenarios": []
+    }
+
+    print(f"{'moderators':>10} {'video':>14} {'conc':>5} {'rps':>7} {'p50_ms':>8} {'p95_ms':>8} {'p99_ms':>8} {'errors':>6}  "
+          + " ".join(f"{stage:>16}" for stage in STAGES))
+    for rows in args.moderators:
+        moderators_path = os.path.join(data_dir, f"moderators_{rows}.parquet")
+        if not os.path.exists(moderators_path):
+            write_moderator_table(moderators_path, rows)
+        for spec in args.videos:
+            videos = write_videos(os.path.join(data_dir, "videos"), spec, uploads)
+            for concurrency in args.concurrency:
+                row = run_scenario(args, env, rows, moderators_path, spec, videos, forms, concurrency)
+                results["scenarios"].append(row)
+                latency = row["latency_ms"]
+                print(f"{rows:>10} {spec:>14} {concurrency:>5} {row['throughput_rps']:>7.2f} "
+                      f"{latency['p50'] or float('nan'):>8.1f} {latency['p95'] or float('nan'):>8.1f} "
+                      f"{latency['p99'] or float('nan'):>8.1f} {row['errors']:>6}  "
+                      + " ".join(f"{row['stages'].get(stage, {}).get('mean_ms', float('nan')):>13.1f} ms" for stage in STAGES),
+                      flush=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
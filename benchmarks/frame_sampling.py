@@ -0,0 +1,101 @@
+"""
+Decode time of the seek-based frame sampler against full sequential decoding
+
+    python benchmarks/frame_sampling.py --seconds 5 30 60 --resolutions 640x360 1280x720 --fps 30 60
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from violations.frame_sampler import sample_frames
+
+
+def write_video(path: str, seconds: float, width: int, height: int, fps: int, seed: int = 0):
+    """
+    Write a synthetic MP4 whose content changes every frame so decoded frames can be told apart; videos
+    written with different seeds have different content
+    """
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    rng = np.random.default_rng(seed)
+    background = rng.integers(0, 255, size=(height, width, 3), dtype=np.uint8)
+    for i in range(int(seconds * fps)):
+        frame = np.roll(background, i * 4, axis=1)
+        cv2.putText(frame, str(i), (20, height // 2), cv2.FONT_HERSHEY_SIMPLEX, 2, (255, 255, 255), 3)
+        writer.write(frame)
+    writer.release()
+
+
+def sample_frames_sequential(video_path: str, num_frames: int) -> list:
+    """Previous implementation: read and colour-convert every frame, keep every interval-th one"""
+    frames = []
+    cap = cv2.VideoCapture(video_path)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    frame_interval = max(total_frames // num_frames, 1)
+    frame_count = 0
+    while True:
+        ret, frame = cap.read()
+        if (not ret) or (frame is None) or (len(frames) >= num_frames):
+            break
+        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        if frame_count % frame_interval == 0:
+            frames.append(rgb)
+        frame_count += 1
+    cap.release()
+    return frames
+
+
+def best_of(fn, repeats: int) -> tuple:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        out = fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings), out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--seconds", type=float, nargs="+", default=[5, 30, 60])
+    parser.add_argument("--resolutions", nargs="+", default=["640x360", "1280x720"])
+    parser.add_argument("--fps", type=int, nargs="+", default=[30])
+    parser.add_argument("--num-frames", type=int, default=10)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", help="write results as JSON to this path")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'seconds':>7} {'resolution':>10} {'fps':>4} {'sequential_s':>12} {'sampled_s':>10} {'speedup':>8} {'match':>6}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for seconds in args.seconds:
+            for resolution in args.resolutions:
+                width, height = (int(v) for v in resolution.split("x"))
+                for fps in args.fps:
+                    path = os.path.join(tmp, f"{seconds}_{resolution}_{fps}.mp4")
+                    write_video(path, seconds, width, height, fps)
+
+                    sequential, expected = best_of(lambda: sample_frames_sequential(path, args.num_frames), args.repeats)
+                    sampled, actual = best_of(lambda: sample_frames(path, args.num_frames), args.repeats)
+                    match = len(expected) == len(actual) and all(np.array_equal(a, b) for a, b in zip(expected, actual))
+
+                    row = {"seconds": seconds, "resolution": resolution, "fps": fps,
+                           "sequential_seconds": sequential, "sampled_seconds": sampled,
+                           "speedup": sequential / sampled, "frames_match": match}
+                    results.append(row)
+                    print(f"{seconds:>7g} {resolution:>10} {fps:>4} {sequential:>12.3f} {sampled:>10.3f} "
+                          f"{row['speedup']:>8.1f} {str(match):>6}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
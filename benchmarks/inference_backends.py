@@ -0,0 +1,143 @@
+"""
+Accuracy against fp32, latency and throughput of the ViolationChecker inference backends
+
+    python benchmarks/inference_backends.py --backends fp32 int8 onnx onnx-int8 --threads 4
+
+The fixture set is the given videos (or seeded synthetic frames) and ad descriptions. Each backend's
+violation_labels and ad_category are compared with the fp32 backend's; the script exits non-zero when a
+backend drifts past the tolerances.
+"""
+import argparse
+import glob
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from violations.frame_sampler import sample_frames
+from violations.violation_checker import ViolationChecker
+
+DESCRIPTIONS = [
+    "The SAR 21 is a bullpup-style assault rifle with a selective-fire system and a built-in optical scope.",
+    "Fresh sourdough and pastries baked every morning, delivered to your door before breakfast.",
+    "Win big tonight! Spin the wheel at our online casino and get 100 free spins on sign-up.",
+    "Low-interest personal loans approved in minutes with no credit check required.",
+    "Lightweight trail running shoes with a grippy outsole for muddy mountain routes.",
+    "Our new craft lager is brewed with local hops. Must be 21 or older to purchase.",
+    "Learn Python from scratch with our 12-week online bootcamp and land your first developer job.",
+    "Adopt a rescue puppy this weekend: vaccinated, microchipped and ready for a loving home."
+]
+
+
+def fixture_frames(videos: list, num_frames: int, count: int) -> list:
+    """Frames sampled from the given videos, or seeded synthetic frame sets when none are given"""
+    if videos:
+        return [sample_frames(path, num_frames) for path in videos]
+    rng = np.random.default_rng(0)
+    fixtures = []
+    for _ in range(count):
+        # Smooth colour gradients with noise, closer to natural images than uniform noise
+        base = rng.integers(0, 255, size=(num_frames, 1, 1, 3))
+        ramp = np.linspace(0, 1, 224)[None, :, None, None] * rng.integers(0, 128, size=(num_frames, 1, 1, 3))
+        noise = rng.normal(0, 16, size=(num_frames, 224, 224, 3))
+        fixtures.append(np.clip(base + ramp + noise, 0, 255).astype(np.uint8))
+    return fixtures
+
+
+def percentile(values: list, q: float) -> float:
+    return float(np.percentile(values, q))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--backends", nargs="+", default=["fp32", "int8"])
+    parser.add_argument("--threads", type=int, default=None, help="intra-op threads (default: library default)")
+    parser.add_argument("--videos", nargs="*", default=[], help="fixture videos (globs allowed)")
+    parser.add_argument("--synthetic", type=int, default=8, help="synthetic frame sets when no videos are given")
+    parser.add_argument("--num-frames", type=int, default=10)
+    parser.add_argument("--repeats", type=int, default=20, help="uploads timed per backend")
+    parser.add_argument("--batch-size", type=int, default=64, help="frames / texts per throughput call")
+    parser.add_argument("--clip", default="openai/clip-vit-base-patch32")
+    parser.add_argument("--sentence-transformer", default="BAAI/bge-base-en")
+    parser.add_argument("--tolerance", type=float, default=0.05, help="max allowed |p - p_fp32| of a violation label")
+    parser.add_argument("--min-agreement", type=float, default=0.9, help="min share of descriptions with the same top category")
+    parser.add_argument("--output", help="write results as JSON to this path")
+    args = parser.parse_args()
+
+    videos = [path for pattern in args.videos for path in sorted(glob.glob(pattern))]
+    frame_sets = fixture_frames(videos, args.num_frames, args.synthetic)
+    backends = ["fp32"] + [backend for backend in args.backends if backend != "fp32"]
+
+    reference = None
+    results = []
+    print(f"{'backend':<10} {'p50_ms':>8} {'p95_ms':>8} {'frames/s':>9} {'texts/s':>9} "
+          f"{'max_label_diff':>15} {'mean_label_diff':>16} {'max_category_diff':>18} {'top1_agree':>10} {'ok':>4}")
+    for name in backends:
+        checker = ViolationChecker(config_path = os.path.join(ROOT, "violations", "config.yaml"),
+                                   clip_path = args.clip, sentence_transformer_path = args.sentence_transformer,
+                                   cache_dir = tempfile.mkdtemp(prefix="inference-bench-"),
+                                   backend = name, threads = args.threads)
+        checker.warm_up()
+
+        labels = np.array([list(checker.get_violation_labels_from_frames(frames).values()) for frames in frame_sets])
+        categories = np.array([list(checker.get_ad_category(text).values()) for text in DESCRIPTIONS])
+        if reference is None:
+            reference = (labels, categories)
+
+        # Per-upload latency: one set of frames plus one description, as /upload does
+        latencies = []
+        for i in range(args.repeats):
+            start = time.perf_counter()
+            checker.get_violation_labels_from_frames(frame_sets[i % len(frame_sets)])
+            checker._description_embeddings([DESCRIPTIONS[i % len(DESCRIPTIONS)]])
+            latencies.append(time.perf_counter() - start)
+
+        # Throughput of full batches through each encoder
+        pixel_values = checker.clip_processor(images = list(np.concatenate(frame_sets)[:args.batch_size]), return_tensors="pt")["pixel_values"]
+        start = time.perf_counter()
+        checker._image_features(pixel_values)
+        frames_per_second = len(pixel_values) / (time.perf_counter() - start)
+        texts = (DESCRIPTIONS * (args.batch_size // len(DESCRIPTIONS) + 1))[:args.batch_size]
+        start = time.perf_counter()
+        checker._description_embeddings(texts)
+        texts_per_second = len(texts) / (time.perf_counter() - start)
+
+        label_diff = np.abs(labels - reference[0])
+        category_diff = np.abs(categories - reference[1])
+        agreement = float(np.mean(categories.argmax(axis=1) == reference[1].argmax(axis=1)))
+        row = {
+            "backend": name,
+            "threads": args.threads,
+            "p50_ms": 1000 * percentile(latencies, 50),
+            "p95_ms": 1000 * percentile(latencies, 95),
+            "mean_ms": 1000 * statistics.mean(latencies),
+            "frames_per_second": frames_per_second,
+            "texts_per_second": texts_per_second,
+            "max_label_diff": float(label_diff.max()),
+            "mean_label_diff": float(label_diff.mean()),
+            "max_category_diff": float(category_diff.max()),
+            "top1_agreement": agreement,
+            "startup_seconds": checker.startup_seconds
+        }
+        row["ok"] = row["max_label_diff"] <= args.tolerance and agreement >= args.min_agreement
+        results.append(row)
+        print(f"{name:<10} {row['p50_ms']:>8.1f} {row['p95_ms']:>8.1f} {frames_per_second:>9.1f} {texts_per_second:>9.1f} "
+              f"{row['max_label_diff']:>15.4f} {row['mean_label_diff']:>16.4f} {row['max_category_diff']:>18.4f} "
+              f"{agreement:>10.2f} {'yes' if row['ok'] else 'NO':>4}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if not all(row["ok"] for row in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
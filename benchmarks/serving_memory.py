@@ -0,0 +1,102 @@
+"""
+Measure per-worker memory and time-to-first-request of serve.py against worker count
+
+    python benchmarks/serving_memory.py --workers 1 2 4 8
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def children(pid: int) -> list:
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        return [int(p) for p in f.read().split()]
+
+
+def memory(pid: int) -> dict:
+    """
+    Resident memory of a process in MB; Pss splits shared pages evenly between the processes sharing them
+    """
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1]) / 1024
+    return {
+        "rss_mb": fields.get("Rss", 0.0),
+        "pss_mb": fields.get("Pss", 0.0),
+        "shared_mb": fields.get("Shared_Clean", 0.0) + fields.get("Shared_Dirty", 0.0),
+        "private_mb": fields.get("Private_Clean", 0.0) + fields.get("Private_Dirty", 0.0)
+    }
+
+
+def wait_ready(url: str, timeout: float) -> float:
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return time.perf_counter() - start
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        time.sleep(0.1)
+    raise TimeoutError(f"{url} not ready after {timeout}s")
+
+
+def measure(workers: int, port: int, threads: int, timeout: float) -> dict:
+    start = time.perf_counter()
+    server = subprocess.Popen([sys.executable, "serve.py", "--workers", str(workers), "--port", str(port),
+                               "--threads", str(threads)], cwd=ROOT)
+    try:
+        wait_ready(f"http://127.0.0.1:{port}/ready", timeout)
+        time_to_first_request = time.perf_counter() - start
+        # Let every worker finish importing the app before sampling memory
+        time.sleep(2)
+        pids = children(server.pid)
+        per_worker = [memory(pid) for pid in pids]
+        return {
+            "workers": workers,
+            "time_to_first_request_seconds": time_to_first_request,
+            "parent": memory(server.pid),
+            "per_worker": per_worker,
+            "mean_worker_rss_mb": sum(m["rss_mb"] for m in per_worker) / len(per_worker),
+            "mean_worker_pss_mb": sum(m["pss_mb"] for m in per_worker) / len(per_worker),
+            "total_pss_mb": memory(server.pid)["pss_mb"] + sum(m["pss_mb"] for m in per_worker)
+        }
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--output", help="write results as JSON to this path")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'workers':>7} {'ttfr_s':>8} {'worker_rss_mb':>13} {'worker_pss_mb':>13} {'total_pss_mb':>12}")
+    for workers in args.workers:
+        row = measure(workers, args.port, args.threads, args.timeout)
+        results.append(row)
+        print(f"{workers:>7} {row['time_to_first_request_seconds']:>8.2f} {row['mean_worker_rss_mb']:>13.0f} "
+              f"{row['mean_worker_pss_mb']:>13.0f} {row['total_pss_mb']:>12.0f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
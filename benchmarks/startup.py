@@ -0,0 +1,86 @@
+"""
+Cold-start benchmark of the violation checker: import time, weight load time and first-inference time
+
+    python benchmarks/startup.py --sources hub models/ --repeats 3
+
+Each source is either "hub" (the hub loader and its local cache) or a snapshot directory written by
+`python -m violations.model_snapshot`. Every run is a fresh interpreter, so imports are cold.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PHASES = ("app_import", "import", "load", "embeddings", "first_inference", "second_inference")
+
+
+def run_child(args):
+    """Measure one cold start in this process and print the timings as JSON"""
+    start = time.perf_counter()
+    from violations.violation_checker import ViolationChecker
+    app_import = time.perf_counter() - start
+
+    import numpy as np
+
+    checker = ViolationChecker(config_path = os.path.join(ROOT, "violations", "config.yaml"),
+                               clip_path = args.clip, sentence_transformer_path = args.sentence_transformer,
+                               cache_dir = tempfile.mkdtemp(prefix="startup-bench-"),
+                               snapshot_dir = None if args.source == "hub" else args.source)
+    checker.warm_up()
+
+    start = time.perf_counter()
+    checker.get_violation_labels_from_frames(np.zeros((1, 224, 224, 3), dtype=np.uint8))
+    checker._description_embeddings(["warm up"])
+    second_inference = time.perf_counter() - start
+
+    timings = dict(checker.startup_seconds, app_import=app_import, second_inference=second_inference)
+    print(json.dumps(timings))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sources", nargs="+", default=["hub"], help='"hub" or model snapshot directories')
+    parser.add_argument("--clip", default="openai/clip-vit-base-patch32")
+    parser.add_argument("--sentence-transformer", default="BAAI/bge-base-en")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", help="write results as JSON to this path")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--source", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+        return
+
+    results = []
+    print(f"{'source':<30} " + " ".join(f"{phase + '_s':>18}" for phase in PHASES) + f" {'total_s':>8}")
+    for source in args.sources:
+        runs = []
+        for _ in range(args.repeats):
+            out = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", "--source", source,
+                                  "--clip", args.clip, "--sentence-transformer", args.sentence_transformer],
+                                 capture_output=True, text=True, check=True, cwd=ROOT)
+            runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+        # Median of each phase over the repeats
+        row = {"source": source, "repeats": args.repeats}
+        for phase in PHASES:
+            row[f"{phase}_s"] = statistics.median(run[phase] for run in runs)
+        row["total_s"] = sum(row[f"{phase}_s"] for phase in PHASES if phase != "second_inference")
+        results.append(row)
+        print(f"{source:<30} " + " ".join(f"{row[phase + '_s']:>18.3f}" for phase in PHASES) + f" {row['total_s']:>8.3f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Write a model snapshot of tiny, randomly initialized stand-ins for CLIP and the sentence transformer
+
+    python benchmarks/stub_models.py --output /tmp/stub-models
+    MODEL_SNAPSHOT_DIR=/tmp/stub-models python serve.py
+
+The stand-ins have the same architectures, inputs and outputs as the real models but a few thousand
+parameters each, so the whole app runs without network access. Their scores are meaningless; use them to
+time everything around the encoders, not the encoders themselves. With --full-size they have the layer and
+embedding sizes of the real models instead (ViT-B/32 CLIP and a BERT-base sentence transformer, about 1 GB of
+weights), for measuring memory.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from violations.model_snapshot import DEFAULT_CLIP_PATH, DEFAULT_SENTENCE_TRANSFORMER_PATH, MANIFEST_NAME, to_safetensors
+
+HIDDEN_SIZE = 32
+# Vocabulary sizes of the real models; the stub tokenizers only use the first few ids
+CLIP_VOCAB_SIZE = 49408
+BERT_VOCAB_SIZE = 30522
+
+
+def write_stub_clip(output_dir: str, vocab_dir: str, full_size: bool = False):
+    from transformers import CLIPConfig, CLIPImageProcessor, CLIPModel, CLIPProcessor, CLIPTokenizerFast
+
+    # Byte-level BPE vocabulary of single printable characters and no merges
+    characters = [chr(c) for c in range(33, 127)]
+    vocab = ["<|startoftext|>", "<|endoftext|>"] + characters + [c + "</w>" for c in characters]
+    vocab_path = os.path.join(vocab_dir, "vocab.json")
+    merges_path = os.path.join(vocab_dir, "merges.txt")
+    with open(vocab_path, "w") as f:
+        json.dump({token: i for i, token in enumerate(vocab)}, f)
+    with open(merges_path, "w") as f:
+        f.write("#version: 0.2\n")
+    tokenizer = CLIPTokenizerFast(vocab_file=vocab_path, merges_file=merges_path)
+
+    token_ids = dict(bos_token_id=0, eos_token_id=1, pad_token_id=1)
+    if full_size:
+        # The library defaults are the ViT-B/32 sizes
+        config = CLIPConfig(text_config=dict(vocab_size=CLIP_VOCAB_SIZE, **token_ids),
+                            vision_config=dict(image_size=224, patch_size=32), projection_dim=512)
+    else:
+        config = CLIPConfig(
+            text_config=dict(vocab_size=len(vocab), hidden_size=HIDDEN_SIZE, intermediate_size=2 * HIDDEN_SIZE,
+                             num_hidden_layers=2, num_attention_heads=2, max_position_embeddings=77, **token_ids),
+            vision_config=dict(hidden_size=HIDDEN_SIZE, intermediate_size=2 * HIDDEN_SIZE, num_hidden_layers=2,
+                               num_attention_heads=2, image_size=224, patch_size=32),
+            projection_dim=16)
+    CLIPModel(config).save_pretrained(output_dir)
+    CLIPProcessor(image_processor=CLIPImageProcessor(), tokenizer=tokenizer).save_pretrained(output_dir)
+
+
+def write_stub_sentence_transformer(output_dir: str, vocab_dir: str, full_size: bool = False):
+    from sentence_transformers import SentenceTransformer, models
+    from transformers import BertConfig, BertModel, BertTokenizerFast
+
+    vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + [chr(c) for c in range(97, 123)]
+    vocab_path = os.path.join(vocab_dir, "bert_vocab.txt")
+    with open(vocab_path, "w") as f:
+        f.write("\n".join(vocab))
+
+    bert_dir = os.path.join(vocab_dir, "bert")
+    if full_size:
+        # The library defaults are the BERT-base sizes of BAAI/bge-base-en
+        config = BertConfig(vocab_size=BERT_VOCAB_SIZE)
+    else:
+        config = BertConfig(vocab_size=len(vocab), hidden_size=HIDDEN_SIZE, intermediate_size=2 * HIDDEN_SIZE,
+                            num_hidden_layers=2, num_attention_heads=2)
+    BertModel(config).save_pretrained(bert_dir)
+    BertTokenizerFast(vocab_file=vocab_path).save_pretrained(bert_dir)
+
+    # CLS pooling and normalization, as BAAI/bge-base-en
+    transformer = models.Transformer(bert_dir)
+    pooling = models.Pooling(config.hidden_size, "cls")
+    SentenceTransformer(modules=[transformer, pooling, models.Normalize()]).save(output_dir)
+
+
+def write_stub_snapshot(output_dir: str, clip_path: str = DEFAULT_CLIP_PATH,
+                        sentence_transformer_path: str = DEFAULT_SENTENCE_TRANSFORMER_PATH, seed: int = 0,
+                        full_size: bool = False) -> dict:
+    """
+    Write stand-in models as a snapshot that MODEL_SNAPSHOT_DIR / snapshot_dir can point at
+
+    :param output_dir: snapshot directory to create
+    :param clip_path: hub id the CLIP stand-in is registered under (default: "openai/clip-vit-base-patch32")
+    :param sentence_transformer_path: hub id the sentence transformer stand-in is registered under
+                                      (default: "BAAI/bge-base-en")
+    :param seed: seed of the random weights (default: 0)
+    :param full_size: give the stand-ins the sizes of the real models (default: False)
+    :return: the manifest written next to the models
+    """
+    import torch
+
+    torch.manual_seed(seed)
+    os.makedirs(output_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory() as vocab_dir:
+        write_stub_clip(os.path.join(output_dir, "clip"), vocab_dir, full_size)
+        write_stub_sentence_transformer(os.path.join(output_dir, "sentence_transformer"), vocab_dir, full_size)
+    to_safetensors(output_dir)
+
+    manifest = {
+        "created": time.time(),
+        "safetensors": True,
+        "stub": True,
+        "full_size": full_size,
+        "models": {
+            clip_path: "clip",
+            sentence_transformer_path: "sentence_transformer"
+        }
+    }
+    with open(os.path.join(output_dir, MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--output", required=True, help="snapshot directory to create")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--full-size", action="store_true", help="sizes of the real models instead of tiny ones")
+    args = parser.parse_args()
+
+    manifest = write_stub_snapshot(args.output, seed=args.seed, full_size=args.full_size)
+    print(json.dumps(manifest, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Synthetic videos, moderator tables and upload forms for the benchmarks
+
+    python benchmarks/synthetic_data.py --moderators 10000 100000 --videos 5x640x360 30x1280x720 --output /tmp/synthetic
+"""
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from frame_sampling import write_video
+from reference_data import ST_COMBINATIONS_PATH, read_table
+from scoring import fit_moderator_bounds, score_moderators
+
+DEFAULT_FPS = 30
+
+
+def parse_video_spec(spec: str) -> dict:
+    """
+    :param spec: "<seconds>x<width>x<height>", e.g. "5x640x360"
+    :return: seconds, width and height
+    """
+    seconds, width, height = spec.split("x")
+    return {"seconds": float(seconds), "width": int(width), "height": int(height)}
+
+
+def write_videos(directory: str, spec: str, count: int, fps: int = DEFAULT_FPS) -> list:
+    """
+    Write distinct synthetic MP4s of one length and resolution, so no two uploads share a cache entry
+
+    :param directory: output directory
+    :param spec: "<seconds>x<width>x<height>"
+    :param count: number of videos
+    :param fps: frames per second (default: 30)
+    :return: paths of the videos
+    """
+    video = parse_video_spec(spec)
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for seed in range(count):
+        path = os.path.join(directory, f"{spec}_{seed:04d}.mp4")
+        if not os.path.exists(path):
+            write_video(path, video["seconds"], video["width"], video["height"], fps, seed=seed)
+        paths.append(path)
+    return paths
+
+
+def st_combinations(path: str = ST_COMBINATIONS_PATH) -> pd.DataFrame:
+    return read_table(path)[["delivery_country", "product_line", "task_type_en"]]
+
+
+def write_moderator_table(path: str, rows: int, seed: int = 0, st_path: str = ST_COMBINATIONS_PATH) -> str:
+    """
+    Write a scored moderator table that MODERATOR_DATA_PATH can point at
+
+    Raw columns are drawn from ranges like those of EDA/Datasets/moderator-data-cleaned.xlsx and scored with
+    the scoring module, so the derived columns are consistent with the real table.
+
+    :param path: .parquet, .csv or .xlsx file to write
+    :param rows: number of moderators
+    :param seed: random seed (default: 0)
+    :param st_path: st_combinations table whose markets the moderators cover
+    :return: path
+    """
+    rng = np.random.default_rng(seed)
+    markets = st_combinations(st_path)["delivery_country"].unique()
+    # One to three markets per moderator
+    market_lists = [json.dumps(sorted(rng.choice(markets, size=rng.integers(1, 4), replace=False).tolist()))
+                    for _ in range(rows)]
+    raw = pd.DataFrame({
+        "moderator": 1700000000000000 + rng.choice(10 ** 14, size=rows, replace=False),
+        "market": market_lists,
+        "Productivity": rng.uniform(50, 1300, size=rows),
+        "Utilisation %": rng.uniform(0.3, 1.5, size=rows),
+        "handling time": rng.integers(20000, 400000, size=rows),
+        "accuracy": rng.uniform(0.6, 1.0, size=rows)
+    })
+    moderators = score_moderators(raw, fit_moderator_bounds(raw))
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    if path.endswith(".parquet"):
+        moderators.to_parquet(path, index=False)
+    elif path.endswith(".csv"):
+        moderators.to_csv(path, index=False)
+    else:
+        moderators.to_excel(path, index=False)
+    return path
+
+
+def upload_forms(count: int, seed: int = 0, st_path: str = ST_COMBINATIONS_PATH) -> list:
+    """
+    Form fields of /upload requests, spread over the markets, product lines and task types of st_combinations
+
+    :param count: number of forms
+    :param seed: random seed (default: 0)
+    :param st_path: st_combinations table
+    :return: one dict of form fields per request
+    """
+    rng = np.random.default_rng(seed)
+    combinations = st_combinations(st_path).to_numpy()
+    words = ("fresh", "fast", "new", "premium", "cheap", "organic", "smart", "classic", "bold", "daily")
+    products = ("shoes", "coffee", "loans", "games", "phones", "holidays", "courses", "furniture", "snacks")
+    forms = []
+    for i in range(count):
+        market, product_line, task_type = combinations[rng.integers(len(combinations))]
+        title = f"{rng.choice(words)} {rng.choice(products)}"
+        forms.append({
+            "adTitle": title,
+            "advertiserName": f"advertiser-{rng.integers(1000)}",
+            "description": f"{title} {rng.choice(words)} {rng.choice(words)} deals {i}",
+            "deliveryMarket": market,
+            "productLine": product_line,
+            "taskType": task_type,
+            "startDate": f"{rng.integers(1, 29)}/{rng.integers(1, 13)}/2023"
+        })
+    return forms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--moderators", type=int, nargs="*", default=[10000, 100000], help="moderator table sizes")
+    parser.add_argument("--videos", nargs="*", default=["5x640x360"], help="<seconds>x<width>x<height> of each video set")
+    parser.add_argument("--count", type=int, default=16, help="distinct videos per video set")
+    parser.add_argument("--fps", type=int, default=DEFAULT_FPS)
+    parser.add_argument("--output", required=True, help="output directory")
+    args = parser.parse_args()
+
+    for rows in args.moderators:
+        print(write_moderator_table(os.path.join(args.output, f"moderators_{rows}.parquet"), rows))
+    for spec in args.videos:
+        paths = write_videos(os.path.join(args.output, "videos"), spec, args.count, args.fps)
+        print(f"{len(paths)} videos of {spec} in {os.path.dirname(paths[0])}")
+
+
+if __name__ == "__main__":
+    main()
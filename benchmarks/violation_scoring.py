@@ -0,0 +1,80 @@
+"""
+Micro-benchmark of per-element violation scoring against the batched matmul path
+
+    python benchmarks/violation_scoring.py --frames 10 50 200 --labels 11 50 200
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import torch
+import torch.nn.functional as F
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from violations.violation_checker import score_violations
+
+
+def score_violations_loop(image_features: torch.Tensor, text_features: torch.Tensor) -> list:
+    """Previous implementation: one cosine similarity and softmax per (label, frame)"""
+    out = []
+    empty_prompt = text_features.shape[0] - 1
+    for i in range(empty_prompt):
+        pair = text_features[[i, empty_prompt]]
+        indiv = []
+        for im in image_features:
+            cos_sim = F.cosine_similarity(im.unsqueeze(0), pair) * 100
+            indiv.append(cos_sim.softmax(dim=0)[0].item())
+        out.append(max(indiv))
+    return out
+
+
+def best_of(fn, repeats: int) -> float:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--frames", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--labels", type=int, nargs="+", default=[11, 50, 200])
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--output", help="write results as JSON to this path")
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    results = []
+    print(f"{'frames':>6} {'labels':>6} {'loop_ms':>10} {'batched_ms':>10} {'speedup':>8} {'max_abs_diff':>12}")
+    for n_frames in args.frames:
+        for n_labels in args.labels:
+            image_features = torch.randn(n_frames, args.dim, device=args.device)
+            text_features = F.normalize(torch.randn(n_labels + 1, args.dim, device=args.device), dim=-1)
+
+            with torch.inference_mode():
+                expected = torch.tensor(score_violations_loop(image_features, text_features))
+                actual = score_violations(image_features, text_features).cpu()
+                loop = best_of(lambda: score_violations_loop(image_features, text_features), args.repeats)
+                batched = best_of(lambda: score_violations(image_features, text_features).tolist(), args.repeats)
+
+            diff = (expected - actual).abs().max().item()
+            row = {"frames": n_frames, "labels": n_labels, "loop_seconds": loop,
+                   "batched_seconds": batched, "speedup": loop / batched, "max_abs_diff": diff}
+            results.append(row)
+            print(f"{n_frames:>6} {n_labels:>6} {loop * 1000:>10.2f} {batched * 1000:>10.3f} "
+                  f"{row['speedup']:>8.1f} {diff:>12.2e}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""
+Score a manifest of ads offline through the violation pipeline
+
+    python bulk_score.py manifest.jsonl results.parquet --workers 4 --batch-size 16
+
+The manifest is JSONL or CSV with a video_path and a description per ad, and optionally an ad_id (the row
+number otherwise). Results are written as each batch finishes: a .jsonl output is appended to, anything
+else is a directory of Parquet part files. Rerunning with --resume skips the ads already in the output.
+"""
+import argparse
+import csv
+import gc
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from functools import partial
+
+import torch
+
+from func import calculate_confidences
+from instrumentation import configure_logging
+from violations.violation_checker import ViolationChecker, get_checker
+
+logger = logging.getLogger("bulk_score")
+
+CONFIG_PATH = "violations/config.yaml"
+
+
+def read_manifest(path: str) -> list:
+    """
+    Read the ads to score
+
+    :param path: JSONL or CSV manifest
+    :return: one dict per ad with ad_id, video_path and description
+    """
+    with open(path, newline="") as f:
+        if path.endswith(".csv"):
+            records = list(csv.DictReader(f))
+        else:
+            records = [json.loads(line) for line in f if line.strip()]
+
+    rows = []
+    for i, record in enumerate(records):
+        if not record.get("video_path"):
+            raise ValueError(f"{path}: row {i} has no video_path")
+        rows.append({
+            "ad_id": str(record.get("ad_id") or i),
+            "video_path": record["video_path"],
+            "description": record.get("description") or ""
+        })
+    return rows
+
+
+def short_category(category: str) -> str:
+    # Categories in the config are "<name>\n<explanation>"
+    return category.split("\\n")[0]
+
+
+def output_columns(checker: ViolationChecker) -> list:
+    return (["ad_id", "video_path", "description", "frames"]
+            + [f"violation.{label}" for label in checker.violation_labels]
+            + [f"category.{short_category(category)}" for category in checker.ad_categories]
+            + ["top_category", "confidence", "error"])
+
+
+class JsonlOutput:
+
+    def __init__(self, path: str):
+        """
+        Results appended to a JSON lines file, one line per ad
+
+        :param path: path to the .jsonl file
+        """
+        self.path = path
+
+    def completed(self) -> set:
+        """ad_ids already in the output; a line cut off by a crash is truncated away"""
+        if not os.path.exists(self.path):
+            return set()
+        done = set()
+        valid = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                done.add(json.loads(line)["ad_id"])
+                valid += len(line)
+        with open(self.path, "r+b") as f:
+            f.truncate(valid)
+        return done
+
+    def write(self, rows: list):
+        with open(self.path, "a") as f:
+            f.write("".join(json.dumps(row) + "\n" for row in rows))
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class ParquetOutput:
+
+    def __init__(self, path: str, columns: list):
+        """
+        Results written as a directory of Parquet part files, one per batch
+
+        :param path: output directory
+        :param columns: output column names
+        """
+        import pyarrow as pa
+
+        self.path = path
+        fields = []
+        for column in columns:
+            if column.startswith(("violation.", "category.")) or column == "confidence":
+                fields.append(pa.field(column, pa.float64()))
+            elif column == "frames":
+                fields.append(pa.field(column, pa.int32()))
+            else:
+                fields.append(pa.field(column, pa.string()))
+        self.schema = pa.schema(fields)
+        os.makedirs(path, exist_ok=True)
+        self.parts = len(self._part_paths())
+
+    def _part_paths(self) -> list:
+        return sorted(glob.glob(os.path.join(self.path, "part-*.parquet")))
+
+    def completed(self) -> set:
+        import pyarrow.parquet as pq
+
+        done = set()
+        for path in self._part_paths():
+            done.update(pq.read_table(path, columns=["ad_id"]).column("ad_id").to_pylist())
+        return done
+
+    def write(self, rows: list):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_pylist(rows, schema=self.schema)
+        path = os.path.join(self.path, f"part-{self.parts:06d}.parquet")
+        # Write then rename so a crash never leaves a part without its footer
+        tmp_path = f"{path}.tmp"
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, path)
+        self.parts += 1
+
+
+def open_output(path: str, columns: list):
+    if path.endswith(".jsonl"):
+        return JsonlOutput(path)
+    return ParquetOutput(path, columns)
+
+
+def score_batch(rows: list, num_frames: int) -> list:
+    """
+    Decode a batch of ads and score them with one call per encoder
+
+    :param rows: manifest rows
+    :param num_frames: number of frames to sample from each video
+    :return: one output row per ad; ads that fail get an error instead of scores
+    """
+    checker = get_checker()
+    results = []
+    decoded = []
+    for row in rows:
+        result = dict(row, frames=0, top_category=None, confidence=None, error=None)
+        try:
+            frames = checker.select_frames(row["video_path"], num_frames)
+            if len(frames) == 0:
+                raise Exception("Error: Could not decode any frames from the video.")
+            result["frames"] = len(frames)
+            decoded.append((result, frames))
+        except Exception as e:
+            result["error"] = str(e)
+        results.append(result)
+
+    if decoded:
+        labels = checker.get_violation_labels_batch([frames for _, frames in decoded])
+        categories = checker.get_ad_categories([result["description"] for result, _ in decoded])
+        confidences = calculate_confidences([list(violation_labels.values()) for violation_labels in labels])
+        for (result, _), violation_labels, ad_category, confidence in zip(decoded, labels, categories, confidences.tolist()):
+            for label, probability in violation_labels.items():
+                result[f"violation.{label}"] = probability
+            for category, similarity in ad_category.items():
+                result[f"category.{short_category(category)}"] = similarity
+            result["top_category"] = short_category(max(ad_category, key=ad_category.get))
+            result["confidence"] = confidence
+    return results
+
+
+def init_worker(threads: int):
+    get_checker().backend.set_threads(threads)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("manifest", help="JSONL or CSV of video_path, description and optionally ad_id")
+    parser.add_argument("output", help=".jsonl file, or a directory of Parquet part files")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker processes (0 runs inline)")
+    parser.add_argument("--threads", type=int, default=1, help="encoder intra-op threads per worker")
+    parser.add_argument("--batch-size", type=int, default=16, help="ads per encoder call")
+    parser.add_argument("--num-frames", type=int, default=10)
+    parser.add_argument("--backend", help="inference backend (default: inference.backend in the config)")
+    parser.add_argument("--resume", action="store_true", help="skip ads already in the output")
+    args = parser.parse_args()
+    configure_logging()
+
+    rows = read_manifest(args.manifest)
+
+    # Load and warm up the models before forking so the workers share the weights
+    torch.set_num_threads(1)
+    checker = get_checker(config_path = CONFIG_PATH, backend = args.backend, threads = 1)
+    checker.warm_up()
+
+    output = open_output(args.output, output_columns(checker))
+    done = output.completed()
+    if done and not args.resume:
+        sys.exit(f"{args.output} already has {len(done)} scored ads; pass --resume to continue it")
+    pending = [row for row in rows if row["ad_id"] not in done]
+    logger.info("bulk manifest", extra={"ads": len(rows), "already_scored": len(rows) - len(pending),
+                                        "pending": len(pending)})
+
+    batches = [pending[i:i + args.batch_size] for i in range(0, len(pending), args.batch_size)]
+    score = partial(score_batch, num_frames = args.num_frames)
+    pool = None
+    if args.workers > 0:
+        gc.collect()
+        gc.freeze()
+        pool = multiprocessing.get_context("fork").Pool(args.workers, initializer=init_worker, initargs=(args.threads,))
+        results = pool.imap_unordered(score, batches)
+    else:
+        init_worker(args.threads)
+        results = map(score, batches)
+
+    start = time.perf_counter()
+    scored = failed = 0
+    try:
+        for batch in results:
+            output.write(batch)
+            scored += len(batch)
+            failed += sum(result["error"] is not None for result in batch)
+            rate = scored / (time.perf_counter() - start)
+            logger.info("bulk progress", extra={"scored": scored, "pending": len(pending), "failed": failed,
+                                                "rate": rate})
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,209 @@
+import os
+import sqlite3
+import threading
+from datetime import date
+
+import numpy as np
+
+from reference_data import ReferenceData, ReferenceStore, get_reference_store
+
+CAPACITY_LEDGER_PATH = os.environ.get("CAPACITY_LEDGER_PATH", "./Results/capacity_ledger.db")
+PAID_HOURS_PER_DAY = 8
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS capacity (
+    day TEXT NOT NULL,
+    moderator INTEGER NOT NULL,
+    remaining INTEGER NOT NULL,
+    assigned INTEGER NOT NULL DEFAULT 0,
+    utilisation REAL NOT NULL,
+    PRIMARY KEY (day, moderator)
+) WITHOUT ROWID
+"""
+
+
+class CapacityLedger:
+
+    def __init__(self, path: str = CAPACITY_LEDGER_PATH, reference_store: ReferenceStore = None, clock=date.today):
+        """
+        Per-day moderator capacity backed by SQLite, safe to share between threads and worker processes
+
+        :param path: path to the SQLite database file
+        :param reference_store: reference store used to seed each day's capacity (default: process-wide store)
+        :param clock: callable returning today's date, used to detect the day boundary
+        """
+        self.path = path
+        self.reference_store = reference_store or get_reference_store()
+        self.clock = clock
+
+        self._local = threading.local()
+        self._seed_lock = threading.Lock()
+        self._seeded = None
+        # (day, reference snapshot, remaining tasks aligned with its rows), kept current by consume and release
+        self._remaining_lock = threading.Lock()
+        self._remaining = None
+
+        conn = self._connection()
+        conn.execute(_SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit mode; writes take an explicit IMMEDIATE transaction
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def today(self) -> str:
+        """
+        Current ledger day, seeding fresh capacity the first time a day (or reference snapshot) is seen
+        """
+        day = self.clock().isoformat()
+        data = self.reference_store.data
+        if self._seeded != (day, id(data)):
+            with self._seed_lock:
+                if self._seeded != (day, id(data)):
+                    self._seed(day, data)
+                    self._seeded = (day, id(data))
+        return day
+
+    def _seed(self, day: str, data: ReferenceData):
+        # INSERT OR IGNORE keeps rows other workers have already started consuming
+        rows = zip(
+            [day] * len(data),
+            data.moderator.tolist(),
+            np.floor(data.max_tasks_per_day).astype(np.int64).tolist(),
+            data.utilisation.tolist()
+        )
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT OR IGNORE INTO capacity (day, moderator, remaining, utilisation) VALUES (?, ?, ?, ?)", rows)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get(self, moderator: int) -> tuple:
+        """
+        Get a moderator's capacity for today
+
+        :param moderator: moderator id
+        :return: (remaining_tasks, utilisation) or None for an unknown moderator
+        """
+        day = self.today()
+        return self._connection().execute(
+            "SELECT remaining, utilisation FROM capacity WHERE day = ? AND moderator = ?",
+            (day, int(moderator))).fetchone()
+
+    def remaining(self, moderator: int) -> int:
+        row = self.get(moderator)
+        return row[0] if row is not None else 0
+
+    def remaining_array(self, data: ReferenceData) -> np.ndarray:
+        """
+        Get today's remaining tasks aligned with the rows of a reference snapshot
+
+        The ledger is read only when the day or the snapshot changes; after that consume() and release() keep an
+        in-process copy current. Tasks other worker processes take show up when consume() finds them gone.
+
+        :param data: reference snapshot whose moderator order the result follows
+        :return: int64 array of remaining tasks, 0 for moderators missing from the ledger
+        """
+        day = self.today()
+        with self._remaining_lock:
+            if self._remaining is None or self._remaining[0] != day or self._remaining[1] is not data:
+                self._remaining = (day, data, self._read_remaining(day, data))
+            return self._remaining[2].copy()
+
+    def _read_remaining(self, day: str, data: ReferenceData) -> np.ndarray:
+        remaining = np.zeros(len(data), dtype=np.int64)
+        rows = self._connection().execute("SELECT moderator, remaining FROM capacity WHERE day = ?", (day,))
+        index = data.moderator_index
+        for moderator, left in rows:
+            i = index.get(moderator)
+            if i is not None:
+                remaining[i] = left
+        return remaining
+
+    def _set_remaining(self, day: str, moderator: int, left: int):
+        with self._remaining_lock:
+            if self._remaining is not None and self._remaining[0] == day:
+                i = self._remaining[1].moderator_index.get(int(moderator))
+                if i is not None:
+                    self._remaining[2][i] = left
+
+    def consume(self, moderator: int, handling_time: float, tasks: int = 1) -> tuple:
+        """
+        Atomically take tasks from a moderator's remaining capacity for today
+
+        :param moderator: moderator id
+        :param handling_time: the moderator's handling time per task in milliseconds
+        :param tasks: number of tasks to assign (default: 1)
+        :return: (remaining_tasks, utilisation) after the assignment, or None if capacity was exhausted
+        """
+        day = self.today()
+        increase = tasks * float(handling_time) / (PAID_HOURS_PER_DAY * 60 * 60 * 1000)
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cur = conn.execute(
+                "UPDATE capacity SET remaining = remaining - ?, assigned = assigned + ?, utilisation = utilisation + ? "
+                "WHERE day = ? AND moderator = ? AND remaining >= ?",
+                (tasks, tasks, increase, day, int(moderator), tasks))
+            current = conn.execute(
+                "SELECT remaining, utilisation FROM capacity WHERE day = ? AND moderator = ?",
+                (day, int(moderator))).fetchone()
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if current is not None:
+            self._set_remaining(day, moderator, current[0])
+        return current if cur.rowcount == 1 else None
+
+    def release(self, moderator: int, handling_time: float, tasks: int = 1):
+        """
+        Return tasks to a moderator's capacity, e.g. when an assignment is abandoned
+
+        :param moderator: moderator id
+        :param handling_time: the moderator's handling time per task in milliseconds
+        :param tasks: number of tasks to return (default: 1)
+        """
+        day = self.today()
+        increase = tasks * float(handling_time) / (PAID_HOURS_PER_DAY * 60 * 60 * 1000)
+        self._connection().execute(
+            "UPDATE capacity SET remaining = remaining + ?, assigned = assigned - ?, utilisation = utilisation - ? "
+            "WHERE day = ? AND moderator = ? AND assigned >= ?",
+            (tasks, tasks, increase, day, int(moderator), tasks))
+        self._set_remaining(day, moderator, self.remaining(moderator))
+
+    def stats(self) -> dict:
+        day = self.today()
+        remaining, assigned, moderators = self._connection().execute(
+            "SELECT SUM(remaining), SUM(assigned), COUNT(*) FROM capacity WHERE day = ?", (day,)).fetchone()
+        return {
+            "day": day,
+            "moderators": moderators,
+            "remaining_tasks": remaining or 0,
+            "assigned_tasks": assigned or 0
+        }
+
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+
+def get_capacity_ledger() -> CapacityLedger:
+    """
+    Get the process-wide capacity ledger, creating it on first use
+    """
+    global _ledger
+    if _ledger is None:
+        with _ledger_lock:
+            if _ledger is None:
+                _ledger = CapacityLedger()
+    return _ledger
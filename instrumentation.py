@@ -0,0 +1,195 @@
+"""
+Per-stage latency histograms in Prometheus text format, an opt-in sampling profiler and structured logging
+"""
+import bisect
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# Stages of an /upload, in pipeline order
+STAGES = ("ingest", "decode", "preprocess", "image_encode", "text_score", "categorize", "reference_lookup", "solver",
+          "request")
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED", "0") == "1"
+
+
+class Histogram:
+
+    def __init__(self, name: str, documentation: str, label: str, buckets: tuple = DEFAULT_BUCKETS):
+        """
+        Prometheus histogram with one label
+
+        :param name: metric name
+        :param documentation: HELP text
+        :param label: name of the label distinguishing the series
+        :param buckets: upper bounds of the buckets, in increasing order
+        """
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, label_value: str, value: float):
+        # Per-bucket (not cumulative) counts; the last slot is the +Inf bucket
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list:
+        """Lines of the Prometheus text exposition format"""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {k: (list(v[0]), v[1], v[2]) for k, v in self._series.items()}
+        for label_value, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{self.name}_bucket{{{self.label}="{label_value}",le="{le}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{self.label}="{label_value}"}} {total}')
+            lines.append(f'{self.name}_count{{{self.label}="{label_value}"}} {count}')
+        return lines
+
+
+stage_seconds = Histogram("ad_moderation_stage_seconds", "Time spent in each stage of an ad upload", "stage")
+
+
+@contextmanager
+def timed(stage: str):
+    """
+    Record how long the block takes under a stage of stage_seconds
+
+    :param stage: one of STAGES
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_seconds.observe(stage, time.perf_counter() - start)
+
+
+def render_metrics() -> str:
+    return "\n".join(stage_seconds.render()) + "\n"
+
+
+class SamplingProfiler:
+
+    def __init__(self, interval_ms: float = 5.0, max_depth: int = 64):
+        """
+        Samples the stack of every thread in the process at a fixed interval while it runs
+
+        Every thread is sampled because the models and the assignment solver run on batching threads rather
+        than the request's own thread.
+
+        :param interval_ms: time between samples (default: 5.0)
+        :param max_depth: frames kept from the top of each stack (default: 64)
+        """
+        self.interval = interval_ms / 1000
+        self.max_depth = max_depth
+        self.stacks = Counter()
+        self.samples = 0
+        self.seconds = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> "SamplingProfiler":
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.seconds = time.perf_counter() - self._started
+
+    def __enter__(self) -> "SamplingProfiler":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def folded(self) -> str:
+        """Collapsed stacks, one "frame;frame;frame count" line each, as read by flamegraph tools"""
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+
+    def summary(self, top: int = 20) -> dict:
+        return {
+            "seconds": self.seconds,
+            "samples": self.samples,
+            "interval_ms": 1000 * self.interval,
+            "top_stacks": [{"stack": stack, "samples": count} for stack, count in self.stacks.most_common(top)]
+        }
+
+
+# Attributes every LogRecord has; anything else was passed through extra= and is logged as a field
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line with the time, level, logger, message and any extra= fields
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level: str = None, fmt: str = None):
+    """
+    Send log records to stderr, unless the root logger is already configured
+
+    :param level: minimum level (default: $LOG_LEVEL, else INFO)
+    :param fmt: "json" or "text" (default: $LOG_FORMAT, else json)
+    """
+    root = logging.getLogger()
+    if root.handlers:
+        return
+    handler = logging.StreamHandler()
+    if (fmt or os.environ.get("LOG_FORMAT", "json")) == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s"))
+    root.addHandler(handler)
+    root.setLevel((level or os.environ.get("LOG_LEVEL", "INFO")).upper())
@@ -0,0 +1,211 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from func import analyse_ad, calculate_confidence, format_results
+from instrumentation import timed
+from uploads import IngestedUpload
+from violations.violation_checker import ViolationChecker
+
+STAGES = ("decode", "inference", "assignment")
+
+
+class Job:
+
+    def __init__(self, form: dict, upload: IngestedUpload, num_frames: int):
+        """
+        One /upload submission moving through the staged pipeline
+
+        :param form: the submitted form fields
+        :param upload: the ingested video, owned by the job until decoding finishes
+        :param num_frames: number of frames to sample from the video
+        """
+        self.id = str(uuid.uuid4())
+        self.form = form
+        self.upload = upload
+        self.num_frames = num_frames
+
+        self.status = "queued"
+        self.created = time.time()
+        self.stages = {}
+        self.result = None
+        self.error = None
+
+        # Intermediate values handed from one stage to the next
+        self.frames = None
+        self.cache_key = None
+        self.out = None
+
+        self._events = []
+        self._changed = threading.Condition()
+        self._emit("queued")
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed")
+
+    def _emit(self, status: str, **extra):
+        with self._changed:
+            self.status = status
+            self._events.append(dict({"status": status, "time": time.time()}, **extra))
+            self._changed.notify_all()
+
+    def start_stage(self, stage: str):
+        self.stages[stage] = {"started": time.time()}
+        self._emit(stage)
+
+    def finish_stage(self, stage: str):
+        timing = self.stages[stage]
+        timing["seconds"] = time.time() - timing["started"]
+
+    def complete(self, result: dict):
+        self.result = result
+        self._emit("done")
+
+    def fail(self, error: Exception):
+        self.error = str(error)
+        self._emit("failed", error=self.error)
+
+    def events(self, keepalive: float = 15.0):
+        """
+        Yield status events as they happen, ending once the job has finished and every event has been yielded
+
+        :param keepalive: yield None after this many seconds without a new event, so that a stream can show the
+                          client it is still alive while a long stage runs (default: 15.0)
+        """
+        seen = 0
+        while True:
+            with self._changed:
+                if seen == len(self._events) and not self.finished:
+                    self._changed.wait(keepalive)
+                new = self._events[seen:]
+                seen = len(self._events)
+                finished = self.finished
+            if not new and not finished:
+                yield None
+            for event in new:
+                yield event
+            if finished and seen == len(self._events):
+                return
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "stages": self.stages,
+            "result": self.result,
+            "error": self.error
+        }
+
+
+class JobPipeline:
+
+    def __init__(self, checker: ViolationChecker, decode_workers: int = 4, inference_workers: int = 2,
+                 assignment_workers: int = 2, max_finished_jobs: int = 1000):
+        """
+        Runs uploads through decode -> inference -> assignment, each stage on its own pool
+
+        :param checker: the violation checker used for inference
+        :param decode_workers: threads decoding video frames (I/O bound)
+        :param inference_workers: threads running the encoders; they release the GIL inside torch
+        :param assignment_workers: threads scoring ads and waiting on the moderator assignment engine
+        :param max_finished_jobs: finished jobs kept for status lookups before the oldest are dropped
+        """
+        self.checker = checker
+        self.pools = {
+            "decode": ThreadPoolExecutor(decode_workers, thread_name_prefix="job-decode"),
+            "inference": ThreadPoolExecutor(inference_workers, thread_name_prefix="job-inference"),
+            "assignment": ThreadPoolExecutor(assignment_workers, thread_name_prefix="job-assignment")
+        }
+        self.handlers = {
+            "decode": self._decode,
+            "inference": self._inference,
+            "assignment": self._assignment
+        }
+        self.max_finished_jobs = max_finished_jobs
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, form: dict, upload: IngestedUpload, num_frames: int = 10) -> Job:
+        """
+        Queue an upload; returns immediately
+
+        :param form: the submitted form fields
+        :param upload: the ingested video; the pipeline closes it once frames are decoded
+        :param num_frames: number of frames to sample from the video (default: 10)
+        :return: the job, whose id can be polled
+        """
+        job = Job(form, upload, num_frames)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        self._schedule(job, "decode")
+        return job
+
+    def get(self, job_id: str) -> Job:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self._jobs[job_id]
+
+    def _schedule(self, job: Job, stage: str):
+        self.pools[stage].submit(self._run_stage, job, stage)
+
+    def _run_stage(self, job: Job, stage: str):
+        job.start_stage(stage)
+        try:
+            self.handlers[stage](job)
+        except Exception as e:
+            job.upload.close()
+            job.fail(e)
+            return
+        job.finish_stage(stage)
+
+        following = STAGES.index(stage) + 1
+        if following < len(STAGES):
+            self._schedule(job, STAGES[following])
+        else:
+            job.complete(job.result)
+
+    def _decode(self, job: Job):
+        with job.upload:
+            job.cache_key = self.checker.violation_cache_key(job.upload.digest, job.num_frames)
+            cached = self.checker.result_cache.get(job.cache_key)
+            if cached is not None:
+                job.out = {"violation_labels": cached}
+                return
+            with timed("decode"):
+                job.frames = self.checker.select_frames(job.upload.path, job.num_frames)
+
+    def _inference(self, job: Job):
+        if job.out is None:
+            violation_labels = self.checker.get_violation_labels_from_frames(job.frames, job.cache_key)
+            job.out = {"violation_labels": violation_labels}
+            job.frames = None
+        job.out["ad_category"] = self.checker.get_ad_category(ad_description = job.form.get('description'))
+
+    def _assignment(self, job: Job):
+        form = job.form
+        video_violation_values = list(job.out["violation_labels"].values())
+        confidence = round(calculate_confidence(video_violation_values), 3)
+        ad_results = analyse_ad(form.get('adTitle'), form.get('advertiserName'), form.get('description'),
+                                form.get('deliveryMarket'), form.get('productLine'), form.get('taskType'),
+                                form.get('startDate'), None, confidence)
+        job.result = format_results(job.out, ad_results, confidence)
+
+    def shutdown(self):
+        for pool in self.pools.values():
+            pool.shutdown(wait=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            jobs = list(self._jobs.values())
+        counts = {}
+        for job in jobs:
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return {"jobs": counts, "pending": {stage: pool._work_queue.qsize() for stage, pool in self.pools.items()}}
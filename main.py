@@ -1,15 +1,31 @@
 import json
+import logging
 import os
-from flask import Flask, request, render_template
+import threading
+from flask import Flask, Response, request, render_template
 from flask_cors import CORS, cross_origin
-from func import extract_frames_from_video, analyse_ad, calculate_confidence, top_category, get_top_violations
-from werkzeug.datastructures import FileStorage
+import numpy as np
+from func import analyse_ad, analyse_ads, calculate_confidence, calculate_confidences, format_results, top_violations
 
-from violations.violation_checker import ViolationChecker
+from assignment import NoCapacityError
+from capacity_ledger import get_capacity_ledger
+from instrumentation import PROFILING_ENABLED, SamplingProfiler, configure_logging, render_metrics, timed
+from jobs import JobPipeline
+from reference_data import get_reference_store
+from scoring import get_scoring_bounds
+from uploads import UploadRequest, ingest_stats, ingest_upload
+from violations.violation_checker import get_checker
 
 DEFAULT_FILE_NAME = "videoFile"
+# Ads accepted by one /upload/batch request
+MAX_BATCH_ADS = int(os.environ.get("MAX_BATCH_ADS", 64))
+FORM_FIELDS = ("adTitle", "advertiserName", "description", "deliveryMarket", "productLine", "taskType", "startDate")
+
+configure_logging()
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
+app.request_class = UploadRequest
 CORS(app)
 app.config['SECRET_KEY'] = os.environ.get("SECRET_KEY")
 app.config['MAX_CONTENT_LENGTH'] = 1024 * 1024 * 1024  # 1GB
@@ -59,65 +75,248 @@ sample_data = {
     }
 }
 
-checker = ViolationChecker(config_path = 'violations/config.yaml')
+checker = get_checker(config_path = 'violations/config.yaml')
+# /ready reports ready once this finishes, whatever WSGI server hosts the app; serve.py has already warmed the
+# checker up before forking, so there this returns at once
+threading.Thread(target=checker.warm_up, name="warm-up", daemon=True).start()
+scheduler = checker.enable_batching(max_batch_size = int(os.environ.get("INFERENCE_MAX_BATCH_SIZE", 64)),
+                                    max_wait_ms = float(os.environ.get("INFERENCE_MAX_WAIT_MS", 10)))
+reference_store = get_reference_store()
+# Fail at startup rather than on every upload when scoring.py has not written any bounds
+get_scoring_bounds()
+capacity_ledger = get_capacity_ledger()
+pipeline = JobPipeline(checker,
+                       decode_workers = int(os.environ.get("DECODE_WORKERS", 4)),
+                       inference_workers = int(os.environ.get("INFERENCE_WORKERS", 2)),
+                       assignment_workers = int(os.environ.get("ASSIGNMENT_WORKERS", 2)))
 
 @app.route('/')
 def home():
     return render_template("index.html")
 
 
+@app.route('/ready')
+def ready():
+    # Only report ready once the models have served a warm-up inference
+    if not checker.warmed_up:
+        return json.dumps({"ready": False, "pid": os.getpid()}), 503
+    return json.dumps({"ready": True, "pid": os.getpid(), "startup_seconds": checker.startup_seconds})
+
+
+@app.route('/reference/stats')
+def reference_stats():
+    return json.dumps(reference_store.stats())
+
+
+@app.route('/capacity/stats')
+def capacity_stats():
+    return json.dumps(capacity_ledger.stats())
+
+
+@app.route('/ingest/stats')
+def ingest_statistics():
+    return json.dumps(ingest_stats.snapshot())
+
+
+@app.route('/cache/stats')
+def cache_stats():
+    return json.dumps({
+        "results": checker.result_cache.stats(),
+        "descriptions": checker.description_cache.stats()
+    })
+
+
+@app.route('/inference/stats')
+def inference_stats():
+    return json.dumps(scheduler.stats())
+
+
+@app.route('/sampling/stats')
+def sampling_stats():
+    return json.dumps(dict(checker.sampling_stats.snapshot(), mode=checker.sampling_mode, early_exit=checker.early_exit))
+
+
+@app.route('/ad-index/stats')
+def ad_index_stats():
+    if checker.ad_index is None:
+        return json.dumps({"enabled": False})
+    return json.dumps(dict(checker.ad_index.stats(), enabled=True, threshold=checker.ad_index_threshold))
+
+
+@app.route('/metrics')
+def metrics():
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+
 @app.route('/upload', methods=["GET", "POST"])
 @cross_origin(options=None)
 def upload():
     if request.method == "POST":
-        file = request.files.get(DEFAULT_FILE_NAME)
-        data = request.form
-        ad_title = data.get('adTitle')
-        advertiser_name = data.get('advertiserName')
-        description = data.get('description')
-        delivery_market = data.get('deliveryMarket')
-        product_line = data.get('productLine')
-        task_type = data.get('taskType')
-        date = data.get('startDate')
-        print(file)
-        # print(data)
-        # print(extract_frames_from_video(file, 10))
-
-        out = checker.get_results(ad_description = description, file_storage = file)
-
-        video_violation_values = list(out["violation_labels"].values())
-        confidence = round(calculate_confidence(video_violation_values), 3)
-
-        ad_results = analyse_ad(ad_title, advertiser_name, description, delivery_market, product_line, task_type, date, file, confidence)
-        
-        out = top_category(out)
-
-    json_data = {
-        "ad_score_equation": {
-        "score": ad_results["ad_score"],
-        "baseline_st": ad_results["baseline_st"],
-        "days_diff": ad_results["days_diff"],
-        "confidence": confidence
-    },
-    "moderator_matching": {
-        "moderator_id": ad_results["assigned_moderator"],
-        "moderator_score": ad_results["mod_score"],
-        "productivity": ad_results["normalized_productivity"],
-        "accuracy": ad_results["normalized_accuracy"],
-        "remaining_tasks": ad_results["remaining_tasks_today"],
-        "market": ad_results["market"],
-        "expertise": "No Data",
-        "utilization": ad_results["new_utilisation"]
-    }
-    }
+        try:
+            # ?profile=1 samples every thread's stack while the request runs, when the server allows it
+            if PROFILING_ENABLED and request.args.get("profile") == "1":
+                with SamplingProfiler() as profiler:
+                    result_json = score_upload()
+                result_json["profile"] = profiler.summary()
+            else:
+                result_json = score_upload()
+        except NoCapacityError as e:
+            return json.dumps({"error": str(e)}), 409
+        return json.dumps(result_json)
+    return "post method only please"
 
-    out["violation_labels"] = get_top_violations(out["violation_labels"])
 
-    result_json = out | json_data
-    print(result_json)
+@timed("request")
+def score_upload() -> dict:
+    file = request.files.get(DEFAULT_FILE_NAME)
+    data = request.form
+    ad_title = data.get('adTitle')
+    advertiser_name = data.get('advertiserName')
+    description = data.get('description')
+    delivery_market = data.get('deliveryMarket')
+    product_line = data.get('productLine')
+    task_type = data.get('taskType')
+    date = data.get('startDate')
+    logger.info("upload received", extra={"upload": file.filename if file else None, "ad_title": ad_title,
+                                          "delivery_market": delivery_market})
 
-    return json.dumps(result_json)
-    return "post method only please"
+    out = checker.get_results(ad_description = description, file_storage = file)
+
+    video_violation_values = list(out["violation_labels"].values())
+    confidence = round(calculate_confidence(video_violation_values), 3)
+
+    ad_results = analyse_ad(ad_title, advertiser_name, description, delivery_market, product_line, task_type, date, file, confidence)
+
+    result_json = format_results(out, ad_results, confidence)
+    logger.debug("upload scored", extra={"result": result_json})
+
+    return result_json
+
+
+@app.route('/upload/batch', methods=["POST"])
+@cross_origin(options=None)
+def upload_batch():
+    try:
+        ads = read_batch()
+    except ValueError as e:
+        return json.dumps({"error": str(e)}), 400
+    logger.info("batch received", extra={"ads": len(ads)})
+    return json.dumps({"results": score_batch(ads)})
+
+
+def read_batch() -> list:
+    """
+    The ads of a /upload/batch request, in submission order
+
+    Either a "manifest" field (or file part) holding a JSON list with the /upload form fields of each ad and, under
+    videoFile, the name of the file part holding its video; or videoFile repeated once per ad, with each form field
+    repeated once per ad in the same order or given once for every ad.
+
+    :return: (form fields, video) of each ad
+    """
+    manifest = request.form.get("manifest")
+    if manifest is None and "manifest" in request.files:
+        manifest = request.files["manifest"].read().decode()
+    if manifest is not None:
+        try:
+            entries = json.loads(manifest)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"manifest is not valid JSON: {e}")
+        if not isinstance(entries, list) or not all(isinstance(entry, dict) for entry in entries):
+            raise ValueError("manifest must be a JSON list of objects")
+        if len(entries) > MAX_BATCH_ADS:
+            raise ValueError(f"{len(entries)} ads in one batch; the limit is {MAX_BATCH_ADS}")
+        ads = []
+        for i, entry in enumerate(entries):
+            name = entry.get(DEFAULT_FILE_NAME)
+            if name not in request.files:
+                raise ValueError(f"manifest entry {i} names file part {name!r}, which is not in the request")
+            ads.append(({field: entry.get(field) for field in FORM_FIELDS}, request.files[name]))
+    else:
+        files = request.files.getlist(DEFAULT_FILE_NAME)
+        if len(files) > MAX_BATCH_ADS:
+            raise ValueError(f"{len(files)} ads in one batch; the limit is {MAX_BATCH_ADS}")
+        forms = [{} for _ in files]
+        for field in FORM_FIELDS:
+            values = request.form.getlist(field)
+            if len(values) not in (0, 1, len(files)):
+                raise ValueError(f"{field} is given {len(values)} times for {len(files)} videos")
+            for i, form in enumerate(forms):
+                form[field] = values[0] if len(values) == 1 else values[i] if values else None
+        ads = list(zip(forms, files))
+    if not ads:
+        raise ValueError(f"no ads: send {DEFAULT_FILE_NAME} once per ad, or a manifest")
+    return ads
+
+
+def score_batch(ads: list) -> list:
+    """
+    Score a batch of ads with one call per encoder, one vectorized scoring pass and one moderator assignment
+
+    :param ads: (form fields, video) of each ad
+    :return: /upload response of each ad, in the same order, or {"error": ...} for an ad that could not be scored
+    """
+    outs = checker.get_results_batch([form.get("description") or "" for form, _ in ads], [file for _, file in ads])
+    scored = [i for i, out in enumerate(outs) if not isinstance(out, Exception)]
+
+    values = np.array([list(outs[i]["violation_labels"].values()) for i in scored], dtype=np.float64)
+    values = values.reshape(len(scored), len(checker.violation_labels))
+    confidences = np.round(calculate_confidences(values), 3)
+    violations = top_violations(values, checker.violation_labels)
+    forms = [ads[i][0] for i in scored]
+    ad_results = analyse_ads([form.get("deliveryMarket") for form in forms], [form.get("productLine") for form in forms],
+                             [form.get("taskType") for form in forms], [form.get("startDate") for form in forms],
+                             confidences)
+
+    results = [{"error": str(out)} if isinstance(out, Exception) else None for out in outs]
+    for i, confidence, top, ad_result in zip(scored, confidences.tolist(), violations, ad_results):
+        if isinstance(ad_result, Exception):
+            results[i] = {"error": str(ad_result)}
+        else:
+            results[i] = format_results(outs[i], ad_result, confidence, top)
+    return results
+
+
+@app.route('/jobs', methods=["POST"])
+@cross_origin(options=None)
+def submit_job():
+    file = request.files.get(DEFAULT_FILE_NAME)
+    if file is None:
+        return json.dumps({"error": f"missing {DEFAULT_FILE_NAME}"}), 400
+
+    # The job keeps the uploaded file after this request returns
+    upload = ingest_upload(file, take_ownership = True)
+    job = pipeline.submit(request.form.to_dict(), upload)
+    return json.dumps({"job_id": job.id, "status": job.status}), 202
+
+
+@app.route('/jobs/<job_id>')
+@cross_origin(options=None)
+def job_status(job_id):
+    job = pipeline.get(job_id)
+    if job is None:
+        return json.dumps({"error": "unknown job"}), 404
+    return json.dumps(job.to_dict())
+
+
+@app.route('/jobs/<job_id>/events')
+@cross_origin(options=None)
+def job_events(job_id):
+    job = pipeline.get(job_id)
+    if job is None:
+        return json.dumps({"error": "unknown job"}), 404
+
+    def stream():
+        for event in job.events():
+            # A comment line, which EventSource ignores, keeps the connection open through long stages
+            yield ": keepalive\n\n" if event is None else f"data: {json.dumps(event)}\n\n"
+
+    return Response(stream(), mimetype="text/event-stream")
+
+
+@app.route('/jobs/stats')
+def job_stats():
+    return json.dumps(pipeline.stats())
 
 if __name__ == "__main__":
     app.run(debug=True)
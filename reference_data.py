@@ -0,0 +1,224 @@
+import ast
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import stage_seconds
+
+ST_COMBINATIONS_PATH = "./EDA/Datasets/st_combinations.xlsx"
+MODERATOR_DATA_PATH = os.environ.get("MODERATOR_DATA_PATH", "./Scoring/moderator_scored.xlsx")
+DEFAULT_BASELINE_ST = 1.20
+
+
+def read_table(path: str) -> pd.DataFrame:
+    """
+    Read a table from Excel, CSV or Parquet (a file or a directory of part files, memory-mapped)
+
+    :param path: path to the table
+    :return: the table
+    """
+    if path.endswith((".xlsx", ".xls")):
+        return pd.read_excel(path)
+    if path.endswith(".csv"):
+        return pd.read_csv(path)
+    import pyarrow.parquet as pq
+    return pq.read_table(path, memory_map=True).to_pandas()
+
+
+class LatencyCounter:
+
+    def __init__(self):
+        """
+        Thread-safe count / total / max accumulator for lookup latencies
+        """
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def record(self, seconds: float):
+        with self._lock:
+            self.count += 1
+            self.total_seconds += seconds
+            if seconds > self.max_seconds:
+                self.max_seconds = seconds
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            mean = self.total_seconds / self.count if self.count else 0.0
+            return {
+                "count": self.count,
+                "total_seconds": self.total_seconds,
+                "mean_seconds": mean,
+                "max_seconds": self.max_seconds
+            }
+
+
+class ReferenceData:
+
+    def __init__(self, st_path: str, moderator_path: str):
+        """
+        Immutable snapshot of the reference tables used by the ad scorer
+
+        :param st_path: path to the st_combinations spreadsheet
+        :param moderator_path: path to the scored moderator spreadsheet
+        """
+        self.st_path = st_path
+        self.moderator_path = moderator_path
+        self.mtimes = (os.path.getmtime(st_path), os.path.getmtime(moderator_path))
+        self.loaded_at = time.time()
+
+        # Tuple-keyed baseline_st lookup
+        st = read_table(st_path)
+        keys = zip(st['delivery_country'], st['product_line'], st['task_type_en'])
+        self.st_dict = dict(zip(keys, st['baseline_st'].astype(float)))
+
+        # Columnar moderator attributes, one row per moderator
+        moderators = read_table(moderator_path)
+        self.frame = moderators
+        self.moderator = moderators['moderator'].to_numpy()
+        self.moderator_score = moderators['moderator_score'].to_numpy(dtype=np.float64)
+        self.normalized_productivity = moderators['normalized_productivity'].to_numpy(dtype=np.float64)
+        self.normalized_accuracy = moderators['normalized_accuracy'].to_numpy(dtype=np.float64)
+        self.max_tasks_per_day = moderators['max_tasks_per_day'].to_numpy(dtype=np.float64)
+        self.handling_time = moderators['handling time'].to_numpy(dtype=np.float64)
+        self.utilisation = moderators['Utilisation %'].to_numpy(dtype=np.float64)
+        self.market = moderators['market'].to_numpy(dtype=object)
+        self.moderator_index = {mod: i for i, mod in enumerate(self.moderator.tolist())}
+
+        # Market -> moderator row indices, parsed once instead of per request
+        market_rows = {}
+        for i, markets in enumerate(self.market):
+            for market in ast.literal_eval(markets):
+                market_rows.setdefault(market, []).append(i)
+        self.market_index = {k: np.asarray(v, dtype=np.intp) for k, v in market_rows.items()}
+        self._empty = np.empty(0, dtype=np.intp)
+
+    def __len__(self) -> int:
+        return len(self.moderator)
+
+    def baseline_st(self, delivery_market: str, product_line: str, task_type: str) -> float:
+        return self.st_dict.get((delivery_market, product_line, task_type), DEFAULT_BASELINE_ST)
+
+    def matching_moderators(self, delivery_market: str) -> np.ndarray:
+        return self.market_index.get(delivery_market, self._empty)
+
+
+class ReferenceStore:
+
+    def __init__(self, st_path: str = ST_COMBINATIONS_PATH, moderator_path: str = MODERATOR_DATA_PATH,
+                 poll_interval: float = 5.0):
+        """
+        Holds the current ReferenceData snapshot and swaps in a fresh one when the source files change
+
+        :param st_path: path to the st_combinations spreadsheet
+        :param moderator_path: path to the scored moderator spreadsheet
+        :param poll_interval: seconds between modification-time checks (default: 5.0)
+        """
+        self.st_path = st_path
+        self.moderator_path = moderator_path
+        self.poll_interval = poll_interval
+
+        self._data = ReferenceData(st_path, moderator_path)
+        self._reload_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.reloads = 0
+        self.reload_errors = 0
+        self.st_lookups = LatencyCounter()
+        self.market_lookups = LatencyCounter()
+
+    @property
+    def data(self) -> ReferenceData:
+        """Current snapshot; callers should hold on to it for the duration of a request"""
+        return self._data
+
+    def baseline_st(self, delivery_market: str, product_line: str, task_type: str) -> float:
+        start = time.perf_counter()
+        value = self._data.baseline_st(delivery_market, product_line, task_type)
+        seconds = time.perf_counter() - start
+        self.st_lookups.record(seconds)
+        stage_seconds.observe("reference_lookup", seconds)
+        return value
+
+    def matching_moderators(self, delivery_market: str) -> np.ndarray:
+        start = time.perf_counter()
+        rows = self._data.matching_moderators(delivery_market)
+        seconds = time.perf_counter() - start
+        self.market_lookups.record(seconds)
+        stage_seconds.observe("reference_lookup", seconds)
+        return rows
+
+    def is_stale(self) -> bool:
+        try:
+            mtimes = (os.path.getmtime(self.st_path), os.path.getmtime(self.moderator_path))
+        except OSError:
+            return False
+        return mtimes != self._data.mtimes
+
+    def reload(self) -> bool:
+        """
+        Rebuild the snapshot from disk and swap it in atomically
+
+        :return: True if a new snapshot was installed
+        """
+        with self._reload_lock:
+            if not self.is_stale():
+                return False
+            try:
+                data = ReferenceData(self.st_path, self.moderator_path)
+            except Exception:
+                # Keep serving the previous snapshot if the files are mid-write or malformed
+                self.reload_errors += 1
+                return False
+            self._data = data
+            self.reloads += 1
+            return True
+
+    def start(self) -> "ReferenceStore":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._watch, name="reference-data-watcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _watch(self):
+        while not self._stop.wait(self.poll_interval):
+            self.reload()
+
+    def stats(self) -> dict:
+        data = self._data
+        return {
+            "moderators": len(data),
+            "st_combinations": len(data.st_dict),
+            "loaded_at": data.loaded_at,
+            "reloads": self.reloads,
+            "reload_errors": self.reload_errors,
+            "st_lookups": self.st_lookups.snapshot(),
+            "market_lookups": self.market_lookups.snapshot()
+        }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_reference_store() -> ReferenceStore:
+    """
+    Get the process-wide reference store, loading and starting it on first use
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ReferenceStore().start()
+    return _store
@@ -0,0 +1,452 @@
+"""
+Vectorized ad and moderator scoring from Scoring/ad-score.ipynb and Scoring/moderator-score.ipynb
+
+    python scoring.py --ads EDA/Datasets/ad-data-cleaned.xlsx --moderators EDA/Datasets/moderator-data-cleaned.xlsx
+
+Scored tables are stored as Parquet under Scoring/store and the normalization bounds they were computed
+with as versioned JSON artifacts under Scoring/bounds. Rerunning after rows have been appended to a source
+table only scores the new rows, unless they fall outside the current bounds.
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from capacity_ledger import PAID_HOURS_PER_DAY
+from reference_data import read_table
+
+AD_DATA_PATH = "./EDA/Datasets/ad-data-cleaned.xlsx"
+MODERATOR_SOURCE_PATH = "./EDA/Datasets/moderator-data-cleaned.xlsx"
+SCORING_STORE_PATH = "./Scoring/store"
+BOUNDS_PATH = "./Scoring/bounds"
+
+# Advertiser tier score weights on avg_ad_revenue, punish_num and days_since_last_punishment
+TIER_WEIGHTS = (0.5, -0.25, 0.25)
+NUM_TIERS = 10
+# Advertisers never punished are treated as last punished this many days ago
+DEFAULT_DAYS_SINCE_PUNISHMENT = 91
+
+# Priority model: maximise sum(beta * features_i * x_i) - lambda * sum((x_i - 0.5)^2) subject to mean(x) = 0.5
+PRIORITY_BETA = 0.25
+PRIORITY_LAMBDA = 20
+
+# Share of a moderator's paid day that new assignments may add to their utilisation
+MAX_UTILISATION_INCREASE = 0.1
+
+
+def min_max(values) -> dict:
+    return {"min": float(np.nanmin(values)), "max": float(np.nanmax(values))}
+
+
+def normalize(values, bounds: dict):
+    """
+    Min-max normalization against stored bounds
+
+    :param values: scalar or array
+    :param bounds: {"min": ..., "max": ...}
+    :return: normalized values, outside [0, 1] for values outside the bounds
+    """
+    return (values - bounds["min"]) / (bounds["max"] - bounds["min"])
+
+
+def within(values, bounds: dict) -> bool:
+    values = np.asarray(values, dtype=np.float64)
+    values = values[~np.isnan(values)]
+    return bool(np.all((values >= bounds["min"]) & (values <= bounds["max"])))
+
+
+def raw_days_diff(ads: pd.DataFrame) -> np.ndarray:
+    """Days between upload and the requested start date, NaN where the start date is missing"""
+    return (pd.to_datetime(ads["start_time"]) - pd.to_datetime(ads["p_date"])).dt.days.to_numpy(dtype=np.float64)
+
+
+def impute_days_diff(days_diff: np.ndarray, mean_positive: float) -> np.ndarray:
+    # Negative and missing differences are replaced with the mean of the positive ones
+    return np.where(np.isnan(days_diff) | (days_diff < 0), mean_positive, days_diff)
+
+
+def tier_scores(ads: pd.DataFrame) -> np.ndarray:
+    days_since_punishment = ads["days_since_last_punishment"].fillna(DEFAULT_DAYS_SINCE_PUNISHMENT)
+    revenue, punishments, days = TIER_WEIGHTS
+    return (revenue * ads["avg_ad_revenue"] + punishments * ads["punish_num"] + days * days_since_punishment).to_numpy(dtype=np.float64)
+
+
+def assign_tiers(scores: np.ndarray, thresholds: list) -> np.ndarray:
+    """Tier 1 to NUM_TIERS: one more than the number of decile thresholds below the score"""
+    return np.minimum(np.searchsorted(np.asarray(thresholds), scores, side="left") + 1, NUM_TIERS)
+
+
+def priority_scores(coefficients: np.ndarray, shift: float) -> np.ndarray:
+    """
+    Closed-form optimum of the priority model
+
+    Setting the gradient of each (separable, concave) term to the constraint's multiplier gives
+    x_i = 0.5 + (c_i - shift) / (2 * lambda), clipped to [0, 1].
+    """
+    return np.clip(0.5 + (coefficients - shift) / (2 * PRIORITY_LAMBDA), 0.0, 1.0)
+
+
+def fit_priority_shift(coefficients: np.ndarray, iterations: int = 100) -> float:
+    """
+    The multiplier of the mean(x) = 0.5 constraint, found by bisection since mean(x) falls as it grows
+    """
+    low = float(coefficients.min()) - 2 * PRIORITY_LAMBDA
+    high = float(coefficients.max()) + 2 * PRIORITY_LAMBDA
+    for _ in range(iterations):
+        shift = (low + high) / 2
+        if priority_scores(coefficients, shift).mean() > 0.5:
+            low = shift
+        else:
+            high = shift
+    return (low + high) / 2
+
+
+def _ad_features(ads: pd.DataFrame, bounds: dict, known_tiers: dict = None) -> pd.DataFrame:
+    out = ads.drop(columns=[c for c in ads.columns if c.startswith("Unnamed")])
+    days_diff = impute_days_diff(raw_days_diff(ads), bounds["mean_positive_days_diff"])
+    out["days_diff"] = days_diff
+    out["tier_score"] = tier_scores(ads)
+
+    # An advertiser (identified by avg_ad_revenue) keeps the tier of its first scored ad
+    tiers = pd.Series(assign_tiers(out["tier_score"].to_numpy(), bounds["tier_thresholds"]), index=out.index)
+    tiers = tiers.groupby(out["avg_ad_revenue"], dropna=False).transform("first")
+    if known_tiers:
+        tiers = out["avg_ad_revenue"].map(known_tiers).fillna(tiers)
+    out["tier"] = tiers.astype(np.int64)
+
+    out["normalized_baseline_st"] = normalize(out["baseline_st"], bounds["baseline_st"])
+    out["normalized_days_diff"] = 1 - normalize(out["days_diff"], bounds["days_diff"])
+    out["ad_score"] = np.round(np.abs((out["normalized_baseline_st"] + out["normalized_days_diff"]) / 2), 3)
+
+    # Advertisers with very few or very many punishments are the ones we are confident about
+    out["confidence"] = np.abs(np.sin(normalize(out["punish_num"], bounds["punish_num"]) * np.pi - np.pi / 2))
+    return out
+
+
+def _priority_coefficients(features: pd.DataFrame) -> np.ndarray:
+    return PRIORITY_BETA * (features["avg_ad_revenue"] + features["baseline_st"] - features["days_diff"]
+                            + features["tier"]).to_numpy(dtype=np.float64)
+
+
+def fit_ad_bounds(ads: pd.DataFrame) -> dict:
+    """
+    Normalization bounds, tier thresholds and priority shift of a full ad table
+
+    :param ads: ad table with the columns of EDA/Datasets/ad-data-cleaned.xlsx
+    :return: JSON-serialisable bounds
+    """
+    raw = raw_days_diff(ads)
+    mean_positive = float(np.nanmean(raw[raw > 0]))
+    scores = pd.Series(tier_scores(ads))
+    advertiser_scores = scores[~ads["avg_ad_revenue"].duplicated().to_numpy()]
+
+    bounds = {
+        "mean_positive_days_diff": mean_positive,
+        "days_diff": min_max(impute_days_diff(raw, mean_positive)),
+        "baseline_st": min_max(ads["baseline_st"]),
+        "punish_num": min_max(ads["punish_num"]),
+        "tier_thresholds": [float(advertiser_scores.quantile(i / NUM_TIERS)) for i in range(1, NUM_TIERS + 1)]
+    }
+    bounds["priority_shift"] = fit_priority_shift(_priority_coefficients(_ad_features(ads, bounds)))
+    return bounds
+
+
+def score_ads(ads: pd.DataFrame, bounds: dict, known_tiers: dict = None) -> pd.DataFrame:
+    """
+    Score ads against fitted bounds
+
+    :param ads: ad table with the columns of EDA/Datasets/ad-data-cleaned.xlsx
+    :param bounds: output of fit_ad_bounds
+    :param known_tiers: avg_ad_revenue -> tier of advertisers scored earlier (default: none)
+    :return: the ads with days_diff, tier_score, tier, normalized_baseline_st, normalized_days_diff,
+             ad_score, priority_score and confidence columns
+    """
+    features = _ad_features(ads, bounds, known_tiers)
+    features["priority_score"] = priority_scores(_priority_coefficients(features), bounds["priority_shift"])
+    return features
+
+
+def ads_within(ads: pd.DataFrame, bounds: dict) -> bool:
+    """Whether scoring these ads against the bounds keeps every normalized value in [0, 1]"""
+    days_diff = impute_days_diff(raw_days_diff(ads), bounds["mean_positive_days_diff"])
+    return (within(days_diff, bounds["days_diff"]) and within(ads["baseline_st"], bounds["baseline_st"])
+            and within(ads["punish_num"], bounds["punish_num"]))
+
+
+def fit_moderator_bounds(moderators: pd.DataFrame) -> dict:
+    """
+    Normalization bounds of a full moderator table
+
+    :param moderators: moderator table with the columns of EDA/Datasets/moderator-data-cleaned.xlsx
+    :return: JSON-serialisable bounds
+    """
+    moderators = moderators[moderators["handling time"] > 0]
+    return {
+        "accuracy": dict(min_max(moderators["accuracy"]), mean=float(moderators["accuracy"].mean())),
+        "productivity": min_max(moderators["Productivity"])
+    }
+
+
+def score_moderators(moderators: pd.DataFrame, bounds: dict) -> pd.DataFrame:
+    """
+    Score moderators against fitted bounds
+
+    :param moderators: moderator table with the columns of EDA/Datasets/moderator-data-cleaned.xlsx
+    :param bounds: output of fit_moderator_bounds
+    :return: moderators with a handling time, with normalized_accuracy, normalized_productivity,
+             moderator_score, max_tasks_per_day and expertise columns
+    """
+    out = moderators[moderators["handling time"] > 0]
+    out = out.drop(columns=[c for c in out.columns if c.startswith("Unnamed")])
+    out["accuracy"] = out["accuracy"].fillna(bounds["accuracy"]["mean"])
+    out["normalized_accuracy"] = normalize(out["accuracy"], bounds["accuracy"])
+    out["normalized_productivity"] = normalize(out["Productivity"], bounds["productivity"])
+    out["moderator_score"] = (out["normalized_accuracy"] + out["normalized_productivity"]) / 2
+    out["max_tasks_per_day"] = (MAX_UTILISATION_INCREASE * PAID_HOURS_PER_DAY * 60 * 60 * 1000) / out["handling time"]
+    # No expertise data yet
+    out["expertise"] = "[]"
+    return out
+
+
+def moderators_within(moderators: pd.DataFrame, bounds: dict) -> bool:
+    moderators = moderators[moderators["handling time"] > 0]
+    return (within(moderators["accuracy"], bounds["accuracy"])
+            and within(moderators["Productivity"], bounds["productivity"]))
+
+
+class BoundsStore:
+
+    def __init__(self, directory: str = BOUNDS_PATH):
+        """
+        Versioned normalization bounds, one immutable JSON file per version
+
+        :param directory: directory of bounds-vNNNN.json files
+        """
+        self.directory = directory
+
+    def versions(self) -> list:
+        names = glob.glob(os.path.join(self.directory, "bounds-v*.json"))
+        return sorted(int(os.path.basename(name)[len("bounds-v"):-len(".json")]) for name in names)
+
+    def load(self, version: int = None) -> dict:
+        """
+        :param version: version to load (default: the latest)
+        :return: the bounds artifact, or None if there is none
+        """
+        if version is None:
+            versions = self.versions()
+            if not versions:
+                return None
+            version = versions[-1]
+        with open(os.path.join(self.directory, f"bounds-v{version:04d}.json")) as f:
+            return json.load(f)
+
+    def save(self, ads: dict, moderators: dict, sources: dict) -> dict:
+        """
+        Write a new version
+
+        :param ads: output of fit_ad_bounds
+        :param moderators: output of fit_moderator_bounds
+        :param sources: where the bounds were fitted from, kept for reference
+        :return: the artifact, including its version number
+        """
+        versions = self.versions()
+        artifact = {
+            "version": versions[-1] + 1 if versions else 1,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "sources": sources,
+            "ads": ads,
+            "moderators": moderators
+        }
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"bounds-v{artifact['version']:04d}.json")
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(artifact, f, indent=2)
+        os.replace(tmp_path, path)
+        return artifact
+
+
+def fingerprint(table: pd.DataFrame) -> str:
+    """Hash of a table's contents, used to check that already-scored rows have not changed"""
+    return hashlib.sha256(pd.util.hash_pandas_object(table, index=False).to_numpy().tobytes()).hexdigest()
+
+
+class ScoringStore:
+
+    def __init__(self, directory: str = SCORING_STORE_PATH, bounds: BoundsStore = None):
+        """
+        Scored ad and moderator tables as Parquet datasets, updated incrementally as source rows are appended
+
+        :param directory: directory holding one Parquet dataset per table and the update state
+        :param bounds: where normalization bounds are versioned (default: Scoring/bounds)
+        """
+        self.directory = directory
+        self.bounds = bounds or BoundsStore()
+        self._state_path = os.path.join(directory, "state.json")
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def table(self, name: str, columns: list = None) -> pd.DataFrame:
+        """
+        Read a scored table, memory-mapping its Parquet files
+
+        :param name: "ads" or "moderators"
+        :param columns: only read these columns (default: all)
+        :return: the table, or None if it has not been scored yet
+        """
+        import pyarrow.parquet as pq
+
+        if not os.path.isdir(self.path(name)):
+            return None
+        return pq.read_table(self.path(name), columns=columns, memory_map=True).to_pandas()
+
+    def _state(self) -> dict:
+        if not os.path.exists(self._state_path):
+            return {}
+        with open(self._state_path) as f:
+            return json.load(f)
+
+    def _save_state(self, state: dict):
+        tmp_path = f"{self._state_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp_path, self._state_path)
+
+    def _append(self, name: str, table: pd.DataFrame):
+        path = self.path(name)
+        os.makedirs(path, exist_ok=True)
+        part = os.path.join(path, f"part-{len(glob.glob(os.path.join(path, 'part-*.parquet'))):06d}.parquet")
+        tmp_path = f"{part}.tmp"
+        table.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, part)
+
+    def _rewrite(self, name: str, table: pd.DataFrame):
+        # Build the new dataset next to the old one and swap the directories
+        path = self.path(name)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        table.to_parquet(os.path.join(tmp_path, "part-000000.parquet"), index=False)
+        if os.path.isdir(path):
+            old_path = f"{path}.{os.getpid()}.old"
+            os.replace(path, old_path)
+            os.replace(tmp_path, path)
+            shutil.rmtree(old_path)
+        else:
+            os.replace(tmp_path, path)
+
+    def update(self, ads_path: str = AD_DATA_PATH, moderators_path: str = MODERATOR_SOURCE_PATH,
+               refit: bool = False) -> dict:
+        """
+        Bring the scored tables up to date with their sources
+
+        Rows appended to a source since the last update are scored against the current bounds and written
+        as a new Parquet part. Everything is refitted and rescored, under a new bounds version, when there are
+        no bounds yet, when refit is set, when an already-scored row has changed, or when an appended row
+        falls outside the bounds (which would put normalized values outside [0, 1]).
+
+        :param ads_path: ad source table (Excel, CSV or Parquet)
+        :param moderators_path: moderator source table (Excel, CSV or Parquet)
+        :param refit: refit the bounds even if the new rows are within them (default: False)
+        :return: summary of what was recomputed
+        """
+        sources = {"ads": read_table(ads_path), "moderators": read_table(moderators_path)}
+        state = self._state()
+        artifact = self.bounds.load()
+
+        # Rows beyond the previously scored prefix, provided that prefix is unchanged
+        appended = {}
+        for name, source in sources.items():
+            scored = state.get(name, {})
+            rows = scored.get("rows", 0)
+            if artifact is None or scored.get("version") != artifact["version"] or rows > len(source) \
+                    or fingerprint(source.iloc[:rows]) != scored.get("fingerprint"):
+                appended = None
+                break
+            appended[name] = source.iloc[rows:]
+
+        if appended is not None and not refit:
+            refit = not (ads_within(appended["ads"], artifact["ads"])
+                         and moderators_within(appended["moderators"], artifact["moderators"]))
+        else:
+            refit = True
+
+        if refit:
+            artifact = self.bounds.save(fit_ad_bounds(sources["ads"]), fit_moderator_bounds(sources["moderators"]),
+                                        {"ads": {"path": ads_path, "rows": len(sources["ads"])},
+                                         "moderators": {"path": moderators_path, "rows": len(sources["moderators"])}})
+            scored = {"ads": score_ads(sources["ads"], artifact["ads"]),
+                      "moderators": score_moderators(sources["moderators"], artifact["moderators"])}
+            for name, table in scored.items():
+                table["bounds_version"] = artifact["version"]
+                self._rewrite(name, table)
+        else:
+            known = self.table("ads", columns=["avg_ad_revenue", "tier"])
+            known_tiers = dict(zip(known["avg_ad_revenue"], known["tier"])) if known is not None else None
+            scored = {"ads": score_ads(appended["ads"], artifact["ads"], known_tiers),
+                      "moderators": score_moderators(appended["moderators"], artifact["moderators"])}
+            for name, table in scored.items():
+                if len(table):
+                    table["bounds_version"] = artifact["version"]
+                    self._append(name, table)
+
+        for name, source in sources.items():
+            state[name] = {"rows": len(source), "fingerprint": fingerprint(source), "version": artifact["version"]}
+        self._save_state(state)
+        return {
+            "bounds_version": artifact["version"],
+            "refit": refit,
+            "scored": {name: len(table) for name, table in scored.items()}
+        }
+
+
+_bounds = None
+_bounds_mtime = None
+_bounds_lock = threading.Lock()
+
+
+def get_scoring_bounds(directory: str = BOUNDS_PATH) -> dict:
+    """
+    Get the latest normalization bounds, picking up new versions as they are written
+
+    :param directory: directory of the bounds artifacts
+    :return: the latest artifact; its "ads" and "moderators" entries hold the bounds
+    :raises FileNotFoundError: if the directory holds no artifact
+    """
+    global _bounds, _bounds_mtime
+    mtime = os.path.getmtime(directory) if os.path.isdir(directory) else None
+    if mtime is None or mtime != _bounds_mtime:
+        with _bounds_lock:
+            _bounds = BoundsStore(directory).load() if mtime is not None else None
+            _bounds_mtime = mtime
+    if _bounds is None:
+        raise FileNotFoundError(f"No normalization bounds in {directory}; run scoring.py first")
+    return _bounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--ads", default=AD_DATA_PATH)
+    parser.add_argument("--moderators", default=MODERATOR_SOURCE_PATH)
+    parser.add_argument("--store", default=SCORING_STORE_PATH)
+    parser.add_argument("--bounds", default=BOUNDS_PATH)
+    parser.add_argument("--refit", action="store_true", help="refit the bounds and rescore every row")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    summary = ScoringStore(args.store, BoundsStore(args.bounds)).update(args.ads, args.moderators, refit=args.refit)
+    summary["seconds"] = time.perf_counter() - start
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Production entry point: load and warm the models once, then fork worker processes that share them
+
+    python serve.py --workers 4 --port 5000
+"""
+import argparse
+import gc
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+
+import torch
+
+from instrumentation import configure_logging
+from violations.violation_checker import get_checker
+
+CONFIG_PATH = "violations/config.yaml"
+
+logger = logging.getLogger("serve")
+
+
+def load_models():
+    """
+    Load and warm up the models in the parent process
+
+    Warm-up runs single-threaded so the parent never starts an OpenMP pool, which is not safe to
+    inherit across fork. After warm-up the long-lived objects are frozen out of the garbage
+    collector so its bookkeeping does not write to (and un-share) their pages in the workers.
+    """
+    torch.set_num_threads(1)
+    checker = get_checker(config_path = CONFIG_PATH, threads = 1)
+    start = time.perf_counter()
+    checker.warm_up()
+    logger.info("models loaded and warmed up", extra={"seconds": time.perf_counter() - start,
+                                                      "startup_seconds": checker.startup_seconds})
+
+    # Import the rest of the app's dependencies (pandas, scipy, flask) here too so workers share them;
+    # these modules only start threads when first used
+    import jobs  # noqa: F401
+    import werkzeug.serving  # noqa: F401
+
+    gc.collect()
+    gc.freeze()
+    return checker
+
+
+def run_worker(sock: socket.socket, host: str, port: int, threads: int):
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, lambda *_: os._exit(0))
+    get_checker().backend.set_threads(threads)
+
+    # main builds the Flask app and starts its background threads, which must happen after fork
+    from werkzeug.serving import make_server
+    from main import app
+
+    server = make_server(host, port, app, threaded=True, fd=sock.fileno())
+    server.serve_forever()
+
+
+def spawn(sock: socket.socket, host: str, port: int, threads: int) -> int:
+    pid = os.fork()
+    if pid == 0:
+        try:
+            run_worker(sock, host, port, threads)
+        finally:
+            os._exit(1)
+    return pid
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--threads", type=int, help="encoder intra-op threads per worker (default: inference.threads in the config, else 1)")
+    args = parser.parse_args()
+
+    configure_logging()
+    checker = load_models()
+    args.threads = args.threads or (checker.config.get("inference") or {}).get("threads") or 1
+
+    # One listening socket shared by every worker; the kernel spreads connections across them
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(128)
+    sock.set_inheritable(True)
+
+    workers = {spawn(sock, args.host, args.port, args.threads) for _ in range(args.workers)}
+    logger.info("workers listening", extra={"workers": len(workers), "host": args.host, "port": args.port})
+
+    stopping = False
+
+    def stop(*_):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        workers.discard(pid)
+        if not stopping:
+            logger.warning("worker exited, restarting", extra={"worker_pid": pid, "status": status})
+            workers.add(spawn(sock, args.host, args.port, args.threads))
+
+    sock.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
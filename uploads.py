@@ -0,0 +1,209 @@
+import hashlib
+import mmap
+import os
+import tempfile
+import threading
+import time
+
+from flask import Request
+from werkzeug.datastructures import FileStorage
+
+from instrumentation import stage_seconds
+
+CHUNK_SIZE = 1024 * 1024  # 1MB
+
+
+class IngestStats:
+
+    def __init__(self):
+        """
+        Running totals of upload ingestion throughput
+        """
+        self._lock = threading.Lock()
+        self.uploads = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.last_bytes_per_second = 0.0
+
+    def record(self, size: int, seconds: float):
+        with self._lock:
+            self.uploads += 1
+            self.bytes += size
+            self.seconds += seconds
+            self.last_bytes_per_second = size / seconds if seconds > 0 else 0.0
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "uploads": self.uploads,
+                "bytes": self.bytes,
+                "seconds": self.seconds,
+                "bytes_per_second": self.bytes / self.seconds if self.seconds > 0 else 0.0,
+                "last_bytes_per_second": self.last_bytes_per_second
+            }
+
+
+ingest_stats = IngestStats()
+
+
+class HashingTempFile:
+
+    def __init__(self, suffix: str = ".mp4", dir: str = None):
+        """
+        Named temporary file that hashes everything written to it, used as the multipart upload container
+
+        :param suffix: file name suffix, kept so decoders can sniff the container format
+        :param dir: directory for the temporary file (default: the system temp dir)
+        """
+        fd, self.name = tempfile.mkstemp(suffix=suffix, dir=dir)
+        self._file = os.fdopen(fd, "w+b")
+        self._hash = hashlib.sha256()
+        self.size = 0
+        self.started = None
+        self.finished = None
+        self.owned = True
+
+    def write(self, data: bytes) -> int:
+        if self.started is None:
+            self.started = time.perf_counter()
+        self._hash.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        # Werkzeug rewinds the container once the part is fully received
+        if self.finished is None and self.started is not None:
+            self.finished = time.perf_counter()
+        return self._file.seek(offset, whence)
+
+    def read(self, size: int = -1) -> bytes:
+        return self._file.read(size)
+
+    def readinto(self, buffer) -> int:
+        return self._file.readinto(buffer)
+
+    def readline(self, size: int = -1) -> bytes:
+        return self._file.readline(size)
+
+    def tell(self) -> int:
+        return self._file.tell()
+
+    def flush(self):
+        self._file.flush()
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
+    def close(self):
+        self._file.close()
+        if self.owned:
+            try:
+                os.unlink(self.name)
+            except FileNotFoundError:
+                pass
+
+
+class UploadRequest(Request):
+    """
+    Request that streams multipart file parts straight into hashing temp files on disk
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        suffix = os.path.splitext(filename or "")[1] or ".mp4"
+        return HashingTempFile(suffix=suffix)
+
+
+class IngestedUpload:
+
+    def __init__(self, path: str, digest: str, size: int, seconds: float, owned: bool):
+        """
+        An upload that is fully on disk
+
+        :param path: path to the file
+        :param digest: sha256 hex digest of the contents
+        :param size: size in bytes
+        :param seconds: time spent receiving the contents
+        :param owned: whether closing this object deletes the file
+        """
+        self.path = path
+        self.digest = digest
+        self.size = size
+        self.seconds = seconds
+        self.owned = owned
+
+    @property
+    def bytes_per_second(self) -> float:
+        return self.size / self.seconds if self.seconds > 0 else 0.0
+
+    def mmap(self) -> mmap.mmap:
+        """Read-only memory map of the upload"""
+        with open(self.path, "rb") as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        if self.owned:
+            self.owned = False
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+
+    def __enter__(self) -> "IngestedUpload":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def ingest_upload(file_storage: FileStorage, chunk_size: int = CHUNK_SIZE, take_ownership: bool = False) -> IngestedUpload:
+    """
+    Get an uploaded file onto disk with its sha256, without holding the whole upload in memory
+
+    Uploads parsed by UploadRequest are already on disk and hashed, so they are handed over as-is.
+    Anything else is streamed to a temporary file in fixed-size chunks.
+
+    :param file_storage: the uploaded file
+    :param chunk_size: bytes copied per read (default: 1MB)
+    :param take_ownership: keep the file after the request closes, e.g. for background processing (default: False)
+    :return: the ingested upload; the caller should close it when done with the file
+    """
+    stream = file_storage.stream
+    if isinstance(stream, HashingTempFile):
+        stream.flush()
+        seconds = (stream.finished or time.perf_counter()) - (stream.started or time.perf_counter())
+        ingest_stats.record(stream.size, seconds)
+        stage_seconds.observe("ingest", seconds)
+        # Unless ownership is taken, the request removes the file when it is closed
+        if take_ownership:
+            stream.owned = False
+        return IngestedUpload(stream.name, stream.hexdigest(), stream.size, seconds, owned=take_ownership)
+
+    suffix = os.path.splitext(file_storage.filename or "")[1] or ".mp4"
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    digest = hashlib.sha256()
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    size = 0
+    start = time.perf_counter()
+    try:
+        with os.fdopen(fd, "wb") as f:
+            readinto = getattr(stream, "readinto", None)
+            while True:
+                if readinto is not None:
+                    n = readinto(view)
+                    chunk = view[:n]
+                else:
+                    chunk = stream.read(chunk_size)
+                    n = len(chunk)
+                if not n:
+                    break
+                digest.update(chunk)
+                f.write(chunk)
+                size += n
+    except Exception:
+        os.unlink(path)
+        raise
+    seconds = time.perf_counter() - start
+    ingest_stats.record(size, seconds)
+    stage_seconds.observe("ingest", seconds)
+    return IngestedUpload(path, digest.hexdigest(), size, seconds, owned=True)
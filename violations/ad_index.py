@@ -0,0 +1,356 @@
+"""
+Near-duplicate index of pooled CLIP frame embeddings and the violation labels they were given
+
+    python -m violations.ad_index violations/.cache/ad_index/<key> --train --nlist 1024
+"""
+import argparse
+import fcntl
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+META_NAME = "meta.json"
+# Rows searched exhaustively before the index first clusters itself
+TRAIN_SIZE = 20000
+KMEANS_SAMPLE_SIZE = 65536
+KMEANS_ITERATIONS = 10
+CHUNK_ROWS = 65536
+# Rows added since the inverted lists were last sorted that are scanned separately
+MAX_PENDING_ROWS = 4096
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12)
+
+
+def pool_embeddings(features: np.ndarray) -> np.ndarray:
+    """
+    One vector per ad: the normalized mean of its normalized frame embeddings
+
+    :param features: (frames, dim) CLIP image features
+    :return: (dim,) unit vector
+    """
+    return normalize_rows(normalize_rows(features).mean(axis=0))
+
+
+def nearest_centroids(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Index of the most similar centroid of every row, computed in chunks"""
+    out = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), CHUNK_ROWS):
+        chunk = np.asarray(vectors[start:start + CHUNK_ROWS], dtype=np.float32)
+        out[start:start + len(chunk)] = (chunk @ centroids.T).argmax(axis=1)
+    return out
+
+
+def kmeans(vectors: np.ndarray, k: int, iterations: int = KMEANS_ITERATIONS, seed: int = 0) -> np.ndarray:
+    """
+    Spherical k-means: clusters of unit vectors by cosine similarity
+
+    :param vectors: (n, dim) unit vectors, n >= k
+    :param k: number of clusters
+    :param iterations: Lloyd iterations (default: 10)
+    :param seed: random seed (default: 0)
+    :return: (k, dim) unit centroids
+    """
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=k, replace=False)]
+    for _ in range(iterations):
+        assign = nearest_centroids(vectors, centroids)
+        order = np.argsort(assign, kind="stable")
+        clusters, starts = np.unique(assign[order], return_index=True)
+        sums = np.add.reduceat(vectors[order], starts, axis=0)
+        # Clusters that lost every member restart from a random vector
+        centroids = vectors[rng.choice(len(vectors), size=k)]
+        centroids[clusters] = normalize_rows(sums)
+    return centroids
+
+
+class AdIndex:
+
+    def __init__(self, directory: str, dim: int, labels: list, nprobe: int = 8, train_size: int = TRAIN_SIZE):
+        """
+        Persistent IVF index of unit vectors with a row of label probabilities each
+
+        Vectors are stored as float16 in a memory-mapped matrix that grows as rows are added. Until train_size rows
+        have been added every query is an exhaustive search; the rows are then clustered with k-means and a query
+        only scans the rows of the nprobe clusters nearest to it. Several processes can share a directory: adds
+        and training hold a file lock, and queries pick up rows added by other processes.
+
+        :param directory: index directory, created if needed
+        :param dim: embedding dimension
+        :param labels: names of the label probabilities stored with each vector
+        :param nprobe: clusters scanned per query (default: 8)
+        :param train_size: rows added before the first clustering (default: 20000)
+        """
+        self.directory = directory
+        self.dim = dim
+        self.labels = list(labels)
+        self.nprobe = nprobe
+        self.train_size = train_size
+
+        self._lock = threading.RLock()
+        self._meta_stat = None
+        self.count = 0
+        self.capacity = 0
+        self.version = 0
+        self.centroids = None
+        self.vectors = None
+        self.label_matrix = None
+        self.lists = None
+        self._inverted = None
+
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.max_query_seconds = 0.0
+        self.hits = 0
+        self.inserts = 0
+
+        os.makedirs(directory, exist_ok=True)
+        with self._file_lock():
+            if not os.path.exists(self._path(META_NAME)):
+                self._write_meta()
+        meta = self._read_meta()
+        if meta["dim"] != dim or meta["labels"] != self.labels:
+            raise ValueError(f"Ad index at {directory} holds {meta['dim']}-dim vectors with labels {meta['labels']}, "
+                             f"not {dim}-dim vectors with labels {self.labels}")
+        self._refresh()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    @contextmanager
+    def _file_lock(self):
+        with open(self._path("lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read_meta(self) -> dict:
+        with open(self._path(META_NAME)) as f:
+            return json.load(f)
+
+    def _write_meta(self):
+        meta = {
+            "dim": self.dim,
+            "labels": self.labels,
+            "count": self.count,
+            "capacity": self.capacity,
+            "version": self.version,
+            "nlist": 0 if self.centroids is None else len(self.centroids)
+        }
+        # Rows are written before the count that makes them visible; the rename publishes both at once
+        tmp_path = self._path(f"{META_NAME}.{os.getpid()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self._path(META_NAME))
+        self._meta_stat = self._stat()
+
+    def _stat(self) -> tuple:
+        st = os.stat(self._path(META_NAME))
+        return st.st_ino, st.st_mtime_ns
+
+    def _map(self, capacity: int):
+        self.capacity = capacity
+        if capacity == 0:
+            return
+        self.vectors = np.memmap(self._path("vectors.f16"), dtype=np.float16, mode="r+", shape=(capacity, self.dim))
+        self.label_matrix = np.memmap(self._path("labels.f32"), dtype=np.float32, mode="r+",
+                                      shape=(capacity, len(self.labels)))
+        self.lists = np.memmap(self._path("lists.i32"), dtype=np.int32, mode="r+", shape=(capacity,))
+
+    def _refresh(self):
+        """Pick up rows added and clusterings done by other processes since the last call"""
+        stat = self._stat()
+        if stat == self._meta_stat:
+            return
+        meta = self._read_meta()
+        if meta["capacity"] != self.capacity:
+            self._map(meta["capacity"])
+        if meta["version"] != self.version:
+            self.centroids = np.load(self._path("centroids.npy")) if meta["nlist"] else None
+            self._inverted = None
+        self.count = meta["count"]
+        self.version = meta["version"]
+        self._meta_stat = stat
+
+    def _grow(self, rows: int):
+        capacity = max(self.capacity, 1024)
+        while capacity < rows:
+            capacity *= 2
+        for name, row_bytes in (("vectors.f16", 2 * self.dim), ("labels.f32", 4 * len(self.labels)), ("lists.i32", 4)):
+            with open(self._path(name), "ab") as f:
+                f.truncate(capacity * row_bytes)
+        self._map(capacity)
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._refresh()
+            return self.count
+
+    def add(self, vector: np.ndarray, label_values) -> int:
+        """
+        Add one vector
+
+        :param vector: (dim,) embedding, normalized on the way in
+        :param label_values: probability of each label, in the order of labels
+        :return: row of the vector
+        """
+        return self.add_batch(np.asarray(vector)[None], np.asarray(label_values, dtype=np.float32)[None])
+
+    def add_batch(self, vectors: np.ndarray, label_values: np.ndarray) -> int:
+        """
+        Add vectors in one locked append
+
+        :param vectors: (n, dim) embeddings, normalized on the way in
+        :param label_values: (n, labels) probabilities
+        :return: row of the first vector
+        """
+        vectors = normalize_rows(vectors)
+        with self._lock, self._file_lock():
+            self._refresh()
+            start, end = self.count, self.count + len(vectors)
+            if end > self.capacity:
+                self._grow(end)
+            self.vectors[start:end] = vectors
+            self.label_matrix[start:end] = label_values
+            self.lists[start:end] = -1 if self.centroids is None else nearest_centroids(vectors, self.centroids)
+            self.count = end
+            self._write_meta()
+            self.inserts += len(vectors)
+            untrained = self.centroids is None and end >= self.train_size
+        # The file lock is not reentrant, so training takes it afresh
+        if untrained:
+            self.train()
+        return start
+
+    def train(self, nlist: int = None, sample_size: int = KMEANS_SAMPLE_SIZE):
+        """
+        Cluster the rows with k-means and assign every row to its nearest cluster
+
+        :param nlist: number of clusters (default: the square root of the number of rows)
+        :param sample_size: rows the clusters are fitted on (default: 65536)
+        """
+        with self._lock, self._file_lock():
+            self._refresh()
+            if self.count == 0:
+                return
+            nlist = min(nlist or max(int(math.sqrt(self.count)), 1), self.count)
+            rng = np.random.default_rng(0)
+            sample = np.sort(rng.choice(self.count, size=min(sample_size, self.count), replace=False))
+            centroids = kmeans(np.asarray(self.vectors[sample], dtype=np.float32), nlist)
+            self.lists[:self.count] = nearest_centroids(self.vectors[:self.count], centroids)
+
+            tmp_path = self._path(f"centroids.{os.getpid()}.tmp.npy")
+            np.save(tmp_path, centroids)
+            os.replace(tmp_path, self._path("centroids.npy"))
+            self.centroids = centroids
+            self.version += 1
+            self._inverted = None
+            self._write_meta()
+
+    def _inverted_lists(self) -> tuple:
+        """Rows sorted by cluster with each cluster's offsets, rebuilt once enough rows are added after them"""
+        if self._inverted is None or self.count - self._inverted[2] > MAX_PENDING_ROWS:
+            lists = np.asarray(self.lists[:self.count])
+            order = np.argsort(lists, kind="stable").astype(np.int64)
+            offsets = np.searchsorted(lists[order], np.arange(len(self.centroids) + 1))
+            self._inverted = (order, offsets, self.count)
+        return self._inverted
+
+    def search(self, vector: np.ndarray, k: int = 1) -> tuple:
+        """
+        Most similar rows to a vector
+
+        :param vector: (dim,) embedding
+        :param k: number of rows (default: 1)
+        :return: (rows, cosine similarities), most similar first
+        """
+        start = time.perf_counter()
+        query = normalize_rows(vector)
+        with self._lock:
+            self._refresh()
+            if self.count == 0:
+                rows = np.empty(0, dtype=np.int64)
+                similarities = np.empty(0, dtype=np.float32)
+            elif self.centroids is None:
+                rows = np.arange(self.count)
+                similarities = np.concatenate([np.asarray(self.vectors[i:min(i + CHUNK_ROWS, self.count)], dtype=np.float32) @ query
+                                               for i in range(0, self.count, CHUNK_ROWS)])
+            else:
+                probe = np.argsort(-(self.centroids @ query))[:self.nprobe]
+                order, offsets, built = self._inverted_lists()
+                pending = np.arange(built, self.count)
+                pending = pending[np.isin(self.lists[built:self.count], probe)]
+                rows = np.sort(np.concatenate([order[offsets[c]:offsets[c + 1]] for c in probe] + [pending]))
+                similarities = np.asarray(self.vectors[rows], dtype=np.float32) @ query
+            best = np.argsort(-similarities)[:k]
+            rows, similarities = rows[best], similarities[best]
+
+        seconds = time.perf_counter() - start
+        with self._lock:
+            self.queries += 1
+            self.query_seconds += seconds
+            self.max_query_seconds = max(self.max_query_seconds, seconds)
+        return rows, similarities
+
+    def match(self, vector: np.ndarray, threshold: float):
+        """
+        The labels of the most similar row, if it is at least threshold similar
+
+        :param vector: (dim,) embedding
+        :param threshold: minimum cosine similarity
+        :return: (similarity, {label: probability}) or None
+        """
+        rows, similarities = self.search(vector)
+        if len(rows) == 0 or similarities[0] < threshold:
+            return None
+        with self._lock:
+            self.hits += 1
+            values = self.label_matrix[rows[0]].tolist()
+        return float(similarities[0]), dict(zip(self.labels, values))
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._refresh()
+            return {
+                "entries": self.count,
+                "lists": 0 if self.centroids is None else len(self.centroids),
+                "nprobe": self.nprobe,
+                "inserts": self.inserts,
+                "queries": self.queries,
+                "hits": self.hits,
+                "mean_query_ms": 1000 * self.query_seconds / self.queries if self.queries else 0.0,
+                "max_query_ms": 1000 * self.max_query_seconds
+            }
+
+
+def open_index(directory: str) -> AdIndex:
+    """Open an existing index with the dimension and labels it was created with"""
+    with open(os.path.join(directory, META_NAME)) as f:
+        meta = json.load(f)
+    return AdIndex(directory, meta["dim"], meta["labels"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("directory", help="index directory")
+    parser.add_argument("--train", action="store_true", help="recluster every row, e.g. after the index has grown")
+    parser.add_argument("--nlist", type=int, help="clusters (default: square root of the number of rows)")
+    args = parser.parse_args()
+
+    index = open_index(args.directory)
+    if args.train:
+        index.train(args.nlist)
+    print(json.dumps(index.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import torch
+
+
+class _Request:
+
+    def __init__(self, inputs, size: int):
+        self.inputs = inputs
+        self.size = size
+        self.future = Future()
+        self.enqueued = time.perf_counter()
+
+
+class BatchQueue:
+
+    def __init__(self, name: str, run_batch, max_batch_size: int, max_wait_ms: float):
+        """
+        Gathers requests from many threads and runs them through one model call per batch
+
+        :param name: name used for the worker thread and in stats
+        :param run_batch: callable taking a list of request inputs and returning a list of outputs in the same order
+        :param max_batch_size: rows (frames or texts) per model call; a single larger request runs alone
+        :param max_wait_ms: how long the oldest request waits for others to arrive
+        """
+        self.name = name
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+
+        self._queue = queue.Queue()
+        self._carry = None
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name=f"inference-{name}", daemon=True)
+        self._thread.start()
+
+        self.batches = 0
+        self.rows = 0
+        self.max_rows = 0
+        self.requests = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def submit(self, inputs, size: int) -> Future:
+        request = _Request(inputs, size)
+        self._queue.put(request)
+        return request.future
+
+    def stop(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _collect(self) -> list:
+        first = self._carry if self._carry is not None else self._queue.get()
+        self._carry = None
+        if first is None:
+            return None
+        batch = [first]
+        rows = first.size
+        deadline = first.enqueued + self.max_wait
+        while rows < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            try:
+                request = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                self._queue.put(None)
+                break
+            if rows + request.size > self.max_batch_size:
+                # Keep it for the next batch rather than overshooting this one
+                self._carry = request
+                break
+            batch.append(request)
+            rows += request.size
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            started = time.perf_counter()
+            try:
+                outputs = self.run_batch([request.inputs for request in batch])
+            except Exception as e:
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+            for request, output in zip(batch, outputs):
+                request.future.set_result(output)
+            self._record(batch, started)
+
+    def _record(self, batch: list, started: float):
+        rows = sum(request.size for request in batch)
+        waits = [started - request.enqueued for request in batch]
+        with self._lock:
+            self.batches += 1
+            self.rows += rows
+            self.max_rows = max(self.max_rows, rows)
+            self.requests += len(batch)
+            self.wait_seconds += sum(waits)
+            self.max_wait_seconds = max(self.max_wait_seconds, max(waits))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "queue_depth": self._queue.qsize() + (self._carry is not None),
+                "batches": self.batches,
+                "requests": self.requests,
+                "mean_batch_size": self.rows / self.batches if self.batches else 0.0,
+                "max_batch_size": self.max_rows,
+                "mean_wait_ms": 1000 * self.wait_seconds / self.requests if self.requests else 0.0,
+                "max_wait_ms": 1000 * self.max_wait_seconds
+            }
+
+
+class InferenceScheduler:
+
+    def __init__(self, image_features, description_embeddings, max_batch_size: int = 64, max_wait_ms: float = 10.0):
+        """
+        Dynamic batching in front of the CLIP image encoder and the sentence transformer
+
+        :param image_features: callable mapping (n, 3, h, w) pixel values to (n, dim) image features
+        :param description_embeddings: callable mapping a list of texts to (n, dim) normalized embeddings
+        :param max_batch_size: frames / texts per model call (default: 64)
+        :param max_wait_ms: how long a request waits for others to join its batch (default: 10.0)
+        """
+        self._image_features = image_features
+        self._description_embeddings = description_embeddings
+        self.images = BatchQueue("images", self._run_images, max_batch_size, max_wait_ms)
+        self.texts = BatchQueue("texts", self._run_texts, max_batch_size, max_wait_ms)
+
+    def _run_images(self, inputs: list) -> list:
+        sizes = [len(pixel_values) for pixel_values in inputs]
+        features = self._image_features(torch.cat(inputs))
+        return list(torch.split(features, sizes))
+
+    def _run_texts(self, inputs: list) -> list:
+        return list(self._description_embeddings(inputs))
+
+    def image_features(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        return self.images.submit(pixel_values, len(pixel_values)).result()
+
+    def description_embedding(self, text: str) -> torch.Tensor:
+        return self.texts.submit(text, 1).result()
+
+    def stop(self):
+        self.images.stop()
+        self.texts.stop()
+
+    def stats(self) -> dict:
+        return {"images": self.images.stats(), "texts": self.texts.stats()}
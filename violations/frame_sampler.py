@@ -0,0 +1,255 @@
+import threading
+
+import cv2
+import numpy as np
+from werkzeug.datastructures import FileStorage
+
+from uploads import ingest_upload
+
+# Beyond this many frames between two targets, seeking (which lands on the previous keyframe and
+# decodes forward) is cheaper than grabbing every frame in between
+SEEK_THRESHOLD = 48
+
+# Hamming distances between 64-bit difference hashes: frames closer than DUPLICATE_DISTANCE are treated as the
+# same shot, and consecutive samples further apart than SCENE_CHANGE_DISTANCE as straddling a cut
+DUPLICATE_DISTANCE = 6
+SCENE_CHANGE_DISTANCE = 20
+
+
+def sample_indices(total_frames: int, num_frames: int) -> np.ndarray:
+    """
+    Indices of the frames to sample, evenly spaced from the first frame
+
+    :param total_frames: number of frames in the video
+    :param num_frames: number of frames wanted
+    :return: sorted frame indices, fewer than num_frames if the video is shorter
+    """
+    if total_frames <= 0 or num_frames <= 0:
+        return np.empty(0, dtype=np.int64)
+    interval = max(total_frames // num_frames, 1)
+    return np.arange(0, total_frames, interval, dtype=np.int64)[:num_frames]
+
+
+def _count_frames(video_path: str) -> int:
+    # Some containers do not report a frame count; grabbing skips the colour conversion
+    cap = cv2.VideoCapture(video_path)
+    count = 0
+    while cap.grab():
+        count += 1
+    cap.release()
+    return count
+
+
+def _read_frames(cap, targets: np.ndarray) -> np.ndarray:
+    """
+    Decode the target frames of a freshly opened capture
+
+    :param cap: cv2.VideoCapture positioned at the first frame
+    :param targets: sorted frame indices
+    :return: (n, height, width, 3) uint8 RGB batch of the first n targets that could be decoded
+    """
+    batch = None
+    count = 0
+    position = 0  # index of the next frame grab() would return
+    for target in targets:
+        if target - position > SEEK_THRESHOLD:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, int(target))
+            position = int(target)
+        while position < target:
+            if not cap.grab():
+                break
+            position += 1
+        if position != target or not cap.grab():
+            break
+        position += 1
+
+        ret, frame = cap.retrieve()
+        if not ret or frame is None:
+            break
+        if batch is None:
+            batch = np.empty((len(targets),) + frame.shape, dtype=np.uint8)
+        elif frame.shape != batch.shape[1:]:
+            break
+        cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=batch[count])
+        count += 1
+
+    if batch is None:
+        return np.empty((0, 0, 0, 3), dtype=np.uint8)
+    return batch[:count]
+
+
+def _open(video_path: str):
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise Exception("Error: Could not open video file.")
+    return cap
+
+
+def frame_count(video_path: str) -> int:
+    cap = _open(video_path)
+    try:
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    finally:
+        cap.release()
+    return total_frames if total_frames > 0 else _count_frames(video_path)
+
+
+def read_frames(video_path: str, indices: np.ndarray) -> np.ndarray:
+    """
+    Decode only the given frames of a video
+
+    :param video_path: path to the video file
+    :param indices: sorted frame indices
+    :return: (n, height, width, 3) uint8 RGB batch of the first n indices that could be decoded
+    """
+    cap = _open(video_path)
+    try:
+        return _read_frames(cap, indices)
+    finally:
+        cap.release()
+
+
+def sample_frames(video_path: str, num_frames: int) -> np.ndarray:
+    """
+    Decode only the sampled frames of a video
+
+    :param video_path: path to the video file
+    :param num_frames: number of frames to extract from the video
+    :return: (n, height, width, 3) uint8 RGB batch, n <= num_frames
+    """
+    cap = _open(video_path)
+    try:
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if total_frames <= 0:
+            total_frames = _count_frames(video_path)
+        return _read_frames(cap, sample_indices(total_frames, num_frames))
+    finally:
+        cap.release()
+
+
+def frame_hashes(frames: np.ndarray) -> np.ndarray:
+    """
+    Difference hashes of frames: whether each pixel of a 9x8 grayscale thumbnail is brighter than its right-hand
+    neighbour. Noise, re-encoding and small movements flip only a few of the 64 bits.
+
+    :param frames: (n, height, width, 3) uint8 RGB frames
+    :return: (n, 64) bool hashes
+    """
+    hashes = np.empty((len(frames), 64), dtype=bool)
+    for i, frame in enumerate(frames):
+        thumbnail = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY), (9, 8), interpolation=cv2.INTER_AREA)
+        hashes[i] = (thumbnail[:, 1:] > thumbnail[:, :-1]).ravel()
+    return hashes
+
+
+class SamplingStats:
+
+    def __init__(self):
+        """
+        Running totals of frames decoded, selected and embedded per video
+        """
+        self._lock = threading.Lock()
+        self.videos = 0
+        self.frames_decoded = 0
+        self.frames_selected = 0
+        self.ads = 0
+        self.frames_embedded = 0
+        self.early_exits = 0
+
+    def record_selection(self, decoded: int, selected: int):
+        with self._lock:
+            self.videos += 1
+            self.frames_decoded += decoded
+            self.frames_selected += selected
+
+    def record_embedding(self, frames: int, embedded: int):
+        with self._lock:
+            self.ads += 1
+            self.frames_embedded += embedded
+            self.early_exits += embedded < frames
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "videos": self.videos,
+                "frames_decoded": self.frames_decoded,
+                "frames_selected": self.frames_selected,
+                "ads": self.ads,
+                "frames_embedded": self.frames_embedded,
+                "mean_frames_embedded": self.frames_embedded / self.ads if self.ads else 0.0,
+                "early_exits": self.early_exits
+            }
+
+
+class AdaptiveSampler:
+
+    def __init__(self, base_frames: int = 16, max_frames: int = 32, duplicate_distance: int = DUPLICATE_DISTANCE,
+                 scene_change_distance: int = SCENE_CHANGE_DISTANCE, stats: SamplingStats = None):
+        """
+        Picks the frames of a video worth embedding: evenly spaced samples, plus the frame halfway between any
+        two consecutive samples that straddle a cut, with near-duplicates dropped
+
+        A static product shot comes down to one or two frames, while a fast-cut ad gets up to max_frames.
+
+        :param base_frames: evenly spaced frames decoded first (default: 16)
+        :param max_frames: most frames decoded per video (default: 32)
+        :param duplicate_distance: hash distance at or below which a frame duplicates one already kept (default: 6)
+        :param scene_change_distance: hash distance above which two consecutive samples straddle a cut (default: 20)
+        :param stats: totals to record into (default: a new SamplingStats)
+        """
+        self.base_frames = base_frames
+        self.max_frames = max_frames
+        self.duplicate_distance = duplicate_distance
+        self.scene_change_distance = scene_change_distance
+        self.stats = stats or SamplingStats()
+
+    def sample(self, video_path: str) -> np.ndarray:
+        """
+        :param video_path: path to the video file
+        :return: (n, height, width, 3) uint8 RGB frames in temporal order, n <= max_frames
+        """
+        indices = sample_indices(frame_count(video_path), self.base_frames)
+        frames = read_frames(video_path, indices)
+        indices = indices[:len(frames)]
+        hashes = frame_hashes(frames)
+
+        # Decode the midpoints of the largest changes between consecutive samples
+        if len(frames) > 1 and self.max_frames > len(frames):
+            distances = (hashes[1:] != hashes[:-1]).sum(axis=1)
+            gaps = np.flatnonzero((distances > self.scene_change_distance) & (np.diff(indices) > 1))
+            gaps = gaps[np.argsort(-distances[gaps], kind="stable")][:self.max_frames - len(frames)]
+            midpoints = np.sort((indices[gaps] + indices[gaps + 1]) // 2)
+            extra = read_frames(video_path, midpoints) if len(midpoints) else frames[:0]
+            if len(extra) and extra.shape[1:] == frames.shape[1:]:
+                order = np.argsort(np.concatenate([indices, midpoints[:len(extra)]]), kind="stable")
+                frames = np.concatenate([frames, extra])[order]
+                hashes = np.concatenate([hashes, frame_hashes(extra)])[order]
+
+        keep = self.deduplicate(hashes)
+        self.stats.record_selection(len(frames), len(keep))
+        return frames[keep]
+
+    def deduplicate(self, hashes: np.ndarray) -> np.ndarray:
+        """
+        Greedily keep frames in temporal order, skipping any within duplicate_distance of a frame already kept
+
+        :param hashes: (n, 64) bool hashes from frame_hashes
+        :return: indices of the frames kept
+        """
+        keep = []
+        for i, h in enumerate(hashes):
+            if not keep or (hashes[keep] != h).sum(axis=1).min() > self.duplicate_distance:
+                keep.append(i)
+        return np.array(keep, dtype=np.intp)
+
+
+def extract_frames_from_video(file_storage: FileStorage, num_frames: int) -> np.ndarray:
+    """
+    Extract frames from an uploaded video
+
+    :param file_storage: video file
+    :param num_frames: number of frames to extract from the video
+    :return: (n, height, width, 3) uint8 RGB batch, n <= num_frames
+    """
+    with ingest_upload(file_storage) as upload:
+        return sample_frames(upload.path, num_frames)
@@ -0,0 +1,233 @@
+import hashlib
+import os
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+DEFAULT_BACKEND = "fp32"
+ONNX_OPSET = 14
+
+
+class InferenceBackend:
+    """
+    Runs the CLIP and sentence transformer encoders for a ViolationChecker
+    """
+
+    name = None
+    supports_cuda = False
+
+    def __init__(self, threads: int = None):
+        """
+        :param threads: intra-op threads used by the encoders (default: the library default)
+        """
+        self.threads = threads
+        self.clip_model = None
+        self.sentence_transformer = None
+
+    def prepare(self, clip_model, sentence_transformer, cache_dir: str, model_names: tuple):
+        """
+        Take over the loaded fp32 models, converting them as needed
+
+        :param clip_model: the loaded CLIPModel
+        :param sentence_transformer: the loaded SentenceTransformer
+        :param cache_dir: directory for converted models
+        :param model_names: (clip, sentence transformer) hub ids or paths, used to key converted models
+        """
+        self.clip_model = clip_model
+        self.sentence_transformer = sentence_transformer
+        self.set_threads(self.threads)
+
+    def set_threads(self, threads: int):
+        self.threads = threads
+        if threads:
+            torch.set_num_threads(threads)
+
+    @torch.no_grad()
+    def text_features(self, inputs: dict) -> torch.Tensor:
+        """
+        :param inputs: tokenized prompts
+        :return: (n, dim) CLIP text features
+        """
+        return self.clip_model.get_text_features(**inputs)
+
+    def image_features(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        """
+        :param pixel_values: (n, 3, h, w) preprocessed frames
+        :return: (n, dim) CLIP image features
+        """
+        with torch.inference_mode():
+            return self.clip_model.get_image_features(pixel_values=pixel_values.to(self.clip_model.device))
+
+    def description_embeddings(self, texts: list) -> torch.Tensor:
+        """
+        :param texts: ad descriptions or categories
+        :return: (n, dim) normalized sentence embeddings
+        """
+        return self.sentence_transformer.encode(texts, convert_to_tensor=True, normalize_embeddings=True)
+
+
+class Fp32Backend(InferenceBackend):
+    """
+    The models as loaded, on GPU when one is available
+    """
+
+    name = "fp32"
+    supports_cuda = True
+
+
+class Int8Backend(InferenceBackend):
+    """
+    Dynamic int8 quantization of every linear layer: weights are stored as int8 and activations are quantized
+    on the fly, so the matmuls run through the CPU's int8 kernels
+    """
+
+    name = "int8"
+
+    def prepare(self, clip_model, sentence_transformer, cache_dir: str, model_names: tuple):
+        from torch.ao.quantization import quantize_dynamic
+
+        clip_model = quantize_dynamic(clip_model, {torch.nn.Linear}, dtype=torch.qint8)
+        sentence_transformer = quantize_dynamic(sentence_transformer, {torch.nn.Linear}, dtype=torch.qint8)
+        super().prepare(clip_model, sentence_transformer, cache_dir, model_names)
+
+
+class _ImageEncoder(torch.nn.Module):
+
+    def __init__(self, clip_model):
+        super().__init__()
+        self.clip_model = clip_model
+
+    def forward(self, pixel_values):
+        return self.clip_model.get_image_features(pixel_values=pixel_values)
+
+
+class _SentenceEncoder(torch.nn.Module):
+
+    def __init__(self, sentence_transformer, input_names: list):
+        super().__init__()
+        self.sentence_transformer = sentence_transformer
+        self.input_names = input_names
+
+    def forward(self, *inputs):
+        return self.sentence_transformer(dict(zip(self.input_names, inputs)))["sentence_embedding"]
+
+
+class OnnxBackend(InferenceBackend):
+    """
+    The CLIP image encoder and the sentence transformer exported to ONNX and run with ONNX Runtime
+
+    CLIP text features are only computed once per label set, so they stay on the PyTorch model.
+    """
+
+    name = "onnx"
+    quantize = False
+
+    def __init__(self, threads: int = None):
+        super().__init__(threads)
+        self.paths = {}
+        self.sessions = {}
+        self.text_input_names = None
+
+    def prepare(self, clip_model, sentence_transformer, cache_dir: str, model_names: tuple):
+        # Fail before spending time on the export
+        try:
+            import onnxruntime  # noqa: F401
+        except ImportError as e:
+            raise ImportError(f"The {self.name} inference backend requires onnxruntime, install it with "
+                              "`python -m pip install onnxruntime==1.15.1`") from e
+
+        sentence_transformer = sentence_transformer.eval()
+        super().prepare(clip_model, sentence_transformer, cache_dir, model_names)
+
+        clip_name, sentence_transformer_name = model_names
+        self.text_input_names = list(sentence_transformer.tokenize(["warm up"]).keys())
+        self.paths = {
+            "image": self._export(cache_dir, "image", clip_name, _ImageEncoder(clip_model),
+                                  (torch.zeros(1, 3, 224, 224),), ["pixel_values"], {"pixel_values": {0: "batch"}}),
+            "text": self._export(cache_dir, "text", sentence_transformer_name,
+                                 _SentenceEncoder(sentence_transformer, self.text_input_names),
+                                 tuple(sentence_transformer.tokenize(["warm up"]).values()), self.text_input_names,
+                                 {name: {0: "batch", 1: "sequence"} for name in self.text_input_names})
+        }
+        self._create_sessions()
+
+    def _export(self, cache_dir: str, kind: str, model_name: str, module: torch.nn.Module, example: tuple,
+                input_names: list, dynamic_axes: dict) -> str:
+        """
+        Export a module to ONNX under cache_dir, reusing an earlier export of the same model
+
+        :return: path to the .onnx file
+        """
+        key = hashlib.sha256(f"{model_name}\0{self.name}".encode()).hexdigest()[:16]
+        path = os.path.join(cache_dir, "onnx", f"{kind}_{key}.onnx")
+        if os.path.exists(path):
+            return path
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename so concurrent workers never read a partial file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        dynamic_axes = dict(dynamic_axes, output={0: "batch"})
+        with torch.no_grad():
+            torch.onnx.export(module, example, tmp_path, input_names=input_names, output_names=["output"],
+                              dynamic_axes=dynamic_axes, opset_version=ONNX_OPSET)
+        if self.quantize:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            quantized_path = f"{tmp_path}.int8"
+            quantize_dynamic(tmp_path, quantized_path, weight_type=QuantType.QInt8)
+            os.replace(quantized_path, tmp_path)
+        os.replace(tmp_path, path)
+        return path
+
+    def _create_sessions(self):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = self.threads or 0
+        self.sessions = {kind: ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+                         for kind, path in self.paths.items()}
+
+    def set_threads(self, threads: int):
+        """
+        ONNX Runtime sizes its thread pool when a session is created, so the sessions are rebuilt; this is
+        also how a forked worker gets its own pool
+        """
+        super().set_threads(threads)
+        if self.paths:
+            self._create_sessions()
+
+    def image_features(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        out = self.sessions["image"].run(None, {"pixel_values": pixel_values.cpu().numpy()})[0]
+        return torch.from_numpy(out)
+
+    def description_embeddings(self, texts: list) -> torch.Tensor:
+        features = self.sentence_transformer.tokenize(texts)
+        inputs = {name: features[name].cpu().numpy().astype(np.int64) for name in self.text_input_names}
+        out = self.sessions["text"].run(None, inputs)[0]
+        return F.normalize(torch.from_numpy(out), dim=-1)
+
+
+class OnnxInt8Backend(OnnxBackend):
+    """
+    The ONNX export with its weights quantized to int8 by ONNX Runtime
+    """
+
+    name = "onnx-int8"
+    quantize = True
+
+
+BACKENDS = {backend.name: backend for backend in (Fp32Backend, Int8Backend, OnnxBackend, OnnxInt8Backend)}
+
+
+def get_backend(name: str = DEFAULT_BACKEND, threads: int = None) -> InferenceBackend:
+    """
+    Look up an inference backend by name
+
+    :param name: one of "fp32", "int8", "onnx" or "onnx-int8" (default: "fp32")
+    :param threads: intra-op threads used by the encoders (default: the library default)
+    :return: the backend
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown inference backend {name!r}, expected one of {sorted(BACKENDS)}")
+    return BACKENDS[name](threads)
@@ -0,0 +1,119 @@
+"""
+Pinned local copies of the CLIP and sentence transformer models, so the server starts without network access
+
+    python -m violations.model_snapshot --output models/
+"""
+import argparse
+import json
+import os
+import time
+
+MANIFEST_NAME = "manifest.json"
+MODEL_SNAPSHOT_DIR = os.environ.get("MODEL_SNAPSHOT_DIR")
+DEFAULT_CLIP_PATH = "openai/clip-vit-base-patch32"
+DEFAULT_SENTENCE_TRANSFORMER_PATH = "BAAI/bge-base-en"
+
+
+def to_safetensors(directory: str) -> list:
+    """
+    Convert every pytorch_model.bin under a directory to model.safetensors, which loads by memory mapping
+    instead of unpickling
+
+    :param directory: a saved model directory
+    :return: paths of the files written
+    """
+    import torch
+    from safetensors.torch import save_file
+
+    written = []
+    for root, _, names in os.walk(directory):
+        if "pytorch_model.bin" not in names:
+            continue
+        bin_path = os.path.join(root, "pytorch_model.bin")
+        state_dict = torch.load(bin_path, map_location="cpu")
+        # safetensors refuses tensors sharing storage; tied weights are restored by from_pretrained
+        seen = set()
+        tensors = {}
+        for name, tensor in state_dict.items():
+            if tensor.data_ptr() in seen:
+                continue
+            seen.add(tensor.data_ptr())
+            tensors[name] = tensor.contiguous()
+        path = os.path.join(root, "model.safetensors")
+        save_file(tensors, path, metadata={"format": "pt"})
+        os.remove(bin_path)
+        written.append(path)
+    return written
+
+
+def create_snapshot(output_dir: str, clip_path: str = DEFAULT_CLIP_PATH,
+                    sentence_transformer_path: str = DEFAULT_SENTENCE_TRANSFORMER_PATH, safetensors: bool = True) -> dict:
+    """
+    Download (or copy from the local hub cache) both models into a self-contained directory
+
+    :param output_dir: snapshot directory to create
+    :param clip_path: hub id or path of the CLIP model (default: "openai/clip-vit-base-patch32")
+    :param sentence_transformer_path: hub id or path of the sentence transformer (default: "BAAI/bge-base-en")
+    :param safetensors: store the weights as safetensors (default: True)
+    :return: the manifest written next to the models
+    """
+    from transformers import AutoProcessor, CLIPModel, AutoTokenizer
+    from sentence_transformers import SentenceTransformer
+
+    os.makedirs(output_dir, exist_ok=True)
+    clip_dir = os.path.join(output_dir, "clip")
+    CLIPModel.from_pretrained(clip_path).save_pretrained(clip_dir)
+    AutoProcessor.from_pretrained(clip_path).save_pretrained(clip_dir)
+    AutoTokenizer.from_pretrained(clip_path).save_pretrained(clip_dir)
+
+    sentence_transformer_dir = os.path.join(output_dir, "sentence_transformer")
+    SentenceTransformer(sentence_transformer_path).save(sentence_transformer_dir)
+
+    if safetensors:
+        to_safetensors(output_dir)
+
+    manifest = {
+        "created": time.time(),
+        "safetensors": safetensors,
+        "models": {
+            clip_path: "clip",
+            sentence_transformer_path: "sentence_transformer"
+        }
+    }
+    with open(os.path.join(output_dir, MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def resolve_model(snapshot_dir: str, model_path: str) -> str:
+    """
+    Local directory of a model in a snapshot
+
+    :param snapshot_dir: directory written by create_snapshot
+    :param model_path: hub id or path the snapshot was created from
+    :return: path to load the model from
+    """
+    manifest_path = os.path.join(snapshot_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        raise FileNotFoundError(f"No model snapshot at {snapshot_dir}: {MANIFEST_NAME} is missing")
+    with open(manifest_path) as f:
+        models = json.load(f)["models"]
+    if model_path not in models:
+        raise KeyError(f"Model snapshot at {snapshot_dir} does not contain {model_path}")
+    return os.path.join(snapshot_dir, models[model_path])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--output", required=True, help="snapshot directory to create")
+    parser.add_argument("--clip", default=DEFAULT_CLIP_PATH)
+    parser.add_argument("--sentence-transformer", default=DEFAULT_SENTENCE_TRANSFORMER_PATH)
+    parser.add_argument("--no-safetensors", action="store_true", help="keep the weights as pickled pytorch_model.bin")
+    args = parser.parse_args()
+
+    manifest = create_snapshot(args.output, args.clip, args.sentence_transformer, safetensors=not args.no_safetensors)
+    print(json.dumps(manifest, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+from violations.lru_cache import LRUCache
+
+
+def cache_key(*parts) -> str:
+    """
+    Content address built from everything that affects a result
+
+    :param parts: e.g. the video digest, number of frames, model ids and config hash
+    :return: sha256 hex digest of the parts
+    """
+    return hashlib.sha256("\0".join(str(p) for p in parts).encode()).hexdigest()
+
+
+class ResultCache:
+
+    def __init__(self, directory: str, max_memory_entries: int = 1024, max_disk_bytes: int = 512 * 1024 * 1024):
+        """
+        Two-tier content-addressed cache: an in-memory LRU in front of size-bounded files on disk
+
+        :param directory: directory of the disk tier
+        :param max_memory_entries: entries kept in the in-memory tier (default: 1024)
+        :param max_disk_bytes: size of the disk tier before least recently used entries are evicted (default: 512MB)
+        """
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.memory = LRUCache(maxsize=max_memory_entries)
+
+        self._lock = threading.Lock()
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self.disk_bytes = sum(size for _, size, _ in self._entries().values())
+
+    def _path(self, key: str, suffix: str) -> str:
+        return os.path.join(self.directory, key + suffix)
+
+    def get(self, key: str, with_embeddings: bool = False):
+        """
+        Look up a cached result
+
+        :param key: content address from cache_key
+        :param with_embeddings: also load the stored embeddings, if any
+        :return: the result, (result, embeddings or None) if with_embeddings, or None on a miss
+        """
+        entry = self.memory.get(key)
+        if entry is None:
+            entry = self._load(key)
+            if entry is None:
+                with self._lock:
+                    self.misses += 1
+                return None
+            with self._lock:
+                self.disk_hits += 1
+            self.memory.put(key, entry)
+
+        result, embeddings = entry
+        if with_embeddings:
+            if embeddings is None and os.path.exists(self._path(key, ".npy")):
+                embeddings = np.load(self._path(key, ".npy"))
+            return result, embeddings
+        return result
+
+    def _load(self, key: str):
+        path = self._path(key, ".json")
+        try:
+            with open(path) as f:
+                result = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        # Bump the modification time so eviction sees this entry as recently used
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return result, None
+
+    def put(self, key: str, result, embeddings: np.ndarray = None):
+        """
+        Store a result in both tiers
+
+        :param key: content address from cache_key
+        :param result: JSON-serialisable result
+        :param embeddings: optional array stored alongside the result on disk
+        """
+        self.memory.put(key, (result, embeddings))
+
+        written = self._write(self._path(key, ".json"), lambda f: f.write(json.dumps(result).encode()))
+        if embeddings is not None:
+            written += self._write(self._path(key, ".npy"), lambda f: np.save(f, embeddings))
+
+        with self._lock:
+            self.disk_bytes += written
+            over = self.disk_bytes > self.max_disk_bytes
+        if over:
+            self._evict()
+
+    def _write(self, path: str, write) -> int:
+        # Write then rename so readers in other workers never see a partial entry
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            write(f)
+        try:
+            previous = os.path.getsize(path)
+        except FileNotFoundError:
+            previous = 0
+        os.replace(tmp_path, path)
+        return os.path.getsize(path) - previous
+
+    def _entries(self) -> dict:
+        """
+        The entries on disk, leaving out the temporary files of writes in progress
+
+        :return: {key: (last used, total size, paths)}, the result file listed first
+        """
+        entries = {}
+        for name in os.listdir(self.directory):
+            if name.endswith(".tmp"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            key = os.path.splitext(name)[0]
+            mtime, size, paths = entries.get(key, (0.0, 0, []))
+            paths = [path] + paths if name.endswith(".json") else paths + [path]
+            entries[key] = (max(mtime, stat.st_mtime), size + stat.st_size, paths)
+        return entries
+
+    def _evict(self):
+        with self._lock:
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries.values())
+
+            # Drop least recently used entries, result and embeddings together, until the tier is back under 90%
+            # of its budget
+            target = 0.9 * self.max_disk_bytes
+            for _, size, paths in sorted(entries.values()):
+                if total <= target:
+                    break
+                for path in paths:
+                    try:
+                        os.unlink(path)
+                    except FileNotFoundError:
+                        pass
+                total -= size
+                self.evictions += 1
+            self.disk_bytes = total
+
+    def stats(self) -> dict:
+        memory = self.memory.stats()
+        with self._lock:
+            lookups = memory["hits"] + self.disk_hits + self.misses
+            return {
+                "memory_hits": memory["hits"],
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (memory["hits"] + self.disk_hits) / lookups if lookups else 0.0,
+                "memory_entries": memory["size"],
+                "disk_bytes": self.disk_bytes,
+                "evictions": self.evictions
+            }
@@ -1,39 +1,234 @@
-import cv2
+import hashlib
+import os
+import threading
+import time
 import torch
-import tempfile
 import yaml
 import torch.nn.functional as F
 import numpy as np
 
-from transformers import AutoProcessor, CLIPModel, AutoTokenizer
-from sentence_transformers import SentenceTransformer
-
-from PIL import Image
 from werkzeug.datastructures import FileStorage
 
+from instrumentation import timed
+from uploads import ingest_upload
+from violations.ad_index import AdIndex, pool_embeddings
+from violations.batching import InferenceScheduler
+from violations.inference_backends import DEFAULT_BACKEND, get_backend
+from violations.frame_sampler import AdaptiveSampler, SamplingStats, sample_frames
+from violations.lru_cache import LRUCache
+from violations.model_snapshot import DEFAULT_CLIP_PATH, DEFAULT_SENTENCE_TRANSFORMER_PATH, MODEL_SNAPSHOT_DIR, resolve_model
+from violations.result_cache import ResultCache, cache_key
+
+CACHE_DIR = os.environ.get("VIOLATION_CACHE_DIR")
+# Frames per image encoder call when batching is not enabled; with it, the scheduler's max_batch_size
+ENCODER_BATCH_SIZE = 64
+
+
+def score_violations(image_features: torch.Tensor, text_features: torch.Tensor) -> torch.Tensor:
+    """
+    Score every frame against every violation label in one pass
+
+    :param image_features: (frames, dim) CLIP image features
+    :param text_features: (labels + 1, dim) normalized text features, the last row being the empty prompt
+    :return: (labels,) highest probability over frames of each label against the empty prompt
+    """
+    logits = F.normalize(image_features, dim=-1) @ text_features.T * 100
+    labels, empty = logits[:, :-1], logits[:, -1:]
+    pairs = torch.stack([labels, empty.expand_as(labels)], dim=-1)
+    return pairs.softmax(dim=-1)[..., 0].max(dim=0).values
+
+
 class ViolationChecker:
 
-    def __init__(self, config_path: str, clip_path: str = "openai/clip-vit-base-patch32", sentence_transformer_path: str = "BAAI/bge-base-en"):
+    def __init__(self, config_path: str, clip_path: str = DEFAULT_CLIP_PATH, sentence_transformer_path: str = DEFAULT_SENTENCE_TRANSFORMER_PATH, cache_dir: str = None, description_cache_size: int = 1024, result_cache: ResultCache = None, cache_frame_embeddings: bool = False, snapshot_dir: str = MODEL_SNAPSHOT_DIR, backend: str = None, threads: int = None):
         """
         Initialize the violation checker
 
         :param config_path: path to the config file
-        :param video_path: path to the video file
         :param clip_path: path to the CLIP model (default: "openai/clip-vit-base-patch32")
         :param sentence_transformer_path: path to the sentence transformer model (default: "BAAI/bge-base-en")
+        :param cache_dir: directory for precomputed embeddings (default: $VIOLATION_CACHE_DIR, else ".cache" next to the config file)
+        :param description_cache_size: number of ad description embeddings kept in memory (default: 1024)
+        :param result_cache: cache of results keyed by video digest / description hash (default: "results" under cache_dir)
+        :param cache_frame_embeddings: also store per-frame CLIP embeddings with cached results (default: False)
+        :param snapshot_dir: load both models from this local snapshot instead of the hub (default: $MODEL_SNAPSHOT_DIR)
+        :param backend: encoder backend, "fp32", "int8", "onnx" or "onnx-int8" (default: inference.backend in the config, else "fp32")
+        :param threads: intra-op threads for the encoders (default: inference.threads in the config, else the library default)
         """
 
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        with open(config_path) as f:
-            self.config = yaml.load(f, Loader=yaml.FullLoader)
+        with open(config_path, "rb") as f:
+            raw_config = f.read()
+        self.config = yaml.load(raw_config, Loader=yaml.FullLoader)
+        inference = self.config.get('inference') or {}
+        self.backend = get_backend(backend or inference.get('backend', DEFAULT_BACKEND), threads or inference.get('threads'))
+        self.device = "cuda" if torch.cuda.is_available() and self.backend.supports_cuda else "cpu"
+        self.config_hash = hashlib.sha256(raw_config).hexdigest()
+        self.cache_dir = cache_dir or CACHE_DIR or os.path.join(os.path.dirname(os.path.abspath(config_path)), ".cache")
         self.violation_labels = self.config['violation_labels']
         self.ad_categories = self.config['ad_categories']
 
-        self.clip_model = CLIPModel.from_pretrained(clip_path).to(self.device)
-        self.clip_processor = AutoProcessor.from_pretrained(clip_path)
-        self.tokenizer = AutoTokenizer.from_pretrained(clip_path)
+        # Which frames are embedded; see the sampling section of the config
+        sampling = dict(self.config.get('sampling') or {})
+        self.sampling_mode = sampling.pop('mode', 'fixed')
+        self.early_exit = sampling.pop('early_exit', None)
+        self.early_exit_chunk = sampling.pop('early_exit_chunk', 4)
+        self.sampling_stats = SamplingStats()
+        self.sampler = AdaptiveSampler(stats = self.sampling_stats, **sampling) if self.sampling_mode == 'adaptive' else None
+
+        self.snapshot_dir = snapshot_dir
+        self.startup_seconds = {}
+        self._load_models(clip_path, sentence_transformer_path)
+
+        # Normalized text features: one row per violation label followed by the empty prompt
+        start = time.perf_counter()
+        self.clip_path = clip_path
+        self.text_features = self._cached_embeddings("clip_text", clip_path, self._compute_text_features)
+
+        # Normalized category embeddings, one row per ad category
+        self.sentence_transformer_path = sentence_transformer_path
+        self.category_embeddings = self._cached_embeddings("categories", sentence_transformer_path, self._compute_category_embeddings)
+        self.startup_seconds["embeddings"] = time.perf_counter() - start
+        self.description_cache = LRUCache(maxsize=description_cache_size)
+
+        self.result_cache = result_cache or ResultCache(os.path.join(self.cache_dir, "results"))
+        self.cache_frame_embeddings = cache_frame_embeddings
+
+        # Near-duplicate ads; see the ad_index section of the config
+        ad_index = self.config.get('ad_index') or {}
+        self.ad_index = None
+        self.ad_index_threshold = ad_index.get('threshold', 0.97)
+        self.ad_index_probe_frames = ad_index.get('probe_frames', 3)
+        if ad_index.get('enabled'):
+            # Embeddings of different encoders or labels are not comparable, so each gets its own index
+            key = cache_key("ad_index", clip_path, self.backend.name, *self.violation_labels)[:16]
+            self.ad_index = AdIndex(os.path.join(self.cache_dir, "ad_index", key), dim = self.text_features.shape[1],
+                                    labels = self.violation_labels, nprobe = ad_index.get('nprobe', 8))
+        self.scheduler = None
+        self.warmed_up = False
+        self._warm_up_lock = threading.Lock()
+
+    def _load_models(self, clip_path: str, sentence_transformer_path: str):
+        """
+        Import the model libraries and load the weights, recording how long each step takes
+
+        The imports happen here rather than at module level so that importing the app stays cheap for code
+        that never loads the models.
+
+        :param clip_path: hub id or path of the CLIP model
+        :param sentence_transformer_path: hub id or path of the sentence transformer
+        """
+        start = time.perf_counter()
+        from transformers import AutoProcessor, CLIPModel, AutoTokenizer
+        from sentence_transformers import SentenceTransformer
+        self.startup_seconds["import"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        model_names = (clip_path, sentence_transformer_path)
+        local_files_only = self.snapshot_dir is not None
+        if local_files_only:
+            clip_path = resolve_model(self.snapshot_dir, clip_path)
+            sentence_transformer_path = resolve_model(self.snapshot_dir, sentence_transformer_path)
+
+        clip_model = CLIPModel.from_pretrained(clip_path, local_files_only = local_files_only).to(self.device).eval()
+        self.clip_processor = AutoProcessor.from_pretrained(clip_path, local_files_only = local_files_only)
+        self.tokenizer = AutoTokenizer.from_pretrained(clip_path, local_files_only = local_files_only)
+
+        sentence_transformer = SentenceTransformer(sentence_transformer_path, device = self.device)
+        self.startup_seconds["load"] = time.perf_counter() - start
+
+        # Quantize or export the encoders for the selected backend
+        start = time.perf_counter()
+        self.backend.prepare(clip_model, sentence_transformer, self.cache_dir, model_names)
+        self.clip_model = self.backend.clip_model
+        self.sentence_transformer = self.backend.sentence_transformer
+        self.startup_seconds["convert"] = time.perf_counter() - start
+
+    def _cached_embeddings(self, kind: str, model_name: str, compute) -> torch.Tensor:
+        """
+        Load embeddings from the on-disk cache, computing and saving them on a miss
 
-        self.sentence_transformer = SentenceTransformer(sentence_transformer_path)
+        :param kind: what the embeddings are for, used in the file name
+        :param model_name: name or path of the model producing the embeddings
+        :param compute: callable returning the embeddings tensor
+        :return: embeddings tensor on self.device
+        """
+        key = hashlib.sha256(f"{model_name}\0{self.backend.name}\0{self.config_hash}".encode()).hexdigest()[:16]
+        path = os.path.join(self.cache_dir, f"{kind}_{key}.pt")
+        if os.path.exists(path):
+            return torch.load(path, map_location=self.device)
+
+        embeddings = compute()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Write then rename so concurrent workers never read a partial file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        torch.save(embeddings.cpu(), tmp_path)
+        os.replace(tmp_path, path)
+        return embeddings
+
+    def _compute_text_features(self) -> torch.Tensor:
+        # The CLIP tokenizer pads with the end-of-text token, so batching every prompt gives the same
+        # pooled features as tokenizing [label, ""] pairs one at a time
+        inputs = self.tokenizer(self.violation_labels + [""], padding=True, return_tensors="pt")
+        inputs = {k: v.to(self.device) for k, v in inputs.items()}
+        text_features = self.backend.text_features(inputs)
+        return F.normalize(text_features, dim=-1)
+
+    def _compute_category_embeddings(self) -> torch.Tensor:
+        return self._description_embeddings(self.ad_categories)
+
+    def _encode_description(self, ad_description: str) -> torch.Tensor:
+        """
+        Normalized embedding of an ad description, served from the LRU cache for resubmitted text
+
+        :param ad_description: description of the ad
+        :return: (dim,) embedding tensor
+        """
+        key = hashlib.sha256(ad_description.encode()).digest()
+        embedding = self.description_cache.get(key)
+        if embedding is None:
+            if self.scheduler is not None:
+                embedding = self.scheduler.description_embedding(ad_description)
+            else:
+                embedding = self._description_embeddings([ad_description])[0]
+            self.description_cache.put(key, embedding)
+        return embedding
+
+    def _description_embeddings(self, texts: list) -> torch.Tensor:
+        return self.backend.description_embeddings(texts)
+
+    def _image_features(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        return self.backend.image_features(pixel_values)
+
+    def warm_up(self):
+        """
+        Run one image and one text inference so lazy initialisation happens before the first request
+
+        Only the first call does any work; calls made while it runs wait for it.
+        """
+        with self._warm_up_lock:
+            if self.warmed_up:
+                return
+            start = time.perf_counter()
+            # Straight through the encoders, so the blank frame is neither counted as an ad nor added to the ad index
+            pixel_values = self.clip_processor(images = [np.zeros((224, 224, 3), dtype=np.uint8)], return_tensors="pt")["pixel_values"]
+            with torch.inference_mode():
+                score_violations(self._image_features(pixel_values), self.text_features)
+            self._description_embeddings(["warm up"])
+            self.startup_seconds["first_inference"] = time.perf_counter() - start
+            self.warmed_up = True
+
+    def enable_batching(self, max_batch_size: int = 64, max_wait_ms: float = 10.0) -> InferenceScheduler:
+        """
+        Route encoder calls through a scheduler that batches them across concurrent requests
+
+        :param max_batch_size: frames / texts per model call (default: 64)
+        :param max_wait_ms: how long a request waits for others to join its batch (default: 10.0)
+        :return: the scheduler, whose stats() reports queue depth, batch sizes and wait times
+        """
+        if self.scheduler is None:
+            self.scheduler = InferenceScheduler(self._image_features, self._description_embeddings,
+                                                max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+        return self.scheduler
 
     def get_results(self, ad_description: str, file_storage: FileStorage, num_frames: int = 10) -> dict:
         
@@ -41,7 +236,7 @@ class ViolationChecker:
         Get the violation labels and ad categories for the video
 
         :param ad_description: description of the ad
-        :param video_path: path to the video file
+        :param file_storage: the file storage
         :param num_frames: number of frames to extract from the video (default: 10)
         :return: dictionary of violation labels and their probabilities
         """
@@ -66,6 +261,50 @@ class ViolationChecker:
             "ad_category": ad_category
         }
 
+    def get_results_batch(self, ad_descriptions: list, file_storages: list, num_frames: int = 10) -> list:
+        """
+        Get the violation labels and ad categories for several videos, embedding the frames of those not cached together
+
+        :param ad_descriptions: description of each ad
+        :param file_storages: video of each ad
+        :param num_frames: number of frames to extract from each video (default: 10)
+        :return: dictionary of violation labels and ad categories for each ad, in the same order, or the exception
+                 raised for an ad whose video could not be scored
+        """
+
+        labels = [None] * len(file_storages)
+        # Videos to embed by cache key, so a video submitted twice is embedded once
+        pending = {}
+        for i, file_storage in enumerate(file_storages):
+            try:
+                if file_storage is None:
+                    raise Exception("Error: No video file.")
+                with ingest_upload(file_storage) as upload:
+                    key = self.violation_cache_key(upload.digest, num_frames)
+                    labels[i] = self.result_cache.get(key)
+                    if labels[i] is None and key not in pending:
+                        with timed("decode"):
+                            frames = self.select_frames(upload.path, num_frames)
+                        if len(frames) == 0:
+                            raise Exception("Error: Could not decode any frames from the video.")
+                        pending[key] = ([], frames)
+                if labels[i] is None:
+                    pending[key][0].append(i)
+            except Exception as e:
+                labels[i] = e
+
+        if pending:
+            computed = self._score_videos([frames for _, frames in pending.values()])
+            for (key, (indices, _)), (out, features) in zip(pending.items(), computed):
+                self._cache_labels(key, out, features)
+                for i in indices:
+                    labels[i] = out
+
+        with timed("categorize"):
+            categories = self.get_ad_categories(ad_descriptions)
+        return [out if isinstance(out, Exception) else {"violation_labels": out, "ad_category": ad_category}
+                for out, ad_category in zip(labels, categories)]
+
     def get_ad_category(self, ad_description: str) -> dict:
         """
         Get the ad category for the ad description
@@ -74,12 +313,22 @@ class ViolationChecker:
         :return: dictionary of ad categories and their probabilities
         """
 
-        input_texts = [ad_description] + self.ad_categories
-        embeddings = self.sentence_transformer.encode(input_texts, convert_to_tensor=True, normalize_embeddings=True)
-        query = embeddings[0]
-        categories = embeddings[1:]
-        cos_sim = F.cosine_similarity(query, categories)
-        return dict(zip(self.ad_categories, cos_sim.tolist()))
+        with timed("categorize"):
+            return self._get_ad_category(ad_description)
+
+    def _get_ad_category(self, ad_description: str) -> dict:
+        description_hash = hashlib.sha256(ad_description.encode()).hexdigest()
+        key = cache_key("ad_category", description_hash, self.sentence_transformer_path, self.backend.name, self.config_hash)
+        cached = self.result_cache.get(key)
+        if cached is not None:
+            return cached
+
+        query = self._encode_description(ad_description)
+        with torch.inference_mode():
+            cos_sim = self.category_embeddings @ query.to(self.category_embeddings.device)
+        out = dict(zip(self.ad_categories, cos_sim.tolist()))
+        self.result_cache.put(key, out)
+        return out
 
     def get_violation_labels(self, file_storage: FileStorage, num_frames: int = 10) -> dict:
         """
@@ -90,75 +339,232 @@ class ViolationChecker:
         :return: dictionary of violation labels and their probabilities
         """
 
-        frames = self._extract_frames_from_video(file_storage, num_frames)
+        with ingest_upload(file_storage) as upload:
+            key = self.violation_cache_key(upload.digest, num_frames)
+            cached = self.result_cache.get(key)
+            if cached is not None:
+                return cached
+            with timed("decode"):
+                frames = self.select_frames(upload.path, num_frames)
 
-        img_inputs = self.clip_processor(images = frames, return_tensors="pt")
-        img_inputs = {k: v.to(self.device) for k, v in img_inputs.items()}
-        image_features = self.clip_model.get_image_features(**img_inputs)
+        return self.get_violation_labels_from_frames(frames, key)
 
-        out = {}
-        for label in self.violation_labels:
-            inputs = self.tokenizer([label, ""], padding=True, return_tensors="pt")
-            inputs = {k: v.to(self.device) for k, v in inputs.items()}
-            text_features = self.clip_model.get_text_features(**inputs)
-            indiv = []
-            for im in image_features:
-                cos_sim = F.cosine_similarity(im.unsqueeze(0), text_features) * 100
-                indiv.append(cos_sim.softmax(dim=0)[0].item())
+    def select_frames(self, video_path: str, num_frames: int = 10) -> np.ndarray:
+        """
+        Decode the frames of a video to embed: num_frames evenly spaced frames, or in adaptive sampling mode the
+        AdaptiveSampler's selection
+
+        :param video_path: path to the video file
+        :param num_frames: number of frames in fixed sampling mode (default: 10)
+        :return: (n, height, width, 3) uint8 RGB frames
+        """
+        if self.sampler is not None:
+            return self.sampler.sample(video_path)
+        frames = sample_frames(video_path, num_frames)
+        self.sampling_stats.record_selection(len(frames), len(frames))
+        return frames
+
+    def violation_cache_key(self, video_digest: str, num_frames: int) -> str:
+        """
+        Content address of a video's violation labels
+
+        :param video_digest: sha256 of the video file
+        :param num_frames: number of frames sampled from the video
+        :return: result cache key
+        """
+        return cache_key("violation_labels", video_digest, num_frames, self.clip_path, self.backend.name, self.config_hash)
 
-            highest = max(indiv)
-            out[label] = highest
+    def get_violation_labels_from_frames(self, frames: np.ndarray, key: str = None) -> dict:
+        """
+        Get the violation labels for already decoded frames
+
+        :param frames: (n, height, width, 3) uint8 RGB frames
+        :param key: result cache key to store the labels under, from violation_cache_key (default: not cached)
+        :return: dictionary of violation labels and their probabilities
+        """
+
+        if len(frames) == 0:
+            raise Exception("Error: Could not decode any frames from the video.")
+
+        out, features = self._score_videos([frames])[0]
+        if key is not None:
+            self._cache_labels(key, out, features)
         return out
 
-    def _extract_frames_from_video(self, file_storage: FileStorage, num_frames: int) -> list:
+    def get_violation_labels_batch(self, frame_sets: list) -> list:
         """
-        Extract frames from the video
+        Get the violation labels for several videos, embedding their frames together
 
-        :param file_storage: video file
-        :param num_frames: number of frames to extract from the video
-        :return: list of PIL images
+        :param frame_sets: (n, height, width, 3) uint8 RGB frames of each video
+        :return: dictionary of violation labels and their probabilities for each video, in the same order
         """
-        frames = []
 
-        with tempfile.NamedTemporaryFile(suffix='.mp4') as temp_file:
-            temp_file.write(file_storage.read())
-            video_path = temp_file.name
+        if any(len(frames) == 0 for frames in frame_sets):
+            raise Exception("Error: Could not decode any frames from the video.")
 
-            cap = cv2.VideoCapture(video_path)
-            if not cap.isOpened():
-                raise Exception("Error: Could not open video file.")
-            total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        return [out for out, _ in self._score_videos(frame_sets)]
 
-            frame_interval = int(total_frames / num_frames)
+    def _cache_labels(self, key: str, out: dict, features: torch.Tensor):
+        embeddings = features.cpu().numpy() if self.cache_frame_embeddings else None
+        self.result_cache.put(key, out, embeddings)
 
-            frame_count = 0
-            while True:
-                ret, frame = cap.read()
+    def _embed(self, images: list) -> torch.Tensor:
+        """
+        CLIP image features of frames, at most max_batch_size frames per encoder call
 
-                if (not ret) or (frame is None) or (len(frames) >= num_frames):
+        :param images: (height, width, 3) uint8 RGB frames
+        :return: (frames, dim) image features
+        """
+        size = self.scheduler.images.max_batch_size if self.scheduler is not None else ENCODER_BATCH_SIZE
+        features = []
+        for start in range(0, len(images), size):
+            with timed("preprocess"):
+                pixel_values = self.clip_processor(images = images[start:start + size], return_tensors="pt")["pixel_values"]
+            # With batching enabled this includes the wait for the batch to fill
+            with timed("image_encode"):
+                if self.scheduler is not None:
+                    features.append(self.scheduler.image_features(pixel_values))
+                else:
+                    features.append(self._image_features(pixel_values))
+        return torch.cat(features)
+
+    def _score_videos(self, frame_sets: list) -> list:
+        """
+        Score several videos, embedding the frames every video needs next together in each round
+
+        :param frame_sets: (n, height, width, 3) uint8 RGB frames of each video, none empty
+        :return: (labels, image features of the frames embedded) of each video, in the same order
+        """
+        # Videos of this batch that missed the ad index, so their near-duplicates later in the batch wait for them
+        peers = []
+        scorings = [self._score_frames(frames, peers) for frames in frame_sets]
+        pending = {i: next(scoring) for i, scoring in enumerate(scorings)}
+        results = [None] * len(frame_sets)
+        while pending:
+            chunks = list(pending.items())
+            images = [frame for _, chunk in chunks for frame in chunk]
+            features = self._embed(images) if images else torch.empty(0, self.text_features.shape[1])
+            for (i, _), chunk_features in zip(chunks, torch.split(features, [len(chunk) for _, chunk in chunks])):
+                try:
+                    pending[i] = scorings[i].send(chunk_features)
+                except StopIteration as done:
+                    results[i] = done.value
+                    del pending[i]
+        return results
+
+    def _score_frames(self, frames: np.ndarray, peers: list):
+        """
+        Score one video a chunk of frames at a time
+
+        A generator: it yields the frames to embed next and is sent their image features, until it returns
+        (labels, image features of the frames embedded). Embedding is left to the caller so that the chunks of
+        several videos can go through the encoder together.
+
+        :param frames: (n, height, width, 3) uint8 RGB frames, n > 0
+        :param peers: [pooled probe embedding, labels once scored] of the videos scored alongside this one that
+                      missed the ad index; this video is added to it if it misses too
+        """
+        # With the ad index the probe frames are embedded first and looked up; a near-duplicate of an ad scored
+        # before takes the labels it was given, raised to anything the probe frames score higher, and the other
+        # frames are skipped
+        probe = None
+        if self.ad_index is not None:
+            probe = self._probe_indices(len(frames))
+            frames = frames[np.concatenate([probe, np.setdiff1d(np.arange(len(frames)), probe)])]
+
+        # With early exit the frames are embedded a chunk at a time until a label reaches the threshold; the
+        # labels not yet flagged are then the maximum over the frames embedded so far
+        chunk_size = len(frames) if self.early_exit is None else self.early_exit_chunk
+        first = 0 if probe is None else len(probe)
+        starts = ([0] if first else []) + list(range(first, len(frames), chunk_size))
+        ends = starts[1:] + [len(frames)]
+        scores = None
+        pooled = None
+        match = None
+        entry = None
+        features = []
+        for start, end in zip(starts, ends):
+            image_features = yield frames[start:end]
+            with timed("text_score"), torch.inference_mode():
+                chunk_scores = score_violations(image_features, self.text_features)
+            scores = chunk_scores if scores is None else torch.maximum(scores, chunk_scores)
+            features.append(image_features)
+            if probe is not None and pooled is None:
+                pooled = pool_embeddings(image_features.float().cpu().numpy())
+                with timed("reference_lookup"):
+                    match = self.ad_index.match(pooled, self.ad_index_threshold)
+                if match is None:
+                    # A near-duplicate scored alongside this video reaches the index only once it is done
+                    similarities = [float(peer[0] @ pooled) for peer in peers]
+                    best = int(np.argmax(similarities)) if similarities else None
+                    if best is not None and similarities[best] >= self.ad_index_threshold:
+                        while peers[best][1] is None:
+                            yield frames[:0]
+                        match = (similarities[best], peers[best][1])
+                    else:
+                        entry = [pooled, None]
+                        peers.append(entry)
+                if match is not None:
+                    prior = torch.tensor(list(match[1].values()), dtype=scores.dtype)
+                    scores = torch.maximum(scores, prior)
                     break
+            if self.early_exit is not None and scores.max().item() >= self.early_exit:
+                break
+        self.sampling_stats.record_embedding(len(frames), sum(len(f) for f in features))
+        out = dict(zip(self.violation_labels, scores.tolist()))
+        if entry is not None:
+            self.ad_index.add(pooled, scores.tolist())
+            entry[1] = out
+
+        return out, torch.cat(features)
+
+    def _probe_indices(self, num_frames: int) -> np.ndarray:
+        """Evenly spaced frames that identify a video in the ad index"""
+        return np.unique(np.linspace(0, num_frames - 1, min(self.ad_index_probe_frames, num_frames)).round().astype(int))
+
+    def get_ad_categories(self, ad_descriptions: list) -> list:
+        """
+        Get the ad categories for several ad descriptions with one sentence transformer call
+
+        :param ad_descriptions: descriptions of the ads
+        :return: dictionary of ad categories and their probabilities for each description, in the same order
+        """
+
+        embeddings = self._description_embeddings(ad_descriptions)
+        with torch.inference_mode():
+            cos_sim = embeddings.to(self.category_embeddings.device) @ self.category_embeddings.T
+        return [dict(zip(self.ad_categories, row)) for row in cos_sim.tolist()]
+
+_checker = None
 
-                if frame_count % frame_interval == 0:
-                    pil_frame = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-                    frames.append(pil_frame)
 
-                frame_count += 1
+def get_checker(config_path: str = "violations/config.yaml", **kwargs) -> ViolationChecker:
+    """
+    Get the process-wide violation checker, loading the models on first use
 
-            cap.release()
+    Loading it before forking worker processes lets every worker share the weights copy-on-write.
 
-            return frames
+    :param config_path: path to the config file
+    :param kwargs: further ViolationChecker arguments, used only when the checker is first created
+    :return: the violation checker
+    """
+    global _checker
+    if _checker is None:
+        _checker = ViolationChecker(config_path = config_path, **kwargs)
+    return _checker
 
 
 if __name__ == "__main__":
-    # Example usage
+    # Example usage, from the repo root: python -m violations.violation_checker
     ad_description = """The SAR 21 is a bullpup-style assault rifle designed and manufactured in Singapore. 
 It features a selective-fire system with options for semi-automatic and automatic firing modes, a 5.56x45mm NATO caliber, 
 a detachable magazine, and a built-in optical scope for improved accuracy. Known for its reliability and ergonomic design,
 the SAR 21 is utilized by the Singapore Armed Forces and other military and law enforcement units worldwide.
 """
 
-    checker = ViolationChecker(config_path = 'config.yaml')
-    out = checker.get_results(ad_description = ad_description, video_path = "test.mp4")
+    checker = ViolationChecker(config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.yaml'))
+    with open("test.mp4", "rb") as f:
+        out = checker.get_results(ad_description = ad_description, file_storage = FileStorage(f, filename = "test.mp4"))
 
 
     print(out)